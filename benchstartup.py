@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+
+#=======================================================================================
+# Imports
+#=======================================================================================
+
+import os
+import sys
+import shutil
+import argparse
+import timeit
+import tempfile
+import importlib
+import statistics
+import subprocess
+
+#=======================================================================================
+# Configuration
+#=======================================================================================
+
+execDirPath = os.path.realpath(os.path.dirname(sys.argv[0]))
+# What the entry points import on startup; the capplib is what a typical capp config pulls in.
+defaultModuleNames = ["lib.capps", "plugins.capplibs.capplib_dash"]
+# Whose ConfigSetups '--configsetups' constructs.
+defaultCappLibModuleName = "plugins.capplibs.capplib_dash"
+
+#=======================================================================================
+# Library
+#=======================================================================================
+
+#==========================================================
+class ImportTimes(object):
+	
+	#=============================
+	"""The '-X importtime' breakdown of one interpreter run importing one module.
+	Times are in microseconds, keyed by module name."""
+	#=============================
+	
+	def __init__(self, moduleName, pycachePrefix):
+		self.moduleName = moduleName
+		environment = dict(os.environ, PYTHONPYCACHEPREFIX=pycachePrefix)
+		environment.pop("PYTHONDONTWRITEBYTECODE", None) # The warm runs need the cold one's bytecode.
+		process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {moduleName}".format(\
+			moduleName=moduleName)], cwd=execDirPath, env=environment, capture_output=True, text=True)
+		if not process.returncode == 0:
+			raise RuntimeError("Importing {moduleName} failed:\n{stderr}".format(moduleName=moduleName,\
+				stderr=process.stderr))
+		self.selfTimes = {}
+		self.cumulativeTimes = {}
+		for line in process.stderr.splitlines():
+			if not line.startswith("import time:") or "self [us]" in line:
+				continue
+			selfTime, cumulativeTime, name = line[len("import time:"):].split("|")
+			self.selfTimes[name.strip()] = int(selfTime)
+			self.cumulativeTimes[name.strip()] = int(cumulativeTime)
+	
+	@property
+	def total(self):
+		return self.cumulativeTimes[self.moduleName]
+
+#==========================================================
+class StartupBenchmark(object):
+	
+	#=============================
+	"""Measures the import time of a module, cold (no bytecode cache, so everything gets compiled)
+	and warm (bytecode cache in place), over a number of runs in fresh interpreters."""
+	#=============================
+	
+	def __init__(self, moduleName, runs):
+		self.moduleName = moduleName
+		self.cold = []
+		self.warm = []
+		for run in range(0, runs):
+			pycachePrefix = tempfile.mkdtemp(prefix="cappman-bench-")
+			try:
+				self.cold.append(ImportTimes(moduleName, pycachePrefix))
+				self.warm.append(ImportTimes(moduleName, pycachePrefix))
+			finally:
+				shutil.rmtree(pycachePrefix)
+	
+	def median(self, importTimesList):
+		return statistics.median([importTimes.total for importTimes in importTimesList])/1000
+	
+	def breakdown(self, importTimesList, count):
+		"""The 'count' modules with the highest median self time, as (name, milliseconds) tuples.
+		Only modules imported in every run are considered."""
+		names = set.intersection(*[set(importTimes.selfTimes) for importTimes in importTimesList])
+		medians = [(name, statistics.median([importTimes.selfTimes[name] for importTimes in importTimesList])/1000)\
+			for name in names]
+		return sorted(medians, key=lambda nameAndTime: nameAndTime[1], reverse=True)[:count]
+	
+	def report(self, count):
+		lines = ["{moduleName}: cold {cold:.1f} ms, warm {warm:.1f} ms (median of {runs} runs)".format(\
+			moduleName=self.moduleName, cold=self.median(self.cold), warm=self.median(self.warm), runs=len(self.warm))]
+		for label, importTimesList in [("cold", self.cold), ("warm", self.warm)]:
+			lines.append("  Top self times ({label}):".format(label=label))
+			for name, milliseconds in self.breakdown(importTimesList, count):
+				lines.append("    {milliseconds:7.2f} ms  {name}".format(milliseconds=milliseconds, name=name))
+		return "\n".join(lines)
+
+#==========================================================
+class ConfigSetupBenchmark(object):
+	
+	#=============================
+	"""Measures how long it takes to construct a capplib's ConfigSetups (and with them, all their
+	ConfigOptions), which happens for every capp and flavor that's loaded."""
+	#=============================
+	
+	def __init__(self, moduleName, rounds, repeats=5):
+		self.moduleName = moduleName
+		self.rounds = rounds
+		sys.path.insert(0, execDirPath)
+		module = importlib.import_module(moduleName)
+		self.times = {}
+		for configSetupClass in [module.FlavorConfigSetup, module.CappConfigSetup]:
+			self.times[configSetupClass.__name__] = min(timeit.repeat(configSetupClass, number=rounds, repeat=repeats))
+	
+	def report(self):
+		lines = ["{moduleName}: ConfigSetup construction (best of {rounds} rounds)".format(\
+			moduleName=self.moduleName, rounds=self.rounds)]
+		for name, seconds in self.times.items():
+			lines.append("    {microseconds:9.1f} us  {name}".format(microseconds=seconds/self.rounds*1000000, name=name))
+		return "\n".join(lines)
+
+#=======================================================================================
+# Action
+#=======================================================================================
+
+if __name__ == "__main__":
+	argParser = argparse.ArgumentParser(description="Measure the startup (import) time of cappman's modules.")
+	argParser.add_argument("moduleNames", nargs="*", default=defaultModuleNames, metavar="MODULE")
+	argParser.add_argument("--runs", type=int, default=5)
+	argParser.add_argument("--top", type=int, default=10, help="How many modules to list in the breakdown.")
+	argParser.add_argument("--budget", type=float, default=None, metavar="MS",\
+		help="Exit with an error if a module's median warm import time exceeds this.")
+	argParser.add_argument("--configsetups", type=int, default=0, metavar="ROUNDS",\
+		help="Also time constructing the ConfigSetups of {moduleName} this many times.".format(\
+		moduleName=defaultCappLibModuleName))
+	args = argParser.parse_args()
+	overBudget = False
+	for moduleName in args.moduleNames:
+		benchmark = StartupBenchmark(moduleName, args.runs)
+		print(benchmark.report(args.top))
+		if not args.budget is None and benchmark.median(benchmark.warm) > args.budget:
+			print("  Over budget: {budget:.1f} ms".format(budget=args.budget))
+			overBudget = True
+	if args.configsetups > 0:
+		print(ConfigSetupBenchmark(defaultCappLibModuleName, args.configsetups).report())
+	sys.exit(1 if overBudget else 0)
@@ -7,11 +7,12 @@
 
 import os
 import sys
-import argparse
-import importlib
-import shutil
-from subprocess import Popen, PIPE
+import time
+import threading
+import collections
 from lib.localization import Lang
+# Heavier modules (subprocess, asyncio, shutil) are imported where they're used, as most runs
+# don't need all of them and everything importing us would pay for them on startup.
 
 #=======================================================================================
 # Localization
@@ -28,15 +29,28 @@ _ = Lang( "cappbaselib", autodetect=False).gettext
 #==========================================================
 
 #==========================================================
-class Namespace (argparse.Namespace):
+class Namespace(object):
 	
 	#=============================
 	"""Pure namespace class.
 	Basically serves as a dot-notation oriented dict.
-	In its current implementation, this is a simple subclass of 'argparse.Namespace'"""
+	Behaves like 'argparse.Namespace', without having to import argparse for it."""
 	#=============================
 
-	pass
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+	def __eq__(self, other):
+		if not isinstance(other, Namespace):
+			return NotImplemented
+		return vars(self) == vars(other)
+
+	def __contains__(self, key):
+		return key in self.__dict__
+
+	def __repr__(self):
+		return "{className}({attributes})".format(className=type(self).__name__,\
+			attributes=", ".join(["{key}={value!r}".format(key=key, value=value) for key, value in self.__dict__.items()]))
 
 #==========================================================
 class FormattedNamespace(object):
@@ -260,31 +274,176 @@ class Actions(object):
 	def perform(self, actionName):
 		"""Perform the action specified by its name, if found in the ledger."""
 		#Should perhaps raise an error if it can't find a match.
-		self.ledger[actionName].perform()
+		return self.ledger[actionName].perform()
+
+#==========================================================
+class PathResolution(object):
+	
+	#=============================
+	"""What a path, or the name of an executable available through $PATH, resolved to.
+	'resolvedPath' is 'None' if it doesn't exist. 'stampPath' is what has to stay unchanged
+	(judged by its mtime, 'stamp') for the resolution to remain valid."""
+	#=============================
+	
+	__slots__ = ("path", "resolvedPath", "stampPath", "stamp")
+	
+	def __init__(self, path, resolvedPath, stampPath, stamp):
+		self.path = path
+		self.resolvedPath = resolvedPath
+		self.stampPath = stampPath
+		self.stamp = stamp
+	
+	@property
+	def exists(self):
+		return not self.resolvedPath is None
+
+#==========================================================
+class PathResolutionCache(object):
+	
+	#=============================
+	"""Resolves paths and executable names, remembering the results.
+	Looking up an executable walks all of $PATH, and a fleet of capps tends to point at the same
+	handful of executables and dirs, so each one is only resolved once. By default, a resolution
+	is revalidated with a single stat of what it resolved to (or of the parent dir of a path that
+	didn't exist) on every use; with 'revalidate=False', resolutions are kept for the lifetime
+	of the cache."""
+	#=============================
+	
+	# Defaults
+	defaultMaxWorkers = 8
+	
+	def __init__(self, revalidate=True):
+		self.revalidate = revalidate
+		self.resolutions = {}
+	
+	def stampOf(self, path):
+		try:
+			return os.stat(path).st_mtime_ns
+		except OSError:
+			return None
+	
+	def resolveUncached(self, path):
+		if os.path.exists(path):
+			resolvedPath = path
+		else:
+			import shutil
+			resolvedPath = shutil.which(path)
+		if not resolvedPath is None:
+			stampPath = resolvedPath
+		elif os.sep in path:
+			stampPath = os.path.dirname(os.path.abspath(path))
+		else:
+			stampPath = None # An executable name not found in $PATH; there's nothing to stat.
+		return PathResolution(path, resolvedPath, stampPath, None if stampPath is None else self.stampOf(stampPath))
+	
+	def isValid(self, resolution):
+		if not self.revalidate:
+			return True
+		if resolution.stampPath is None:
+			return False
+		return self.stampOf(resolution.stampPath) == resolution.stamp
+	
+	def cached(self, path):
+		"""The cached resolution of 'path' if it's still valid, 'None' otherwise."""
+		resolution = self.resolutions.get(path)
+		if resolution is None or not self.isValid(resolution):
+			return None
+		return resolution
+	
+	def resolve(self, path):
+		"""Return the 'PathResolution' for 'path'."""
+		resolution = self.cached(path)
+		if resolution is None:
+			resolution = self.resolutions[path] = self.resolveUncached(path)
+		return resolution
+	
+	def resolveAll(self, paths, maxWorkers=defaultMaxWorkers):
+		"""Return a dict of the 'PathResolution' of each of 'paths'. Every distinct path is only
+		resolved once; those that aren't cached are resolved concurrently."""
+		resolutions = {}
+		uncachedPaths = []
+		for path in paths:
+			if path in resolutions or path in uncachedPaths:
+				continue
+			resolution = self.cached(path)
+			if resolution is None:
+				uncachedPaths.append(path)
+			else:
+				resolutions[path] = resolution
+		if maxWorkers <= 1 or len(uncachedPaths) <= 1:
+			for path in uncachedPaths:
+				resolutions[path] = self.resolutions[path] = self.resolveUncached(path)
+			return resolutions
+		import concurrent.futures
+		with concurrent.futures.ThreadPoolExecutor(max_workers=min(maxWorkers, len(uncachedPaths))) as executor:
+			for resolution in executor.map(self.resolveUncached, uncachedPaths):
+				resolutions[resolution.path] = self.resolutions[resolution.path] = resolution
+		return resolutions
+	
+	def clear(self):
+		self.resolutions = {}
 
 #==========================================================
 class BatchPathExistenceCheckPath(object):
 	
 	#=============================
-	"""Pairs a path with an existence-check and an error message to use if it doesn't exist."""
+	"""Pairs a path with an existence-check and an error message to use if it doesn't exist.
+	'owner' is whatever the path belongs to (e.g. a capp), for checks spanning several owners."""
 	#=============================
 	
-	def __init__(self, path, errorMessage):
+	def __init__(self, path, errorMessage, owner=None):
 		self.path = path
 		self.errorMessage = errorMessage
+		self.owner = owner
+		self.resolution = None
 
 	def exists(self):
 		"""Checks whether the path exists; returns 'True' if it does, 'False' if it doesn't.
 		This also considers executable availability through $PATH, in case the specified
 		'path' is not actually a path per se, but the name of an executable available through
 		$PATH."""
-		if os.path.exists(self.path):
-			return True
+		if self.resolution is None:
+			self.resolution = BatchPathExistenceCheck.resolutionCache.resolve(self.path)
+		return self.resolution.exists
+
+#==========================================================
+class PathCheckReport(object):
+	
+	#=============================
+	"""The outcome of a 'BatchPathExistenceCheck': every checked 'BatchPathExistenceCheckPath',
+	each with its 'resolution'."""
+	#=============================
+	
+	def __init__(self, checkedPaths):
+		self.checkedPaths = checkedPaths
+	
+	@property
+	def missing(self):
+		"""The checked paths that don't exist."""
+		return [checkedPath for checkedPath in self.checkedPaths if not checkedPath.exists()]
+	
+	@property
+	def ok(self):
+		return len(self.missing) == 0
+	
+	def forOwner(self, owner):
+		"""A report on only the paths belonging to 'owner'."""
+		return PathCheckReport([checkedPath for checkedPath in self.checkedPaths if checkedPath.owner is owner])
+	
+	@property
+	def errorMessage(self):
+		return "\n".join([checkedPath.errorMessage for checkedPath in self.missing])
+	
+	def raiseError(self):
+		missingCount = len(self.missing)
+		if missingCount == 0:
+			raise PathNotFoundError("Error: No non-existent paths found, but error was raised anyway.")
+		elif missingCount == 1:
+			raise PathNotFoundError("Error: The following path doesn't exist:\n{errorMessage}".format(\
+				errorMessage=self.errorMessage))
 		else:
-			if shutil.which(self.path):
-				return True
-			else:
-				return False
+			raise PathNotFoundError("Error: The following paths don't exist:\n{errorMessage}".format(\
+				errorMessage=self.errorMessage))
 
 #==========================================================
 class BatchPathExistenceCheck(object):
@@ -292,42 +451,43 @@ class BatchPathExistenceCheck(object):
 	#=============================
 	"""Takes path+errorMessage pairs and checks whether they exist, with an optional error raised.
 	Raising the optional error is the default behaviour and needs to be disabled if
-	that is undesired."""
+	that is undesired. Identical paths are only checked once per batch, and resolutions are
+	shared process-wide through 'resolutionCache'."""
 	#=============================
 	
+	resolutionCache = PathResolutionCache()
+	
 	def __init__(self):
 		self.paths = []
-		self.batchErrorMessage = ""
-		self.nonExistentPathCount = 0
+		self.report = None
 	
-	def addPath(self, path, errorMessage):
-		self.paths.append(BatchPathExistenceCheckPath(path, errorMessage))
+	def addPath(self, path, errorMessage, owner=None):
+		self.paths.append(BatchPathExistenceCheckPath(path, errorMessage, owner=owner))
 	
-	def checkAll(self, autoRaiseError=True):
+	def checkAll(self, autoRaiseError=True, maxWorkers=PathResolutionCache.defaultMaxWorkers):
+		"""Check all paths and return a 'PathCheckReport'."""
+		resolutions = self.__class__.resolutionCache.resolveAll([path.path for path in self.paths], maxWorkers=maxWorkers)
 		for path in self.paths:
-			if not path.exists():
-				self.nonExistentPathCount += 1
-				self.batchErrorMessage\
-					= "{batchErrorMessage}\n{errorMessage}".format(\
-					batchErrorMessage=self.batchErrorMessage, errorMessage=path.errorMessage)
+			path.resolution = resolutions[path.path]
+		self.report = PathCheckReport(self.paths)
 		if autoRaiseError:
 			self.raiseErrorIfNonExistentPathFound()
+		return self.report
+	
+	@property
+	def nonExistentPathCount(self):
+		return 0 if self.report is None else len(self.report.missing)
+	
+	@property
+	def batchErrorMessage(self):
+		return "" if self.report is None else self.report.errorMessage
 	
 	def raiseErrorIfNonExistentPathFound(self):
 		if self.nonExistentPathCount > 0:
 			self.raiseError()
 	
 	def raiseError(self):
-		if self.batchErrorMessage == "":
-			raise PathNotFoundError("Error: No non-existent paths found, but error was raised anyway.")
-		elif self.nonExistentPathCount == 1:
-			raise PathNotFoundError(\
-				"Error: The following path doesn't exist:{batchErrorMessage}".format(\
-					batchErrorMessage=self.batchErrorMessage))
-		elif self.nonExistentPathCount > 1:
-			raise PathNotFoundError(\
-				"Error: The following paths don't exist:{batchErrorMessage}".format(\
-					batchErrorMessage=self.batchErrorMessage))
+		PathCheckReport(self.paths).raiseError()
 
 #==========================================================
 class BaseFile(object):
@@ -373,6 +533,20 @@ class File(BaseFile):
 		with open(self.path, "w") as fileHandler:
 			fileHandler.write(data)
 
+	def writeAtomically(self, data):
+		"""Write to a temporary file next to the file first, which then replaces it, so concurrent
+		readers see either the old content or the new, never half of it."""
+		import tempfile
+		fileDescriptor, tempFilePath = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+		try:
+			with os.fdopen(fileDescriptor, "w") as fileHandler:
+				fileHandler.write(data)
+			os.replace(tempFilePath, self.path)
+		except BaseException:
+			if os.path.exists(tempFilePath):
+				os.remove(tempFilePath)
+			raise
+
 	def read(self):
 		with open(self.path, "r") as fileHandler:
 			return fileHandler.read()
@@ -386,13 +560,629 @@ class File(BaseFile):
 	def makeDirs(self):
 		os.makedirs(self.__dirPath)
 
+#==========================================================
+class PidFile(BaseFile):
+	
+	#=============================
+	"""A file containing the pid of a running process, as daemons write them."""
+	#=============================
+	
+	def read(self):
+		"""The pid in the file, or 'None' if there's no (valid) pid file."""
+		try:
+			with open(self.path, "r") as pidFile:
+				return int(pidFile.read().strip())
+		except (OSError, ValueError):
+			return None
+
+#==========================================================
+class LockFile(BaseFile):
+	
+	#=============================
+	"""A file another process holds a POSIX (fcntl) lock on while it's running, like the '.lock'
+	file daemons keep in their datadir."""
+	#=============================
+	
+	@property
+	def held(self):
+		"""Whether some process holds a lock on the file. Checked by trying to take a shared lock
+		ourselves, which doesn't block and is released right away. That conflicts with the exclusive
+		lock a daemon holds, and only takes read access, so other users' lock files can be checked too.
+		A lock file we can't even read is taken to be held, as there's no telling."""
+		import fcntl
+		try:
+			fileDescriptor = os.open(self.path, os.O_RDONLY)
+		except FileNotFoundError:
+			return False
+		except PermissionError:
+			return True
+		try:
+			fcntl.lockf(fileDescriptor, fcntl.LOCK_SH | fcntl.LOCK_NB)
+		except OSError:
+			return True
+		finally:
+			os.close(fileDescriptor) # Closing releases the lock, if we got it.
+		return False
+
+#==========================================================
+class TrashDir(BaseFile):
+	
+	#=============================
+	"""A dir things are moved into to be deleted later (see 'TrashReaper'), instead of right away.
+	Moving is a rename, which is instant however big the thing moved is, and atomic; that's why the
+	trash dir has to be on the same filesystem as what's moved into it, e.g. in the same datadir.
+	Each 'move' gets a batch dir of its own in the trash dir, so names from different moves don't clash."""
+	#=============================
+	
+	def move(self, paths):
+		"""Move those of 'paths' that exist into a new batch dir and return its path."""
+		batchDirPath = os.path.join(self.path, "{time}-{pid}".format(time=time.time_ns(), pid=os.getpid()))
+		os.makedirs(batchDirPath)
+		for path in paths:
+			try:
+				os.rename(path, os.path.join(batchDirPath, os.path.basename(path)))
+			except FileNotFoundError:
+				pass
+		return batchDirPath
+	
+	@property
+	def batchDirPaths(self):
+		"""The batch dirs in the trash, including any left over by a reaper that didn't get to finish."""
+		try:
+			return sorted([dirEntry.path for dirEntry in os.scandir(self.path) if dirEntry.is_dir(follow_symlinks=False)])
+		except FileNotFoundError:
+			return []
+
+#==========================================================
+class TrashReaper(object):
+	
+	#=============================
+	"""Empties trash dirs (see 'TrashDir') in a background thread, freeing no more than 'rate' bytes
+	per second ('None' for no limit), so the deletion of a multi-gigabyte datadir doesn't hog the
+	disk other daemons on the host are using. Big files are truncated chunk by chunk before they're
+	unlinked, as the filesystem frees their blocks as they go and a single unlink would free all
+	of them at once. One reaper is shared per process ('shared'), so the rate holds however many
+	trash dirs there are. The thread ends when there's nothing left to do. It's a daemon thread,
+	so a process exiting doesn't wait for it; what's left in the trash is picked up again the next
+	time its trash dir is added, by whatever process that is."""
+	#=============================
+	
+	# Defaults
+	defaultRate = 64*1024*1024
+	chunkSize = 16*1024*1024
+	
+	sharedReaper = None
+	sharedReaperLock = threading.Lock()
+	
+	def __init__(self, rate=defaultRate, sleep=time.sleep):
+		self.rate = rate
+		self.sleep = sleep
+		self.queue = collections.deque()
+		self.errors = []
+		self.bytesFreed = 0
+		self._lock = threading.Lock()
+		self._idle = threading.Event()
+		self._idle.set()
+		self._thread = None
+		self._budgetStart = None
+		self._budgetBytes = 0
+	
+	@classmethod
+	def shared(cls):
+		with cls.sharedReaperLock:
+			if cls.sharedReaper is None:
+				cls.sharedReaper = cls()
+			return cls.sharedReaper
+	
+	def add(self, trashDirPath):
+		"""Have everything in the trash dir deleted in the background."""
+		with self._lock:
+			if not trashDirPath in self.queue:
+				self.queue.append(trashDirPath)
+			self._idle.clear()
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self.run, name="TrashReaper", daemon=True)
+				self._thread.start()
+	
+	def wait(self, timeout=None):
+		"""Wait until there's nothing left to delete; 'False' if 'timeout' seconds passed first."""
+		return self._idle.wait(timeout)
+	
+	def run(self):
+		# Batches that couldn't be deleted completely (see 'errors') aren't tried again and again.
+		reapedPaths = set()
+		pendingPaths = lambda trashDirPath: [batchDirPath for batchDirPath\
+			in TrashDir(trashDirPath).batchDirPaths if not batchDirPath in reapedPaths]
+		while True:
+			with self._lock:
+				if len(self.queue) == 0:
+					self._thread = None
+					self._budgetStart = None
+					self._idle.set()
+					return
+				trashDirPath = self.queue[0]
+			for batchDirPath in pendingPaths(trashDirPath):
+				self.reap(batchDirPath)
+				reapedPaths.add(batchDirPath)
+			# More may have been moved into the trash dir in the meantime, which 'add' doesn't queue
+			# again as long as it's still queued.
+			with self._lock:
+				if len(pendingPaths(trashDirPath)) == 0:
+					self.queue.popleft()
+	
+	def reap(self, path):
+		"""Delete 'path' and everything in it, at the configured rate."""
+		for dirPath, dirNames, fileNames in os.walk(path, topdown=False):
+			for fileName in fileNames:
+				self.reapFile(os.path.join(dirPath, fileName))
+			for dirName in dirNames:
+				subDirPath = os.path.join(dirPath, dirName)
+				try:
+					if os.path.islink(subDirPath):
+						os.unlink(subDirPath)
+					else:
+						os.rmdir(subDirPath)
+				except OSError as error:
+					self.errors.append(error)
+		try:
+			os.rmdir(path)
+		except OSError as error:
+			self.errors.append(error)
+	
+	def reapFile(self, filePath):
+		import stat
+		try:
+			fileStat = os.lstat(filePath)
+			# The data of files with other hard links stays around when this one is unlinked.
+			size = fileStat.st_size if stat.S_ISREG(fileStat.st_mode) and fileStat.st_nlink == 1 else 0
+			while size > self.__class__.chunkSize:
+				size -= self.__class__.chunkSize
+				os.truncate(filePath, size)
+				self.throttle(self.__class__.chunkSize)
+			os.unlink(filePath)
+			self.throttle(size)
+		except OSError as error:
+			self.errors.append(error)
+	
+	def throttle(self, byteCount):
+		"""Account for 'byteCount' freed bytes and sleep for as long as it takes to get back under the rate."""
+		self.bytesFreed += byteCount
+		if self.rate is None:
+			return
+		now = time.monotonic()
+		if self._budgetStart is None:
+			self._budgetStart = now
+			self._budgetBytes = 0
+		self._budgetBytes += byteCount
+		ahead = self._budgetBytes/self.rate-(now-self._budgetStart)
+		if ahead > 0:
+			self.sleep(ahead)
+
+#==========================================================
+class FileCloner(object):
+	
+	#=============================
+	"""Clones files as cheaply as the filesystem allows: as reflinks (copy-on-write clones that share
+	their data until either of them is written to; btrfs, XFS and the like), as hard links if the
+	file is 'immutable', i.e. never going to be written to again, or else by copying.
+	Whether a filesystem supports reflinks is found out once, with the first file cloned on it.
+	'clone' is thread safe, so many files can be cloned at once."""
+	#=============================
+	
+	# Methods
+	REFLINK = "reflink"
+	HARDLINK = "hardlink"
+	COPY = "copy"
+	
+	# The Linux FICLONE ioctl.
+	ficlone = 0x40049409
+	
+	def __init__(self, reflinks=True, hardlinks=True):
+		self.reflinks = reflinks
+		self.hardlinks = hardlinks
+		self.reflinkSupport = {} # st_dev of the target's dir: bool
+	
+	def reflink(self, sourcePath, targetPath):
+		"""Try to clone 'sourcePath' to 'targetPath' as a reflink; 'False' if the filesystem won't."""
+		import fcntl
+		import errno
+		with open(sourcePath, "rb") as sourceFile, open(targetPath, "wb") as targetFile:
+			try:
+				fcntl.ioctl(targetFile.fileno(), self.__class__.ficlone, sourceFile.fileno())
+				return True
+			except OSError as error:
+				if not error.errno in [errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS]:
+					raise
+		os.remove(targetPath)
+		return False
+	
+	def clone(self, sourcePath, targetPath, immutable=False, copy=True):
+		"""Clone a file and return the method used (one of 'REFLINK', 'HARDLINK', 'COPY').
+		If 'copy' is 'False', returns 'None' instead of copying the file."""
+		import shutil
+		if self.reflinks:
+			device = os.stat(os.path.dirname(os.path.abspath(targetPath))).st_dev
+			if self.reflinkSupport.get(device, True):
+				supported = self.reflink(sourcePath, targetPath)
+				self.reflinkSupport[device] = supported
+				if supported:
+					shutil.copystat(sourcePath, targetPath)
+					return self.__class__.REFLINK
+		if immutable and self.hardlinks:
+			try:
+				os.link(sourcePath, targetPath)
+				return self.__class__.HARDLINK
+			except OSError:
+				pass # Different filesystems, too many links, ...; copying works regardless.
+		if not copy:
+			return None
+		shutil.copy2(sourcePath, targetPath)
+		return self.__class__.COPY
+
+#==========================================================
+class FileDeduplicator(object):
+	
+	#=============================
+	"""Finds identical files among those it's given and replaces all but one of each set of them with
+	reflinks or hard links to the one (see 'FileCloner'), freeing the space the others took up.
+	Only hand it files that are never written to again, as linked files share their data.
+	Files are compared by size first, and only those that share their size with another file are
+	hashed (sha256 over the mmap'd file; hashing releases the GIL, so 'maxWorkers' files at once).
+	A file that changed between being hashed and being replaced is left alone."""
+	#=============================
+	
+	# Defaults
+	defaultMaxWorkers = 4
+	
+	def __init__(self, maxWorkers=defaultMaxWorkers, fileCloner=None):
+		self.maxWorkers = maxWorkers
+		self.fileCloner = FileCloner() if fileCloner is None else fileCloner
+	
+	@classmethod
+	def hashFile(cls, path):
+		import mmap
+		import hashlib
+		fileHash = hashlib.sha256()
+		with open(path, "rb") as fileHandler:
+			if os.fstat(fileHandler.fileno()).st_size > 0:
+				with mmap.mmap(fileHandler.fileno(), 0, access=mmap.ACCESS_READ) as mappedFile:
+					fileHash.update(mappedFile)
+		return fileHash.hexdigest()
+	
+	@classmethod
+	def statSignature(cls, fileStat):
+		return (fileStat.st_dev, fileStat.st_ino, fileStat.st_size, fileStat.st_mtime_ns)
+	
+	def findDuplicates(self, paths):
+		"""Return lists of paths of identical files, the file to keep first, along with their stats.
+		Paths of the same file (e.g. already hard linked) count as one."""
+		import concurrent.futures
+		stats = {}
+		inodes = set()
+		sizeGroups = {}
+		for path in paths:
+			try:
+				fileStat = os.stat(path)
+			except FileNotFoundError:
+				continue
+			if (fileStat.st_dev, fileStat.st_ino) in inodes:
+				continue
+			inodes.add((fileStat.st_dev, fileStat.st_ino))
+			stats[path] = fileStat
+			# Links can't span filesystems, so only files on the same one are candidates.
+			sizeGroups.setdefault((fileStat.st_dev, fileStat.st_size), []).append(path)
+		hashPaths = [path for group in sizeGroups.values() if len(group) > 1 for path in group]
+		hashGroups = {}
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+			for path, fileHash in zip(hashPaths, executor.map(self.hashFile, hashPaths)):
+				hashGroups.setdefault((stats[path].st_dev, stats[path].st_size, fileHash), []).append(path)
+		duplicates = []
+		for group in hashGroups.values():
+			if len(group) > 1:
+				# Keep the file with the most links already, so the fewest need replacing down the road.
+				group.sort(key=lambda path: -stats[path].st_nlink)
+				duplicates.append(group)
+		return (duplicates, stats)
+	
+	def replace(self, keptPath, duplicatePath, duplicateStat):
+		"""Replace 'duplicatePath' with a link to 'keptPath'; returns the method, or 'None' if it was left alone."""
+		try:
+			if not self.statSignature(os.stat(duplicatePath)) == self.statSignature(duplicateStat):
+				return None
+		except FileNotFoundError:
+			return None
+		import tempfile
+		# The link is made in a dir of its own next to the duplicate, as a hard link needs a name
+		# that's free; a unique one, so nothing an interrupted run left behind gets in the way.
+		temporaryDirPath = tempfile.mkdtemp(prefix=".cappman-dedup-", dir=os.path.dirname(os.path.abspath(duplicatePath)))
+		temporaryPath = os.path.join(temporaryDirPath, os.path.basename(duplicatePath))
+		try:
+			method = self.fileCloner.clone(keptPath, temporaryPath, immutable=True, copy=False)
+			if method is None:
+				return None
+			os.replace(temporaryPath, duplicatePath)
+			return method
+		finally:
+			try:
+				os.remove(temporaryPath)
+			except FileNotFoundError:
+				pass
+			os.rmdir(temporaryDirPath)
+	
+	def run(self, paths, dryRun=False):
+		"""Deduplicate the files and return a report: how many files were 'checked', how many were
+		'replaced' by each method, and the 'bytesReclaimed'. With 'dryRun', nothing is replaced; the
+		report tells what would have been."""
+		duplicates, stats = self.findDuplicates(paths)
+		report = {"checked": len(stats), "replaced": 0, FileCloner.REFLINK: 0, FileCloner.HARDLINK: 0, "bytesReclaimed": 0}
+		for group in duplicates:
+			for duplicatePath in group[1:]:
+				duplicateStat = stats[duplicatePath]
+				if not dryRun:
+					method = self.replace(group[0], duplicatePath, duplicateStat)
+					if method is None:
+						continue
+					report[method] += 1
+				report["replaced"] += 1
+				# Data another link still points to stays where it is.
+				if duplicateStat.st_nlink == 1:
+					report["bytesReclaimed"] += duplicateStat.st_blocks*512
+		return report
+
+#==========================================================
+class PidWatcher(object):
+	
+	#=============================
+	"""Waits for a process that's not necessarily our child (e.g. a daemon that forked off) to exit.
+	Where available (Linux), this waits on a pidfd, which becomes readable as soon as the process
+	exits, without any polling. Elsewhere, the process is checked for with a backoff."""
+	#=============================
+	
+	# Defaults
+	fallbackPollDelays = (0.01, 0.5)
+	
+	def __init__(self, pid):
+		self.pid = pid
+	
+	@property
+	def alive(self):
+		try:
+			os.kill(self.pid, 0)
+		except ProcessLookupError:
+			return False
+		except PermissionError:
+			pass # It exists, it just isn't ours.
+		# An exited process nobody has reaped yet (a zombie) still takes signals; it's gone all the same.
+		try:
+			with open("/proc/{pid}/stat".format(pid=self.pid), "r") as statFile:
+				return not statFile.read().rpartition(")")[2].split()[0] == "Z"
+		except (OSError, IndexError):
+			return True
+	
+	def openPidFd(self):
+		"""A pidfd for the process, 'None' if pidfds aren't supported. Raises 'ProcessLookupError' if it's gone."""
+		if not hasattr(os, "pidfd_open"):
+			return None
+		try:
+			return os.pidfd_open(self.pid)
+		except OSError as error:
+			if isinstance(error, ProcessLookupError):
+				raise
+			return None # E.g. a kernel that's too old.
+	
+	def wait(self, timeout=None):
+		"""Return 'True' once the process has exited, or 'False' if 'timeout' (seconds) ran out first."""
+		try:
+			pidFd = self.openPidFd()
+		except ProcessLookupError:
+			return True
+		if pidFd is None:
+			return self.waitPolling(timeout)
+		import select
+		try:
+			poll = select.poll()
+			poll.register(pidFd, select.POLLIN)
+			return len(poll.poll(None if timeout is None else int(timeout*1000))) > 0
+		finally:
+			os.close(pidFd)
+	
+	def waitPolling(self, timeout=None):
+		initialDelay, maxDelay = self.__class__.fallbackPollDelays
+		retryPolicy = RetryPolicy(initialDelay=initialDelay, maxDelay=maxDelay, jitter=0,\
+			deadline=float("inf") if timeout is None else timeout)
+		for attempt in retryPolicy.attempts():
+			if not self.alive:
+				return True
+		return False
+
+#==========================================================
+class RetryPolicy(object):
+	
+	#=============================
+	"""When to retry something that failed, and how long to wait in between.
+	The delays grow exponentially from 'initialDelay' by 'multiplier', up to 'maxDelay'. Each one is
+	shortened by a random fraction of up to 'jitter', so many waiters don't retry in lockstep.
+	Nothing is retried past 'deadline' seconds after the first attempt, nor beyond 'maxAttempts'.
+	Whether a failure is worth retrying at all is up to its error code: 'classification' maps codes
+	to 'RETRY' or 'FAIL', codes not in it are classified as 'defaultClassification'."""
+	#=============================
+	
+	# Classifications
+	RETRY = "retry"
+	FAIL = "fail"
+	
+	def __init__(self, initialDelay=0.5, maxDelay=5, multiplier=2, jitter=0.5, deadline=75, maxAttempts=None,\
+		classification={}, defaultClassification=FAIL):
+		self.initialDelay = initialDelay
+		self.maxDelay = maxDelay
+		self.multiplier = multiplier
+		self.jitter = jitter
+		self.deadline = deadline
+		self.maxAttempts = maxAttempts
+		self.classification = dict(classification)
+		self.defaultClassification = defaultClassification
+	
+	def classify(self, code):
+		return self.classification.get(code, self.defaultClassification)
+	
+	def shouldRetry(self, code):
+		return self.classify(code) == self.__class__.RETRY
+	
+	def delay(self, attempt):
+		"""The delay before the retry following the specified attempt (starting at 0)."""
+		import random
+		delay = min(self.maxDelay, self.initialDelay*self.multiplier**attempt)
+		return delay*(1-self.jitter*random.random())
+	
+	def attempts(self, sleep=time.sleep):
+		"""Yield the number of each attempt (starting at 0), sleeping in between, for as long as
+		the policy allows for another one. Meant to be left with 'return' or 'break' on success:
+			for attempt in retryPolicy.attempts():
+				..."""
+		startTime = time.monotonic()
+		attempt = 0
+		while True:
+			yield attempt
+			attempt += 1
+			if not self.maxAttempts is None and attempt >= self.maxAttempts:
+				return
+			remainingTime = self.deadline-(time.monotonic()-startTime)
+			if remainingTime <= 0:
+				return
+			sleep(min(self.delay(attempt-1), remainingTime))
+
+#==========================================================
+class ReadinessProbe(object):
+	
+	#=============================
+	"""Waits for something to become ready (e.g. a daemon to finish warming up) by calling 'probe'
+	according to a 'RetryPolicy'. 'probe' returns whether it's ready yet.
+	However many threads wait at once, only one of them actually probes; the others wait for
+	its outcome. A new probe is only started by callers that come along after the last one ended."""
+	#=============================
+	
+	def __init__(self, probe, retryPolicy):
+		self.probe = probe
+		self.retryPolicy = retryPolicy
+		self._lock = threading.Lock()
+		self._current = None
+	
+	def run(self, retryPolicy):
+		for attempt in retryPolicy.attempts():
+			if self.probe():
+				return True
+		return False
+	
+	def wait(self, retryPolicy=None):
+		"""Return 'True' once ready, or 'False' if the retry policy gave up first.
+		A probe that's already underway goes by the policy it was started with; 'retryPolicy'
+		only applies to one this call starts. Errors raised by 'probe' are raised to every waiter."""
+		with self._lock:
+			current = self._current
+			probing = current is None
+			if probing:
+				current = self._current = Namespace(done=threading.Event(), ready=False, error=None)
+		if probing:
+			try:
+				current.ready = self.run(self.retryPolicy if retryPolicy is None else retryPolicy)
+			except Exception as error:
+				current.error = error
+			finally:
+				with self._lock:
+					self._current = None
+				current.done.set()
+		else:
+			current.done.wait()
+		if not current.error is None:
+			raise current.error
+		return current.ready
+
+#==========================================================
+class TtlCache(object):
+	
+	#=============================
+	"""Caches the results of calls by key for 'ttl' seconds, e.g. the status a daemon reports:
+		blockCount = cache.get(("getblockcount",), lambda: capp.call("getblockcount"))
+	While a call for a key is underway, callers asking for the same key wait for its result instead
+	of making the same call again. Errors aren't cached, but are raised to every caller that waited.
+	'invalidate' drops everything, including results of calls still underway when it's called.
+	The counters tell how well it's doing: 'hits', 'misses' (calls made) and 'coalesced' (callers
+	that waited for a call someone else made)."""
+	#=============================
+	
+	# Defaults
+	defaultTtl = 2
+	
+	def __init__(self, ttl=defaultTtl, clock=time.monotonic):
+		self.ttl = ttl
+		self.clock = clock
+		self.entries = {} # key: (expiry, value)
+		self.inFlight = {}
+		self.generation = 0
+		self.hits = 0
+		self.misses = 0
+		self.coalesced = 0
+		self._lock = threading.Lock()
+	
+	def get(self, key, function, ttl=None):
+		"""The cached result for 'key', or that of calling 'function' (with no arguments) if there's none."""
+		with self._lock:
+			entry = self.entries.get(key)
+			if not entry is None and entry[0] > self.clock():
+				self.hits += 1
+				return entry[1]
+			current = self.inFlight.get(key)
+			calling = current is None
+			if calling:
+				self.misses += 1
+				current = self.inFlight[key] = Namespace(done=threading.Event(), value=None, error=None,\
+					generation=self.generation)
+			else:
+				self.coalesced += 1
+		if calling:
+			try:
+				current.value = function()
+			except BaseException as error:
+				current.error = error
+			finally:
+				with self._lock:
+					if self.inFlight.get(key) is current:
+						del self.inFlight[key]
+					if current.error is None and current.generation == self.generation:
+						self.entries[key] = (self.clock()+(self.ttl if ttl is None else ttl), current.value)
+				current.done.set()
+		else:
+			current.done.wait()
+		if not current.error is None:
+			raise current.error
+		return current.value
+	
+	def invalidate(self):
+		with self._lock:
+			self.entries.clear()
+			self.inFlight.clear()
+			self.generation += 1
+	
+	@property
+	def stats(self):
+		return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "entries": len(self.entries)}
+
 #==========================================================
 class Process(object):
 
 	#=============================
 	"""Represents a system process started by this script.
+	Its output can either be waited for as a whole ('waitAndGetOutput'), or streamed ('iterLines',
+	'iterChunks') for output too big to hold in memory; one or the other.
 	Note: Refrain from calling .communicate() directly on the process from outside of this object."""
 	#=============================
+	
+	# Defaults
+	streamChunkSize = 64*1024
+	stderrTailSize = 64*1024
+	# How long to wait for the rest of stderr after the process exited, in seconds.
+	stderrDrainTimeout = 1
+	maxLineLength = 1024*1024
 
 	def __init__(self, commandLine, run=True):
 		self.commandLine = commandLine
@@ -401,8 +1191,10 @@ class Process(object):
 		self._communicated = False
 		self._stdout = None
 		self._stderr = None
+		self.errorCode = None
 
 	def run(self):
+		from subprocess import Popen, PIPE
 		self.process = Popen(self.commandLine, stdout=PIPE, stderr=PIPE)
 		return self.process
 
@@ -414,6 +1206,152 @@ class Process(object):
 
 	def waitAndGetStdout(self, timeout=None):
 		return self.waitAndGetOutput(timeout)[0]
+	
+	def iterChunks(self, chunkSize=None, timeout=None):
+		
+		#=============================
+		"""Yield stdout in chunks of up to 'chunkSize' bytes as the process writes it, then wait for it
+		to exit. Stderr is read by a thread of its own meanwhile, so the process never gets stuck on a
+		full stderr pipe, not even while the caller is busy with a chunk; only the last
+		'stderrTailSize' bytes of it are kept ('waitAndGetStderr' has them afterwards).
+		If it all takes longer than 'timeout' seconds, the process is killed and
+		'subprocess.TimeoutExpired' raised. Stopping the iteration early kills the process too."""
+		#=============================
+		
+		import selectors
+		import subprocess
+		if self._communicated:
+			raise ValueError("The output of {commandLine} has already been read.".format(commandLine=self.commandLine))
+		chunkSize = self.__class__.streamChunkSize if chunkSize is None else chunkSize
+		deadline = None if timeout is None else time.monotonic()+timeout
+		remaining = lambda: None if deadline is None else max(0, deadline-time.monotonic())
+		stdoutFd = self.process.stdout.fileno()
+		stderrFd = self.process.stderr.fileno()
+		stderrTail = bytearray()
+		def drainStderr():
+			try:
+				while True:
+					data = os.read(stderrFd, chunkSize)
+					if data == b"":
+						return
+					stderrTail.extend(data)
+					del stderrTail[:-self.__class__.stderrTailSize]
+			finally:
+				self.process.stderr.close()
+		stderrThread = threading.Thread(target=drainStderr, name="ProcessStderr", daemon=True)
+		stderrThread.start()
+		selector = selectors.DefaultSelector()
+		selector.register(stdoutFd, selectors.EVENT_READ)
+		timedOut = False
+		try:
+			while True:
+				if remaining() == 0:
+					raise subprocess.TimeoutExpired(self.commandLine, timeout)
+				if len(selector.select(remaining())) == 0:
+					continue
+				data = os.read(stdoutFd, chunkSize)
+				if data == b"":
+					break
+				yield data
+			self.process.wait(timeout=remaining())
+		except subprocess.TimeoutExpired:
+			timedOut = True
+			self.process.kill()
+			self.process.wait()
+			stderrThread.join(self.__class__.stderrDrainTimeout)
+			raise subprocess.TimeoutExpired(self.commandLine, timeout, stderr=bytes(stderrTail)) from None
+		finally:
+			selector.close()
+			if self.process.poll() is None:
+				self.process.kill()
+				self.process.wait()
+			# What the process left in the pipe comes right after it exited, unless a child it left
+			# behind holds on to the pipe; the thread closes it whenever that one's done with it.
+			if not timedOut:
+				stderrThread.join(self.__class__.stderrDrainTimeout)
+			self.process.stdout.close()
+			self._stdout = b""
+			self._stderr = bytes(stderrTail)
+			self._communicated = True
+	
+	def iterLines(self, timeout=None, maxLineLength=None):
+		"""Like 'iterChunks', but yields stdout line by line (newlines included). Lines longer than
+		'maxLineLength' are yielded in parts of that length, so memory use stays bounded regardless."""
+		maxLineLength = self.__class__.maxLineLength if maxLineLength is None else maxLineLength
+		chunks = self.iterChunks(timeout=timeout)
+		buffer = bytearray()
+		try:
+			for chunk in chunks:
+				buffer += chunk
+				start = 0
+				while True:
+					end = buffer.find(b"\n", start)
+					if end == -1:
+						break
+					for partStart in range(start, end+1, maxLineLength):
+						yield bytes(buffer[partStart:min(partStart+maxLineLength, end+1)])
+					start = end+1
+				del buffer[:start]
+				while len(buffer) >= maxLineLength:
+					yield bytes(buffer[:maxLineLength])
+					del buffer[:maxLineLength]
+			if len(buffer) > 0:
+				yield bytes(buffer)
+		finally:
+			chunks.close()
 
 	def waitAndGetStderr(self, timeout=None):
 		return self.waitAndGetOutput(timeout)[1]
+	
+	@classmethod
+	def runRetrying(cls, commandLine, retryPolicy, errorCodeOf):
+		"""Run 'commandLine' and wait for it, rerunning it as long as 'retryPolicy' allows it for the
+		error code 'errorCodeOf(stdout, stderr)' returns ('None' meaning success).
+		Returns the last process; check its 'errorCode' to tell whether the policy gave up."""
+		for attempt in retryPolicy.attempts():
+			process = cls(commandLine)
+			process.errorCode = errorCodeOf(*process.waitAndGetOutput())
+			if process.errorCode is None or not retryPolicy.shouldRetry(process.errorCode):
+				break
+		return process
+
+#==========================================================
+class AsyncProcess(object):
+
+	#=============================
+	"""The asyncio counterpart of 'Process', for driving many processes from one event loop.
+	As a constructor can't await anything, 'run' has to be awaited before the process is used:
+		process = await AsyncProcess(commandLine).run()
+	The waiting methods are coroutines; otherwise this behaves like 'Process', including
+	raising 'subprocess.TimeoutExpired' if a timeout is exceeded."""
+	#=============================
+
+	def __init__(self, commandLine):
+		self.commandLine = commandLine
+		self.process = None
+		self._communicated = False
+		self._stdout = None
+		self._stderr = None
+
+	async def run(self):
+		import asyncio
+		from subprocess import PIPE
+		self.process = await asyncio.create_subprocess_exec(*self.commandLine, stdout=PIPE, stderr=PIPE)
+		return self
+
+	async def waitAndGetOutput(self, timeout=None):
+		import asyncio
+		from subprocess import TimeoutExpired
+		if not self._communicated:
+			try:
+				self._stdout, self._stderr = await asyncio.wait_for(self.process.communicate(), timeout)
+			except asyncio.TimeoutError:
+				raise TimeoutExpired(self.commandLine, timeout)
+			self._communicated = True
+		return (self._stdout, self._stderr)
+
+	async def waitAndGetStdout(self, timeout=None):
+		return (await self.waitAndGetOutput(timeout))[0]
+
+	async def waitAndGetStderr(self, timeout=None):
+		return (await self.waitAndGetOutput(timeout))[1]
@@ -27,6 +27,37 @@ class CappLibError(ErrorWithCodes):
 	codes = ErrorCodes()
 	codes.CONFIG_SETUP_INVALID = 0
 
+#==========================================================
+class CappConnectionError(Error):
+	
+	#=============================
+	"""The capp couldn't reach its daemon, most likely because it isn't running."""
+	#=============================
+	
+	pass
+
+#==========================================================
+class DaemonStuckError(Error):
+	
+	#=============================
+	"""The daemon is running, but doesn't get past a state it's expected to leave eventually."""
+	#=============================
+	
+	pass
+
+#==========================================================
+class DataDirError(ErrorWithCodes):
+	
+	#=============================
+	"""Something can't be done to a datadir in the state it's in."""
+	#=============================
+	
+	codes = ErrorCodes()
+	codes.DAEMON_RUNNING = 0
+	codes.INCOMPATIBLE = 1
+	codes.TARGET_EXISTS = 2
+	codes.SOURCE_EMPTY = 3
+
 #==========================================================
 class BaseFlavorConfigSetup(object):
 	pass
@@ -42,14 +73,14 @@ class BaseCapp(object):
 	# """Base class for capplibs, which takes care of basic initializations universal to all capplibs."""
 	#=============================
 	
-	def __init__(self, configSetup, flavor=Config()):
+	def __init__(self, configSetup, flavor=None):
+		if flavor is None:
+			flavor = Config()
 		# Initialize config.
 		self.configSetup = configSetup
 		try:
 			# [FLAVOR CONFIG DEBUG]: flavor has all the values.
-			print("[DEBUG][capplib.py.BaseCapp] flavor (as given)", flavor)
-			self.config = self.configSetup.getConfig(config=flavor)
-			print("[DEBUG][capplib.py.BaseCapp] self.config", self.config)
+			self.config = self.configSetup.getConfig(configFilePaths=self.configSetup.configFilePaths, config=flavor)
 			# [FLAVOR CONFIG DEBUG]: self.config has all the values.
 			# [FLAVOR CONFIG DEBUG]: But it still triggers the below error.
 		except ConfigOptionUnassignedError as error:
@@ -59,4 +90,21 @@ class BaseCapp(object):
 					CappLibError.codes.CONFIG_SETUP_INVALID) from error
 		# Initialize flavor.
 		self.flavor = flavor
+	
+	def pathChecks(self):
+		"""The (path, errorMessage) tuples of all the paths that have to exist for this capp to work.
+		To be overridden by capplibs."""
+		return []
+	
+	def addPathChecks(self, batchPathExistenceCheck):
+		"""Add this capp's path checks to 'batchPathExistenceCheck', with the capp as their owner."""
+		for path, errorMessage in self.pathChecks():
+			batchPathExistenceCheck.addPath(path, errorMessage, owner=self)
+	
+	def checkPaths(self, autoRaiseError=True):
+		"""Check this capp's paths and return the 'PathCheckReport'."""
+		batchPathExistenceCheck = BatchPathExistenceCheck()
+		self.addPathChecks(batchPathExistenceCheck)
+		# A handful of paths, mostly cached already; not worth a thread pool. See 'Capps.checkPaths' for fleets.
+		return batchPathExistenceCheck.checkAll(autoRaiseError=autoRaiseError, maxWorkers=1)
 	
\ No newline at end of file
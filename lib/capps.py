@@ -5,18 +5,13 @@
 # Imports
 #=======================================================================================
 
-import argparse
+import copy
+import collections
+import threading
 import configparser
 from lib.base import *
 from lib.cappconfig import *
 from lib.plugins import *
-from lib.configutils import PluginDirPaths
-
-#=======================================================================================
-# Configuration
-#=======================================================================================
-
-defaults = Defaults()
 
 #=======================================================================================
 # Library
@@ -31,6 +26,33 @@ class CappLibUnknown(Exception):
 	def __init__(self, message):
 		super().__init__(message)
 
+#==========================================================
+class CappNotFoundError(Error):
+	
+	#=============================
+	"""No capp config matches what was asked for."""
+	#=============================
+	
+	pass
+
+#==========================================================
+class CappLoadError(Error):
+	
+	#=============================
+	"""Loading one or more capps from their config files failed."""
+	#=============================
+	
+	pass
+
+#==========================================================
+class CappCommandUnknownError(Error):
+	
+	#=============================
+	"""A fan-out was asked to run a command it doesn't know (see 'CappFanOut.commands')."""
+	#=============================
+	
+	pass
+
 #==========================================================
 # Capp Classes
 #==========================================================
@@ -45,12 +67,114 @@ class CappFlavor(object):
 	def __init__(self, name):
 		self.name = name
 
+#==========================================================
+class CappResolver(object):
+	
+	#=============================
+	"""Resolves flavors and capplibs by name, each only once for the lifetime of the resolver.
+	A fleet of capps tends to share a handful of flavors and capplibs; instead of reparsing the
+	same flavor file and looking up the same capplib for every capp, the flavor plugins (in both
+	their basic and their full configuration) and the loaded capplib plugins are kept here.
+	Safe to use from several threads; concurrent requests for the same name share one resolution.
+	With 'lazyModules', a capplib's code is only executed once something of it is first used, which
+	usually is when the first capp using it is instantiated."""
+	#=============================
+	
+	def __init__(self, defaults, lazyModules=False):
+		self.defaults = defaults
+		self.lazyModules = lazyModules
+		self.basicFlavorPlugins = {}
+		self.flavorPlugins = {}
+		self.cappLibPlugins = {}
+		self._lock = threading.Lock()
+		self._keyLocks = {}
+		self._index = None
+	
+	@property
+	def index(self):
+		"""The 'PluginIndex' all our plugins are looked up in."""
+		with self._lock:
+			if self._index is None:
+				self._index = PluginIndex.get(self.defaults.pluginDirPaths)
+			return self._index
+	
+	def resolve(self, cache, key, resolveFunction):
+		"""Return 'cache[key]', calling 'resolveFunction(key)' to fill it in if needed.
+		Failed resolutions aren't cached, so they're retried next time."""
+		try:
+			return cache[key]
+		except KeyError:
+			pass
+		with self._lock:
+			keyLock = self._keyLocks.setdefault((id(cache), key), threading.Lock())
+		with keyLock:
+			if not key in cache:
+				cache[key] = resolveFunction(key)
+		return cache[key]
+	
+	def getBasicFlavorPlugin(self, cappFlavorName):
+		"""The flavor plugin, loaded just enough to know which capplib it needs."""
+		def resolveBasicFlavorPlugin(cappFlavorName):
+			cappFlavorPlugin = CappFlavorPlugin(self.defaults.pluginDirPaths, cappFlavorName, index=self.index)
+			cappFlavorPlugin.loadInitial(BasicFlavorConfigSetup())
+			return cappFlavorPlugin
+		return self.resolve(self.basicFlavorPlugins, cappFlavorName, resolveBasicFlavorPlugin)
+	
+	def getCappLibName(self, cappFlavorName):
+		return self.getBasicFlavorPlugin(cappFlavorName).flavor.cappLibName
+	
+	def getCappLibPlugin(self, cappLibName):
+		"""The loaded capplib plugin of the specified name."""
+		def resolveCappLibPlugin(cappLibName):
+			cappLibPlugin = CappLibPlugin(self.index.dirPaths(CappLibPlugin.kind), cappLibName, index=self.index)
+			cappLibPlugin.load(lazy=self.lazyModules)
+			return cappLibPlugin
+		return self.resolve(self.cappLibPlugins, cappLibName, resolveCappLibPlugin)
+	
+	def getFlavorPlugin(self, cappFlavorName):
+		"""The flavor plugin in its full configuration, according to its capplib's 'FlavorConfigSetup'."""
+		def resolveFlavorPlugin(cappFlavorName):
+			basicFlavorPlugin = self.getBasicFlavorPlugin(cappFlavorName)
+			cappLibPlugin = self.getCappLibPlugin(basicFlavorPlugin.flavor.cappLibName)
+			cappFlavorPlugin = CappFlavorPlugin(self.defaults.pluginDirPaths, cappFlavorName, index=self.index)
+			cappFlavorPlugin.config = copy.copy(basicFlavorPlugin.config)
+			cappFlavorPlugin.loadMore(cappLibPlugin.module.FlavorConfigSetup())
+			return cappFlavorPlugin
+		return self.resolve(self.flavorPlugins, cappFlavorName, resolveFlavorPlugin)
+	
+	def getFlavor(self, cappFlavorName):
+		"""A copy of the full flavor config, for one capp to complement with its own config."""
+		return copy.copy(self.getFlavorPlugin(cappFlavorName).flavor)
+
 """So, we need to do this:
 ConfigSetup needs to take initialization parameters such as directories in its constructor. The getConfig
 method needs to be altered subsequently to allow either for overriding these values or complementing them.
 That way, we don't have to worry about initialization and we can simply pass a ConfigSetup object
 to the plugins, being compatible for all sorts of potential initialization procedures, like databases."""
 
+#==========================================================
+class CappLoadResult(object):
+	
+	#=============================
+	"""The outcome of loading one capp config file: either the capp, or the error that occurred."""
+	#=============================
+	
+	def __init__(self, configFilePath, capp=None, error=None):
+		self.configFilePath = configFilePath
+		self.capp = capp
+		self.error = error
+	
+	@property
+	def failed(self):
+		return not self.error is None
+	
+	@property
+	def description(self):
+		if self.failed:
+			return "{configFilePath}: {errorType}: {error}".format(configFilePath=self.configFilePath,\
+				errorType=type(self.error).__name__, error=self.error)
+		return "{configFilePath}: loaded".format(configFilePath=self.configFilePath)
+
 #==========================================================
 class Capps(object):
 	
@@ -67,36 +191,454 @@ class Capps(object):
 	#   I should probably load the flavor file just to get the capplib name and then pass
 	#   it to the capp lib for proper loading.
 	
-	def __init__(self, cappConfigDirPath):
+	# Defaults
+	defaultMaxWorkers = 8
+	# Asking for the status is mostly waiting on daemons, so many can be asked at once.
+	defaultStatusMaxWorkers = 32
+	
+	def __init__(self, cappConfigDirPath, maxWorkers=defaultMaxWorkers, defaults=None, resolver=None):
 		self.cappConfigDirPath = cappConfigDirPath
-	def getAll(self):
-		allCapps = []
-		#print("[DEBUG][capps.py:Capps:getAll]", "called. Going to probe for conf file: ", self.cappConfigDirPath, os.listdir(self.cappConfigDirPath))
-		for configFileName in os.listdir(self.cappConfigDirPath):
-			configFilePath = os.path.join(self.cappConfigDirPath, configFileName)
-			#print("[DEBUG][capphandler.py:Capps:getAll]", "Conf file found.")
-			#print("[DEBUG][capphandler.py:Capps:getAll]", "configFilePath: ", configFilePath)
-			if configFilePath.rpartition(".")[2] == "conf":
-				#print("[DEBUG][capphandler.py:Capps:getAll]", "Conf file name ends with .conf.")
-				basicConfig = BasicCappConfigSetup().getConfig(configFilePaths=[configFilePath])
-				#print("[DEBUG][capphandler.py:Capps:getAll]", "basicConfig anatomy", basicConfig)
-				# Get the basic version of the flavor plugin bootstrapped, just enough to load the capplib.
-				cappFlavorPlugin = CappFlavorPlugin(defaults.pluginDirPaths, basicConfig.cappFlavorName)
-				cappFlavorPlugin.loadInitial(BasicFlavorConfigSetup())
-				# Get the capp plugin.
-				#print("[DEBUG] [capps.py.Capps.getAll]", basicConfig.__dict__, configFilePath)
-				cappLibPlugin = CappLibPlugin(PluginDirPaths(\
-					defaults.pluginDirPaths, defaults.pluginDirNames).cappLibs,\
-					cappFlavorPlugin.flavor.cappLibName)
-				cappLibPlugin.load()
-				# Get the flavor plugin in its full configuration.
-				cappFlavorPlugin.loadMore(cappLibPlugin.module.FlavorConfigSetup())
-				print("[DEBUG][capps.py.Capps.getAll] flavor config (full):", cappFlavorPlugin.flavor)
-				# Get the capp handler.
-				cappLibPlugin.module.Capp(\
-					configSetup=cappLibPlugin.module.CappConfigSetup(\
-						configFilePaths=[basicConfig.cappConfigDirPath]),\
-					flavor=cappFlavorPlugin.flavor)
-				
-				#print("[DEBUG][capphandler.py:Capps:getAll]", "Name of the chosen capp:", basicConfig.name)
-				#print("[DEBUG][capphandler.py:Capps:getAll]", "CappFlavor chosen:", cappFlavor.name)
\ No newline at end of file
+		self.maxWorkers = maxWorkers
+		if defaults is None:
+			defaults = Defaults()
+		self.defaults = defaults
+		if resolver is None:
+			resolver = CappResolver(self.defaults)
+		self.resolver = resolver
+		self.loadErrors = []
+	
+	@property
+	def configFilePaths(self):
+		"""The paths of all the capp config files, sorted by file name.
+		A capp config dir that doesn't exist (yet) is an empty fleet."""
+		configFilePaths = []
+		try:
+			configFileNames = os.listdir(self.cappConfigDirPath)
+		except FileNotFoundError:
+			return configFilePaths
+		for configFileName in sorted(configFileNames):
+			if configFileName.rpartition(".")[2] == "conf":
+				configFilePaths.append(os.path.join(self.cappConfigDirPath, configFileName))
+		return configFilePaths
+	
+	def load(self, configFilePath):
+		"""Load and instantiate the capp configured in the specified config file."""
+		basicConfig = self.getBasicConfig(configFilePath)
+		cappLibPlugin = self.resolver.getCappLibPlugin(self.resolver.getCappLibName(basicConfig.cappFlavorName))
+		flavor = self.resolver.getFlavor(basicConfig.cappFlavorName)
+		# Carry the basic capp info over, so the capp knows its name and flavor.
+		flavor.name = basicConfig.name
+		flavor.cappFlavorName = basicConfig.cappFlavorName
+		# Get the capp handler.
+		return cappLibPlugin.module.Capp(\
+			configSetup=cappLibPlugin.module.CappConfigSetup(\
+				configFilePaths=[configFilePath]),\
+			flavor=flavor)
+	
+	def loadSafe(self, configFilePath):
+		"""Like 'load', but returns a 'CappLoadResult' carrying either the capp or the error."""
+		try:
+			return CappLoadResult(configFilePath, capp=self.load(configFilePath))
+		except Exception as error:
+			return CappLoadResult(configFilePath, error=error)
+	
+	def getBasicConfig(self, configFilePath):
+		"""Parse just the basic capp info (name and flavor) out of a capp config file."""
+		return BasicCappConfigSetup().getConfig(configFilePaths=[configFilePath])
+	
+	def getCappLibName(self, cappFlavorName):
+		"""Get the name of the capplib a flavor uses, without loading the capplib."""
+		return self.resolver.getCappLibName(cappFlavorName)
+	
+	def select(self, name=None, flavor=None, capplib=None):
+		"""Return the paths of the capp config files matching all of the specified criteria.
+		Only the basic capp info is parsed for this (plus each flavor file once, if 'capplib' is specified);
+		no capp gets instantiated. Config files that can't even be parsed that far are skipped and
+		reported in 'self.loadErrors'."""
+		self.loadErrors = []
+		if not name is None:
+			# Capp configs are usually named after their capp, so try that first.
+			configFilePath = os.path.join(self.cappConfigDirPath, "{name}.conf".format(name=name))
+			configFilePaths = [configFilePath] if os.path.exists(configFilePath) else []
+			configFilePaths += [path for path in self.configFilePaths if not path == configFilePath]
+		else:
+			configFilePaths = self.configFilePaths
+		selectedConfigFilePaths = []
+		for configFilePath in configFilePaths:
+			try:
+				basicConfig = self.getBasicConfig(configFilePath)
+				if not name is None and not basicConfig.name == name:
+					continue
+				if not flavor is None and not basicConfig.cappFlavorName == flavor:
+					continue
+				if not capplib is None and not self.getCappLibName(basicConfig.cappFlavorName) == capplib:
+					continue
+			except Exception as error:
+				self.loadErrors.append(CappLoadResult(configFilePath, error=error))
+				continue
+			selectedConfigFilePaths.append(configFilePath)
+			if not name is None:
+				break # Names are unique.
+		return selectedConfigFilePaths
+	
+	def iterLoadResults(self, configFilePaths=None, maxWorkers=None):
+		"""Yield a 'CappLoadResult' for all (or the specified) config files, in config file order,
+		each as soon as it's available. Up to 'maxWorkers' capps are loaded at once; a capp that
+		fails to load doesn't keep the others from loading."""
+		if configFilePaths is None:
+			configFilePaths = self.configFilePaths
+		if maxWorkers is None:
+			maxWorkers = self.maxWorkers
+		if maxWorkers <= 1 or len(configFilePaths) <= 1:
+			for configFilePath in configFilePaths:
+				yield self.loadSafe(configFilePath)
+			return
+		import concurrent.futures
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+		try:
+			yield from executor.map(self.loadSafe, configFilePaths)
+		finally:
+			# Don't load what nobody is going to ask for if the caller stopped iterating early.
+			executor.shutdown(wait=True, cancel_futures=True)
+	
+	def loadAll(self, configFilePaths=None, maxWorkers=None):
+		"""Like 'iterLoadResults', but returns a list."""
+		return list(self.iterLoadResults(configFilePaths=configFilePaths, maxWorkers=maxWorkers))
+	
+	def iter(self, configFilePaths=None, maxWorkers=None):
+		"""Yield the capps of all (or the specified) config files one by one, as they're loaded.
+		Capps that failed to load are skipped and listed in 'self.loadErrors'."""
+		self.loadErrors = []
+		for loadResult in self.iterLoadResults(configFilePaths=configFilePaths, maxWorkers=maxWorkers):
+			if loadResult.failed:
+				self.loadErrors.append(loadResult)
+			else:
+				yield loadResult.capp
+	
+	def __iter__(self):
+		return self.iter()
+	
+	def filter(self, name=None, flavor=None, capplib=None, maxWorkers=None):
+		"""Yield the capps matching all of the specified criteria; only these get instantiated."""
+		configFilePaths = self.select(name=name, flavor=flavor, capplib=capplib)
+		selectErrors = self.loadErrors
+		for capp in self.iter(configFilePaths=configFilePaths, maxWorkers=maxWorkers):
+			yield capp
+		self.loadErrors = selectErrors+self.loadErrors
+	
+	def get(self, name):
+		"""Load and return the capp with the specified name, and only that one."""
+		configFilePaths = self.select(name=name)
+		if len(configFilePaths) == 0:
+			raise CappNotFoundError("No capp named \"{name}\" found in: {cappConfigDirPath}".format(\
+				name=name, cappConfigDirPath=self.cappConfigDirPath))
+		return self.load(configFilePaths[0])
+	
+	def checkPaths(self, capps=None, maxWorkers=None):
+		"""Check the paths of all (or the specified) capps in one batch and return the 'PathCheckReport'.
+		Paths shared by several capps, like their executables, are only checked once. Use the
+		report's 'forOwner(capp)' for the outcome for a particular capp."""
+		if capps is None:
+			capps = self.getAll(maxWorkers=maxWorkers)
+		if maxWorkers is None:
+			maxWorkers = self.maxWorkers
+		batchPathExistenceCheck = BatchPathExistenceCheck()
+		for capp in capps:
+			capp.addPathChecks(batchPathExistenceCheck)
+		return batchPathExistenceCheck.checkAll(autoRaiseError=False, maxWorkers=maxWorkers)
+	
+	def fanOut(self, command, args=[], capps=None, name=None, flavor=None, capplib=None, maxWorkers=None,\
+		perHostLimit=None):
+		"""A 'CappFanOut' running 'command' on the specified capps, or on those matching all of the
+		specified criteria (see 'filter'). Iterate its 'iterResults' to have results streamed."""
+		if capps is None:
+			capps = list(self.filter(name=name, flavor=flavor, capplib=capplib, maxWorkers=maxWorkers))
+		if maxWorkers is None:
+			maxWorkers = self.maxWorkers
+		return CappFanOut(capps, command, args=args, maxWorkers=maxWorkers, perHostLimit=perHostLimit)
+	
+	def iterStatus(self, capps=None, name=None, flavor=None, capplib=None, maxWorkers=None):
+		"""Yield a status row (see 'CappStatusTable') for each of the specified or matching capps as
+		soon as it has answered. The generator's return value is the table's summary."""
+		if maxWorkers is None:
+			maxWorkers = self.__class__.defaultStatusMaxWorkers
+		statusTable = CappStatusTable(self)
+		fanOut = self.fanOut("status", capps=capps, name=name, flavor=flavor, capplib=capplib, maxWorkers=maxWorkers)
+		for result in fanOut.iterResults():
+			yield statusTable.add(result)
+		return statusTable.summary
+	
+	def dedupBlockFiles(self, capps=None, name=None, flavor=None, capplib=None, maxWorkers=None, dryRun=False):
+		"""Replace identical block files of the specified or matching capps with links to one of them,
+		among the capps of each capplib (see 'FileDeduplicator' and the capplibs' 'dedupCandidatePaths').
+		Returns the deduplication report per capplib."""
+		if capps is None:
+			capps = list(self.filter(name=name, flavor=flavor, capplib=capplib))
+		if maxWorkers is None:
+			maxWorkers = FileDeduplicator.defaultMaxWorkers
+		candidatePaths = collections.OrderedDict()
+		for capp in capps:
+			if hasattr(capp, "dedupCandidatePaths"):
+				candidatePaths.setdefault(self.getCappLibName(capp.config.cappFlavorName), []).extend(capp.dedupCandidatePaths())
+		fileDeduplicator = FileDeduplicator(maxWorkers=maxWorkers)
+		return {cappLibName: fileDeduplicator.run(paths, dryRun=dryRun) for cappLibName, paths in candidatePaths.items()}
+	
+	def renewed(self):
+		"""A new 'Capps' like this one, with a resolver of its own, so flavors and capplibs are resolved
+		anew rather than taken from what this one has resolved so far."""
+		return self.__class__(self.cappConfigDirPath, maxWorkers=self.maxWorkers, defaults=self.defaults,\
+			resolver=CappResolver(self.defaults, lazyModules=self.resolver.lazyModules))
+	
+	def getAll(self, maxWorkers=None, raiseErrors=False):
+		"""Return a list of all the capps that could be loaded, in config file order.
+		Capps that failed to load are listed in 'self.loadErrors'; if 'raiseErrors' is 'True',
+		a 'CappLoadError' summing them up is raised instead."""
+		allCapps = list(self.iter(maxWorkers=maxWorkers))
+		if raiseErrors and len(self.loadErrors) > 0:
+			raise CappLoadError("The following capps couldn't be loaded:\n{errors}".format(\
+				errors="\n".join([loadResult.description for loadResult in self.loadErrors])))
+		return allCapps
+
+
+#==========================================================
+# Fan-out
+#==========================================================
+
+#==========================================================
+class CappActionResult(ActionResult):
+	
+	#=============================
+	"""The outcome of running a fan-out command on one capp; the capp is the item.
+	'key' tells it apart from the other capps of the fan-out (see 'CappFanOut.cappKeys').
+	'duration' is how long the command took, in seconds."""
+	#=============================
+	
+	def __init__(self, capp, status=0, description="", jsonResult=None, duration=0, key=None):
+		super().__init__(item=capp, status=status, description=description, jsonResult=jsonResult)
+		self.duration = duration
+		self.key = capp.config.name if key is None else key
+	
+	@property
+	def name(self):
+		return self.item.config.name
+	
+	@property
+	def failed(self):
+		return not self.status == 0
+	
+	def toDict(self):
+		return {"capp": self.name, "key": self.key, "status": self.status, "description": self.description,\
+			"result": self.json, "duration": round(self.duration, 3)}
+
+#==========================================================
+class CappAction(Action):
+	
+	#=============================
+	"""Runs one of 'CappFanOut.commands' on one capp. Named after the capp, unless another 'key' is given.
+	Never raises; errors end up in the returned 'CappActionResult' along with everything else."""
+	#=============================
+	
+	def __init__(self, capp, command, args=[], key=None):
+		super().__init__(capp.config.name if key is None else key)
+		self.capp = capp
+		self.command = command
+		self.args = list(args)
+	
+	def perform(self):
+		startTime = time.monotonic()
+		try:
+			result = CappFanOut.commands[self.command](self.capp, *self.args)
+		except Exception as error:
+			return CappActionResult(self.capp, status=1,\
+				description="{errorType}: {error}".format(errorType=type(error).__name__, error=error),\
+				duration=time.monotonic()-startTime, key=self.name)
+		return CappActionResult(self.capp, status=0, description="ok", jsonResult=result,\
+			duration=time.monotonic()-startTime, key=self.name)
+
+#==========================================================
+class CappFanOut(object):
+	
+	#=============================
+	"""Runs one command on many capps at once, e.g.:
+		fanOut = CappFanOut(capps, "call", ["getblockcount"], maxWorkers=16, perHostLimit=4)
+	Up to 'maxWorkers' capps are worked on at once, and no more than 'perHostLimit' ('None' for no
+	limit) of those run their daemon on the same host, so a host with many capps doesn't get
+	swamped while others sit idle. A capp failing doesn't affect the others."""
+	#=============================
+	
+	# Defaults
+	defaultMaxWorkers = 8
+	defaultHost = "localhost"
+	
+	# What can be run, by name. The functions take the capp, followed by the command's arguments.
+	commands = {
+		"call": lambda capp, method, *params: capp.call(method, *params),
+		"start": lambda capp, *commandLine: capp.startDaemonAndWait(list(commandLine)),
+		"stop": lambda capp, waitTimeout=None: capp.stopDaemon(waitTimeout=waitTimeout, wait=True),
+		"restart": lambda capp, waitTimeout=None: capp.restartDaemon(waitTimeout=waitTimeout),
+		"deleteBlockchainData": lambda capp, background=False: capp.deleteBlockchainData(background=background),
+		"status": lambda capp: FormattedNamespace(capp.status()).asDict,
+	}
+	
+	def __init__(self, capps, command, args=[], maxWorkers=defaultMaxWorkers, perHostLimit=None):
+		if not command in self.__class__.commands:
+			raise CappCommandUnknownError("Unknown fan-out command \"{command}\", known are: {commands}".format(\
+				command=command, commands=", ".join(sorted(self.__class__.commands.keys()))))
+		self.maxWorkers = max(1, maxWorkers)
+		self.perHostLimit = perHostLimit
+		self.actions = Actions()
+		self.hostQueues = collections.OrderedDict()
+		capps = list(capps)
+		for capp, key in zip(capps, self.__class__.cappKeys(capps)):
+			action = CappAction(capp, command, args, key=key)
+			self.actions.addAction(action)
+			self.hostQueues.setdefault(self.hostOf(capp), collections.deque()).append(action.name)
+	
+	@classmethod
+	def cappKeys(cls, capps):
+		"""What tells the capps apart in the results: their names, or for capps sharing theirs with
+		others (e.g. ones from different config dirs), their config file paths."""
+		nameCounts = collections.Counter([capp.config.name for capp in capps])
+		keys = []
+		for capp in capps:
+			if nameCounts[capp.config.name] == 1:
+				keys.append(capp.config.name)
+			else:
+				configFilePaths = getattr(getattr(capp, "configSetup", None), "configFilePaths", None)
+				keys.append(configFilePaths[0] if configFilePaths else "{name}#{number}".format(\
+					name=capp.config.name, number=len(keys)))
+		return keys
+	
+	@classmethod
+	def hostOf(cls, capp):
+		"""The host the capp's daemon runs on, as far as the per host limit is concerned."""
+		try:
+			return capp.host
+		except Exception:
+			return cls.defaultHost
+	
+	def iterResults(self):
+		"""Yield a 'CappActionResult' for each capp as soon as its command is done.
+		The generator's return value is the summary (see 'summarize')."""
+		import concurrent.futures
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers)
+		runningPerHost = collections.Counter()
+		futures = {}
+		results = []
+		def submitRunnable():
+			# Round robin over the hosts, so none of them is starved by one with many capps.
+			submitted = True
+			while submitted and len(futures) < self.maxWorkers:
+				submitted = False
+				for host, queue in self.hostQueues.items():
+					if len(queue) > 0 and len(futures) < self.maxWorkers\
+						and (self.perHostLimit is None or runningPerHost[host] < self.perHostLimit):
+						futures[executor.submit(self.actions.perform, queue.popleft())] = host
+						runningPerHost[host] += 1
+						submitted = True
+		try:
+			submitRunnable()
+			while len(futures) > 0:
+				done, notDone = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+				doneResults = []
+				for future in done:
+					runningPerHost[futures.pop(future)] -= 1
+					doneResults.append(future.result())
+				# Keep the workers busy while the caller deals with what's done.
+				submitRunnable()
+				for result in doneResults:
+					results.append(result)
+					yield result
+		finally:
+			# Don't start on capps nobody is going to hear about if the caller stopped iterating early.
+			for queue in self.hostQueues.values():
+				queue.clear()
+			executor.shutdown(wait=True, cancel_futures=True)
+		return self.summarize(results)
+	
+	def run(self):
+		"""Run the command on all capps and return the summary."""
+		results = self.iterResults()
+		while True:
+			try:
+				next(results)
+			except StopIteration as stop:
+				return stop.value
+	
+	@classmethod
+	def summarize(cls, results):
+		"""An 'ActionResult' summing up the per capp results, which are its item.
+		Its status is 0 if the command succeeded everywhere, 1 otherwise. Failures are listed by key."""
+		failures = {result.key: result.description for result in results if result.failed}
+		return ActionResult(item=results, status=0 if len(failures) == 0 else 1,\
+			description="{succeeded} succeeded, {failed} failed".format(succeeded=len(results)-len(failures),\
+				failed=len(failures)),\
+			jsonResult={"succeeded": len(results)-len(failures), "failed": len(failures), "failures": failures})
+
+#==========================================================
+class CappStatusTable(object):
+	
+	#=============================
+	"""Turns the results of the "status" fan-out command into one row per capp, as they come in.
+	A capp's 'lag' is how many blocks it's behind the best height seen among the capps of its
+	flavor (i.e. on its chain) so far; the 'summary' has the final best heights, and the final lags
+	of the capps that are behind."""
+	#=============================
+	
+	# Column name: width. The last column isn't padded.
+	columns = collections.OrderedDict([("name", 16), ("flavor", 14), ("capplib", 8), ("running", 7), ("height", 9),\
+		("lag", 6), ("state", 11), ("masternode", 0)])
+	
+	def __init__(self, capps):
+		self.capps = capps
+		self.rows = []
+		self.bestHeights = {}
+	
+	def add(self, cappActionResult):
+		"""Add the result of the "status" command for one capp and return its row, a 'Namespace'."""
+		capp = cappActionResult.item
+		flavor = capp.config.cappFlavorName
+		try:
+			capplib = self.capps.getCappLibName(flavor)
+		except Exception:
+			capplib = None
+		if cappActionResult.failed:
+			status = Namespace(running=None, height=None, state="error", masternode=cappActionResult.description)
+		else:
+			status = Namespace(**cappActionResult.json)
+		if not status.height is None and status.height > self.bestHeights.get(flavor, -1):
+			self.bestHeights[flavor] = status.height
+		row = Namespace(name=cappActionResult.name, flavor=flavor, capplib=capplib, running=status.running,\
+			height=status.height, lag=self.lag(flavor, status.height), state=status.state, masternode=status.masternode,\
+			key=cappActionResult.key)
+		self.rows.append(row)
+		return row
+	
+	def lag(self, flavor, height):
+		if height is None:
+			return None
+		return self.bestHeights[flavor]-height
+	
+	@property
+	def summary(self):
+		return {"capps": len(self.rows), "running": len([row for row in self.rows if row.running]),\
+			"bestHeights": dict(self.bestHeights),\
+			"lagging": {row.key: self.lag(row.flavor, row.height) for row in self.rows\
+				if not row.height is None and self.lag(row.flavor, row.height) > 0}}
+	
+	@classmethod
+	def formatLine(cls, values):
+		return " ".join([("-" if value is None else str(value)).ljust(width) for value, width\
+			in zip(values, cls.columns.values())]).rstrip()
+	
+	@classmethod
+	def formatHeader(cls):
+		return cls.formatLine(list(cls.columns.keys()))
+	
+	@classmethod
+	def formatRow(cls, row):
+		"""A table line for a row, as returned by 'add' (or a dict of one, as sent by the manager)."""
+		if isinstance(row, dict):
+			row = Namespace(**row)
+		values = FormattedNamespace(row).asDict
+		return cls.formatLine([values.get(column) for column in cls.columns.keys()])
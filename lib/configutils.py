@@ -9,6 +9,7 @@ import os
 import sys
 import configparser
 import json
+import types
 from lib.localization import Lang
 from lib.base import *
 
@@ -16,7 +17,8 @@ from lib.base import *
 # Localization
 #=======================================================================================
 
-_ = Lang( "cappconfigutilslib", autodetect=False).gettext
+lang = Lang( "cappconfigutilslib", autodetect=False)
+_ = lang.gettext
 
 #=======================================================================================
 # Library
@@ -106,6 +108,12 @@ class ConfigOptionType(object):
 	def _procedure(self, value):
 		pass#OVERRIDE
 	
+	@property
+	def fingerprint(self):
+		"""Identifies what this option type does to a value, e.g. for telling whether a cached,
+		already processed value is still what processing would result in."""
+		return [self.__class__.__module__, self.__class__.__qualname__, sorted(map(repr, self.__dict__.items()))]
+	
 	def process(self, value, previousValue):
 		if type(value) is list:
 			valueItems = []
@@ -183,6 +191,36 @@ class ConfigOptionListType(ConfigOptionType):
 		else:
 			raise ConfigSetupError("Unrecognized list type specified: {listType}".format(listType=self.listType))
 
+#==========================================================
+class ConfigOptionParameterKind(object):
+	
+	#=============================
+	"""What a kind of option parameter (e.g. the 'configName') is about, for the purpose of explaining it.
+	This is the same for the parameters of that kind of every option, which is why there's only one
+	object per kind, shared by all options. The descriptions are kept untranslated until they're
+	actually needed, which is mostly only when an error or help text is rendered."""
+	#=============================
+	
+	__slots__ = ("name", "defaultParameterValue", "_shortParameterDescription", "_parameterExplanation")
+	
+	def __init__(self, name, defaultParameterValue, shortParameterDescription, parameterExplanation):
+		self.name = name
+		self.defaultParameterValue = defaultParameterValue
+		self._shortParameterDescription = lang.lazy(shortParameterDescription)
+		self._parameterExplanation = lang.lazy(parameterExplanation)
+	
+	@property
+	def shortParameterDescription(self):
+		return str(self._shortParameterDescription)
+	
+	@property
+	def parameterExplanation(self):
+		return str(self._parameterExplanation)
+	
+	@property
+	def synopsis(self):
+		return self.shortParameterDescription+"\n"+self.parameterExplanation
+
 #==========================================================
 class ConfigOptionParameter(object):
 	
@@ -193,19 +231,34 @@ class ConfigOptionParameter(object):
 	The 'value' is the actual parameter string (say, a category the option is configured
 	to be subject to in the context of a configuration file).
 	The 'description' of it is a string used in explaining the parameter, mostly in the context
-	of error messages."""
+	of error messages. It's provided by the 'ConfigOptionParameterKind' the parameter is of."""
 	#=============================
 	
-	def __init__(self, parameterValue, defaultParameterValue, shortParameterDescription, parameterExplanation):
+	__slots__ = ("kind", "parameterValue")
+	
+	def __init__(self, kind, parameterValue):
+		self.kind = kind
 		self.parameterValue = parameterValue
-		self.defaultParameterValue = defaultParameterValue
-		self.shortParameterDescription = shortParameterDescription
-		self.parameterExplanation = parameterExplanation
-		if self.parameterValue == self.defaultParameterValue:
-			self.configured = False
-		else:
-			self.configured = True
-		self.synposis = self.shortParameterDescription+"\n"+self.parameterExplanation
+	
+	@property
+	def defaultParameterValue(self):
+		return self.kind.defaultParameterValue
+	
+	@property
+	def shortParameterDescription(self):
+		return self.kind.shortParameterDescription
+	
+	@property
+	def parameterExplanation(self):
+		return self.kind.parameterExplanation
+	
+	@property
+	def configured(self):
+		return not self.parameterValue == self.kind.defaultParameterValue
+	
+	@property
+	def synposis(self):
+		return self.kind.synopsis
 
 #==========================================================
 class ConfigOption(object):
@@ -231,7 +284,10 @@ class ConfigOption(object):
 	    
 	    Dev note: The reason for instantiating it at that point is to keep the door open for 
 	    possible customization parameters of 'ConfigOptionType' subclasses down the road
-	    without compromising API compatibility."""
+	    without compromising API compatibility.
+	
+	Capplibs and extensions add hundreds of these, so they're kept compact: there's no instance
+	dict, and everything explaining the parameters lives in the shared 'parameterKinds'."""
 	#=============================
 	
 	#NOTE: This is still shaky and messy.
@@ -240,6 +296,45 @@ class ConfigOption(object):
 	# Defaults
 	defaultCategory = "main"
 	
+	#===============
+	# Parameter kinds
+	parameterKinds = {kind.name: kind for kind in [\
+		ConfigOptionParameterKind("varName", None,\
+			"In-code variable name",\
+			"This is how this option is represented and accessed in the actual code"),\
+		ConfigOptionParameterKind("argName", None,\
+			"Command line argument (long)",\
+			"Example: --command-line-argument"),\
+		ConfigOptionParameterKind("argShort", None,\
+			"Command line argument (short)",\
+			"""Example: -c"""),\
+		ConfigOptionParameterKind("configName", None,\
+			"Name in a configuration file context",\
+			"Example: If in a configuration file the option would look like this: \"param\"=paramvalue\"then \"param\" would be what this parameter references"),\
+		ConfigOptionParameterKind("displayName", None,\
+			"Fancy name, e.g. for GUIs",\
+			"Example: the varName might be \"thisParameter\", but the fancy name might be: \"This Parameter\""),\
+		ConfigOptionParameterKind("shortDescription", None,\
+			"A short description, like this one",\
+			"Describes the option in a few words. Used for compact, brief messages such as errors"),\
+		ConfigOptionParameterKind("explanation", None,\
+			"In depth explanation of the option",\
+			"Some options might require more explanation than what the short description provides. Some might even benefit from having examples provided"),\
+		ConfigOptionParameterKind("metaVar", None,\
+			"Syntax variable for help text",\
+			"Example: If the command line argument is \"--parameter=foo\", \"foo\" might be referenced as \"VALUE\" in syntax help, whereas \"VALUE\" would be the metaVar"),\
+		ConfigOptionParameterKind("category", defaultCategory,\
+			"Category in a configuration file context",\
+			"For example: [Main] in an ini-style configuration file, whereas \"Main\" would be the category in this case"),\
+		ConfigOptionParameterKind("defaultValue", None,\
+			"The default value value for this option",\
+			"If no value is assigned to it, this will be the value it's going to carry going forward"),\
+		ConfigOptionParameterKind("optionTypes", [],\
+			"A list of option types",\
+			"These types determine how the value is going to be processed upon assignment")]}
+	
+	__slots__ = tuple(parameterKinds.keys())+("enforceAssignment", "validateAssignment")
+	
 	#===============
 	# Constructor
 	def __init__(self, varName,\
@@ -258,52 +353,18 @@ class ConfigOption(object):
 		
 		#===============
 		# Parameters
-		
-		# varName
-		self.varName = ConfigOptionParameter(parameterValue=varName, defaultParameterValue=None,\
-			shortParameterDescription=_("In-code variable name"),\
-			parameterExplanation=_("This is how this option is represented and accessed in the actual code"))
-		# argName
-		self.argName = ConfigOptionParameter(parameterValue=argName, defaultParameterValue=None,\
-			shortParameterDescription=_("Command line argument (long)"),\
-			parameterExplanation=_("Example: --command-line-argument"))
-		# argShort
-		self.argShort = ConfigOptionParameter(parameterValue=argShort, defaultParameterValue=None,\
-			shortParameterDescription=_("Command line argument (short)"),\
-			parameterExplanation=_("""Example: -c"""))
-		# configName
-		self.configName = ConfigOptionParameter(parameterValue=configName, defaultParameterValue=None,\
-			shortParameterDescription=_("Name in a configuration file context"),\
-			parameterExplanation=_("Example: If in a configuration file the option would look like this: \"param\"=paramvalue\"then \"param\" would be what this parameter references"))
-		# displayName
-		self.displayName = ConfigOptionParameter(parameterValue=displayName, defaultParameterValue=None,\
-			shortParameterDescription=_("Fancy name, e.g. for GUIs"),\
-			parameterExplanation=_("Example: the varName might be \"thisParameter\", but the fancy name might be: \"This Parameter\""))
-		# shortDescription
-		self.shortDescription = ConfigOptionParameter(parameterValue=shortDescription, defaultParameterValue=None,\
-			shortParameterDescription=_("A short description, like this one"),\
-			parameterExplanation=_("Describes the option in a few words. Used for compact, brief messages such as errors"))
-		# explanation
-		self.explanation = ConfigOptionParameter(parameterValue=explanation, defaultParameterValue=None,\
-			shortParameterDescription=_("In depth explanation of the option"),\
-			parameterExplanation=_("Some options might require more explanation than what the short description provides. Some might even benefit from having examples provided"))
-		# metaVar
-		self.metaVar = ConfigOptionParameter(parameterValue=metaVar, defaultParameterValue=None,\
-			shortParameterDescription=_("Syntax variable for help text"),\
-			parameterExplanation=_("Example: If the command line argument is \"--parameter=foo\", \"foo\" might be referenced as \"VALUE\" in syntax help, whereas \"VALUE\" would be the metaVar"))
-		# category
-		self.category = ConfigOptionParameter(parameterValue=category, defaultParameterValue=self.__class__.defaultCategory,\
-			shortParameterDescription=_("Category in a configuration file context"),\
-			parameterExplanation=_("For example: [Main] in an ini-style configuration file, whereas \"Main\" would be the category in this case"))
-		# defaultValue
-		self.defaultValue = ConfigOptionParameter(parameterValue=defaultValue, defaultParameterValue=None,\
-			shortParameterDescription=_("The default value value for this option"),\
-			parameterExplanation=_("If no value is assigned to it, this will be the value it's going to carry going forward"))
-		# optionTypes
-		self.optionTypes = ConfigOptionParameter(parameterValue=optionTypes, defaultParameterValue=[],\
-			shortParameterDescription=_("A list of option types",),\
-			parameterExplanation=_("These types determine how the value is going to be processed upon assignment"))
-	
+		kinds = self.__class__.parameterKinds
+		self.varName = ConfigOptionParameter(kinds["varName"], varName)
+		self.argName = ConfigOptionParameter(kinds["argName"], argName)
+		self.argShort = ConfigOptionParameter(kinds["argShort"], argShort)
+		self.configName = ConfigOptionParameter(kinds["configName"], configName)
+		self.displayName = ConfigOptionParameter(kinds["displayName"], displayName)
+		self.shortDescription = ConfigOptionParameter(kinds["shortDescription"], shortDescription)
+		self.explanation = ConfigOptionParameter(kinds["explanation"], explanation)
+		self.metaVar = ConfigOptionParameter(kinds["metaVar"], metaVar)
+		self.category = ConfigOptionParameter(kinds["category"], category)
+		self.defaultValue = ConfigOptionParameter(kinds["defaultValue"], defaultValue)
+		self.optionTypes = ConfigOptionParameter(kinds["optionTypes"], optionTypes)
 		
 		#===============
 		# Behaviour
@@ -312,6 +373,13 @@ class ConfigOption(object):
 	
 	#TODO: Clean up 'parameters' and 'configuredParameters'. This just doesn't fly.
 	
+	@property
+	def fingerprint(self):
+		"""Everything about this option that affects the value it ends up with in a 'Config'."""
+		return [self.varName.parameterValue, self.argName.parameterValue, self.configName.parameterValue,\
+			self.category.parameterValue, repr(self.defaultValue.parameterValue),\
+			[optionType.fingerprint for optionType in self.optionTypes.parameterValue]]
+	
 	@property
 	def synopsis(self):
 		"""Return a human readable string explaining the anatomy of this option."""
@@ -327,13 +395,10 @@ class ConfigOption(object):
 	@property
 	def configuredParameters(self):
 		"""Returns a dict with all the info variables that are not 'None'."""
-		#NOTE: [Aziroshin] This is a bit hacky. x_X
 		configuredParametersDict = {}
-		for oneOfOurAttributes in self.__dict__.keys():
-			attributeValue = self.__dict__[oneOfOurAttributes]
-			if type(attributeValue) == ConfigOptionParameter:
-				if attributeValue.configured:
-					configuredParametersDict[oneOfOurAttributes] = attributeValue
+		for parameter in self.parameters:
+			if parameter.configured:
+				configuredParametersDict[parameter.kind.name] = parameter
 		return configuredParametersDict
 
 	def createConfiguredNamesErrorListing(self):
@@ -352,7 +417,7 @@ class ConfigOption(object):
 			raise ConfigOptionUnassignedError(_("A configuration option isn't properly configured. The configuration option in question is comprised of the following parameters, which are listed as follows according to the context they're used in to aid you in locating the source of the problem:{eol}{eol}{configInfo}",\
 				formatDict={"eol": os.linesep, "configInfo": self.createConfiguredNamesErrorListing() }))
 
-	def validateAssignment(self, value):
+	def validateAssignedValue(self, value):
 		"""Validate whether the assigned value is within specifications.
 		This method is currently #TODO and doesn't have any code."""
 		# a) Subclassing might be an option.
@@ -380,7 +445,53 @@ class ConfigOption(object):
 		if self.enforceAssignment:
 			self.checkEnforcedAssignment(value)
 		if self.validateAssignment:
-			self.validateAssignment(value)
+			self.validateAssignedValue(value)
+#==========================================================
+class CompiledConfigSetup(object):
+	
+	#=============================
+	"""The options of a 'ConfigSetup', indexed for resolving configs in a single pass.
+	Indexes are read-only; a 'ConfigSetup' recompiles when options are added to it.
+	- byVarName: varName -> option
+	- byArgName: argName -> option, for command line options
+	- byConfigKey: (category, configName) -> option, for config file options. The configName is
+	  stored the way configparser normalizes keys, so file keys can be looked up directly.
+	- commandLineOptions/configFileOptions: varName -> option, for either kind of option.
+	- defaults: (varName, option) for every option, in the order they were added.
+	- validatedOptions: The options that actually have validation to run, sorted by varName."""
+	#=============================
+	
+	def __init__(self, configSetup):
+		options = configSetup.options
+		self.optionCount = len(options)
+		self.byVarName = types.MappingProxyType(dict(options))
+		self.byArgName = types.MappingProxyType({option.argName.parameterValue: option\
+			for option in options.values() if not option.argName.parameterValue == None})
+		self.commandLineOptions = types.MappingProxyType({varName: option\
+			for varName, option in options.items() if not option.argName.parameterValue == None})
+		optionxform = configparser.ConfigParser().optionxform
+		self.byConfigKey = types.MappingProxyType({\
+			(option.category.parameterValue, optionxform(option.configName.parameterValue)): option\
+			for option in options.values() if not option.configName.parameterValue == None})
+		self.configFileOptions = types.MappingProxyType({varName: option\
+			for varName, option in options.items() if not option.configName.parameterValue == None})
+		self.defaults = tuple(options.items())
+		self.validatedOptions = tuple([option for varName, option in sorted(options.items())\
+			if option.enforceAssignment or option.validateAssignment])
+		self._configSetupClass = configSetup.__class__
+		self._fingerprint = None
+	
+	@property
+	def fingerprint(self):
+		"""A hash of the config setup class and everything about its options that affects a config.
+		Only needed for snapshot caching, so it's computed on first access."""
+		if self._fingerprint is None:
+			import hashlib
+			self._fingerprint = hashlib.sha256(json.dumps([self._configSetupClass.__module__,\
+				self._configSetupClass.__qualname__,\
+				sorted([option.fingerprint for option in self.byVarName.values()])]).encode()).hexdigest()
+		return self._fingerprint
+
 #==========================================================
 class ConfigSetup(object):
 	
@@ -397,14 +508,33 @@ class ConfigSetup(object):
 	values as specified in the supplied 'ConfigOption' instances will be used."""
 	#=============================
 	
+	# An optional 'ConfigSnapshotCache' shared by all config setups. Disabled unless assigned,
+	# which is up to the entry points.
+	snapshotCache = None
+	
 	def __init__(self, configFilePaths=[]):
 		self.options = {}
 		self.configFilePaths = configFilePaths
+		self._compiled = None
 
 	def addOption(self, option):
 		"""Add an instance of ConfigOption to the dict of config options."""
 		self.options[option.varName.parameterValue] = option
+		self._compiled = None
 
+	@property
+	def compiled(self):
+		"""The 'CompiledConfigSetup' for the current options, compiled on first use."""
+		if self._compiled is None or not self._compiled.optionCount == len(self.options):
+			self._compiled = CompiledConfigSetup(self)
+		return self._compiled
+
+	@property
+	def fingerprint(self):
+		"""Identifies this config setup by its class and everything about its options that affects the
+		resulting config. Changes whenever a code change would make cached configs stale."""
+		return self.compiled.fingerprint
+	
 	@property
 	def configFilePathPresentation(self):
 		return "\n\t".join(self.configFilePaths)
@@ -429,44 +559,31 @@ class ConfigSetup(object):
 	@property
 	def commandLineOptions(self):
 		"""Get all ConfigOptions that are configured as command line parameters."""
-		commandLineOptions = {}
-		for varName, option in self.options.items():
-			if not option.argName.parameterValue == None:
-				commandLineOptions[varName] = option
-		return commandLineOptions
+		return self.compiled.commandLineOptions
 
 	@property
 	def configFileOptions(self):
 		"""Get all ConfigOptions that are configured for a configuration file."""
-		configFileOptions = {}
-		for varName, option in self.options.items():
-			if not option.configName.parameterValue == None:
-				configFileOptions[varName] = option
-		return configFileOptions
+		return self.compiled.configFileOptions
 	
 	def putValueIntoConfig(self, option, config, value):
 		"""Add a config option and its value to a 'Config' object."""
 		processedValue = value
+		varName = option.varName.parameterValue
 		for optionType in option.optionTypes.parameterValue:
-			if hasattr(config, option.varName.parameterValue):
-				processedValue = optionType.process(\
-					processedValue,\
-					previousValue=getattr(config, option.varName.parameterValue))
-			else:
-				processedValue = optionType.process(\
-					processedValue,\
-					previousValue=NoPreviousValue())
-		setattr(config, option.varName.parameterValue, processedValue)
+			processedValue = optionType.process(\
+				processedValue,\
+				previousValue=config.__dict__.get(varName, NoPreviousValue()))
+		setattr(config, varName, processedValue)
 
 	def putDefaultValueIntoConfig(self, config, option):
-		"""Fill the config namespace object with default values as configured by the config options."""
-		for varName, option in self.options.items():
-			try:
-				self.putValueIntoConfig(option=option, config=config, value=option.defaultValue.parameterValue)
-			except ConfigFormatError as error:
-				raise ConfigFormatError(\
-					_("Whilst assigning default values, the following error occurred:\n{error}\n{optionSynopsis}",\
-					formatDict={"error": error, "optionSynopsis": option.synopsis}))
+		"""Put the default value of the specified option into the config namespace object."""
+		try:
+			self.putValueIntoConfig(option=option, config=config, value=option.defaultValue.parameterValue)
+		except ConfigFormatError as error:
+			raise ConfigFormatError(\
+				_("Whilst assigning default values, the following error occurred:\n{error}\n{optionSynopsis}",\
+				formatDict={"error": error, "optionSynopsis": option.synopsis}))
 
 	def initializeConfigWithDefaultValues(self, config):
 		"""Iterate over all the configured options and initialize default values into the config as fits.
@@ -475,9 +592,10 @@ class ConfigSetup(object):
 		for an option, as that means that a previous 'ConfigSetup' object working on the
 		specfied 'Config' object has already initialized a value for it, which we don't want to
 		override here."""
-		for varName, option in self.options.items():
-			if hasattr(config, varName): # If not, it's not been initialized anyway, so we'll want to.
-				if getattr(config, varName) is not option.defaultValue.defaultParameterValue:
+		configValues = config.__dict__
+		for varName, option in self.compiled.defaults:
+			if varName in configValues: # If not, it's not been initialized anyway, so we'll want to.
+				if configValues[varName] is not option.defaultValue.defaultParameterValue:
 					continue # This config value's already been configured, we don't want to mess with it.
 			self.putDefaultValueIntoConfig(config, option)
 
@@ -486,9 +604,8 @@ class ConfigSetup(object):
 		Note: Arguments are matched using 'varName' as used in 'ConfigOption'. That's
 		why 'target' has to equal 'varName' when setting up arguments with argparse, if the
 		arguments are supposed to work with this here system."""
-		for varName, option in self.commandLineOptions.items():
-			print("[DEBUG] [configutils.py.ConfigSetup.putArgsIntoConfig]", option.parameterValue)
-			if varName in argObject.__dict__.keys():
+		for varName, option in self.compiled.commandLineOptions.items():
+			if varName in argObject.__dict__:
 				self.putValueIntoConfig(\
 					option=option,\
 					config=config,\
@@ -498,24 +615,32 @@ class ConfigSetup(object):
 		"""Parse the specified config file and put its values into the specified 'Config' instance."""
 		fileConfig = configparser.ConfigParser()
 		fileConfig.read(configFilePath)
-		for varName, option in self.configFileOptions.items():
-			#print("[DEBUG][configutils.py:ConfigSetup.putConfigFileValuesIntoConfig] varName: ", varName, "configName: ", option.configName.parameterValue)
-			if option.category.parameterValue in fileConfig:
-				if option.configName.parameterValue in fileConfig[option.category.parameterValue].keys():
-					self.putValueIntoConfig(\
-						option=option,\
-						config=config,\
-						value=fileConfig[option.category.parameterValue][option.configName.parameterValue])
+		# Go by what's in the file rather than by every option we know of.
+		byConfigKey = self.compiled.byConfigKey
+		for category in fileConfig.sections():
+			for configName in fileConfig[category]:
+				option = byConfigKey.get((category, configName))
+				if not option is None:
+					self.putValueIntoConfig(option=option, config=config, value=fileConfig[category][configName])
+
 	def validateConfig(self, config):
-		for varName, option in sorted(self.options.items()):
+		for option in self.compiled.validatedOptions:
 			#print("[configutils.py:ConfigSetup.validateConfig], varName: ", varName, "configName: ", option.configName.parameterValue, "value: ", config.__dict__[option.varName.parameterValue])
 			option.validate(getattr(config, option.varName.parameterValue))
 
-	def getConfig(self, argObjects=[], configFilePaths=[], config=Config(), complementPaths=True):
+	def getConfig(self, argObjects=[], configFilePaths=[], config=None, complementPaths=True):
 		"""Gets a 'Config' object initialized according to the specified arguments and config files.
 		The 'argObjects' and 'configFilePaths' parameters both take lists, whereas the specified items
-		are parsed in list order with each item overriding the former one."""
-		config = config
+		are parsed in list order with each item overriding the former one.
+		If 'config' is specified, it's complemented in place, otherwise a new 'Config' is created."""
+		if config is None:
+			config = Config()
+		# Configs that only depend on files are worth caching; those depending on args aren't.
+		snapshotKey = None
+		if not self.__class__.snapshotCache is None and len(argObjects) == 0:
+			snapshotKey = self.__class__.snapshotCache.key(self, configFilePaths, config)
+			if self.__class__.snapshotCache.restore(snapshotKey, config):
+				return config
 		#print("[DEBUG][configSetup]", configFilePaths)
 		self.initializeConfigWithDefaultValues(config)
 		for configFilePath in configFilePaths:
@@ -529,8 +654,83 @@ class ConfigSetup(object):
 		try:
 			self.validateConfig(config)
 		except ConfigOptionUnassignedError as error:
-			print("[DEBUG] configutils.py.ConfigSetup.getConfig config: ", config)
 			raise type(error)("\n"+"\n".join([error.message,\
 				_("# Config values found:"),\
 				FormattedNamespace(config).asString]))
+		if not snapshotKey is None:
+			self.__class__.snapshotCache.store(snapshotKey, config)
 		return config
+
+#==========================================================
+class ConfigSnapshotCache(object):
+	
+	#=============================
+	"""An on-disk cache of fully processed configs, so unchanged config files don't have to be
+	parsed and processed again on every start.
+	
+	A snapshot is keyed by the 'ConfigSetup' fingerprint, the config file paths and the config
+	that's being complemented, and is only valid for as long as the mtime, size and inode of
+	each of the config files stay the same. As there's one snapshot file per key, stale snapshots
+	are simply overwritten. Configs with values JSON can't represent aren't cached."""
+	#=============================
+	
+	# Defaults
+	defaultDirPath = os.path.join(os.path.expanduser("~"), ".cache", "cappman", "configsnapshots")
+	formatVersion = 1
+	
+	def __init__(self, dirPath=defaultDirPath):
+		self.dirPath = dirPath
+	
+	def fileStamp(self, configFilePath):
+		"""What has to stay the same about a config file for a snapshot of it to stay valid."""
+		stat = os.stat(configFilePath)
+		return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+	
+	def key(self, configSetup, configFilePaths, config):
+		"""Return a 'SnapshotKey' for the specified 'getConfig' inputs, or 'None' if they can't be cached."""
+		try:
+			stablePart = json.dumps([self.__class__.formatVersion, configSetup.fingerprint,\
+				[os.path.abspath(configFilePath) for configFilePath in configFilePaths],\
+				os.path.expanduser("~"), config.__dict__], sort_keys=True)
+			stamps = [self.fileStamp(configFilePath) for configFilePath in configFilePaths]
+		except (TypeError, ValueError, OSError):
+			return None
+		import hashlib
+		return SnapshotKey(hashlib.sha256(stablePart.encode()).hexdigest(), stamps)
+	
+	def snapshotFilePath(self, snapshotKey):
+		return os.path.join(self.dirPath, "{digest}.json".format(digest=snapshotKey.digest))
+	
+	def restore(self, snapshotKey, config):
+		"""Put the snapshotted values into 'config' and return 'True', if there's a valid snapshot."""
+		if snapshotKey is None:
+			return False
+		try:
+			with open(self.snapshotFilePath(snapshotKey), "r") as snapshotFile:
+				snapshot = json.load(snapshotFile)
+		except (OSError, ValueError):
+			return False
+		if not snapshot.get("stamps") == snapshotKey.stamps:
+			return False
+		config.__dict__.update(snapshot["values"])
+		return True
+	
+	def store(self, snapshotKey, config):
+		"""Snapshot the values of 'config'. Failing to do so is not an error, just a cache miss next time."""
+		try:
+			data = json.dumps({"stamps": snapshotKey.stamps, "values": config.__dict__})
+			os.makedirs(self.dirPath, exist_ok=True)
+			File(self.snapshotFilePath(snapshotKey)).writeAtomically(data)
+		except (TypeError, ValueError, OSError):
+			pass
+
+#==========================================================
+class SnapshotKey(object):
+	
+	#=============================
+	"""Identifies a config snapshot ('digest') and what it's valid for ('stamps')."""
+	#=============================
+	
+	def __init__(self, digest, stamps):
+		self.digest = digest
+		self.stamps = stamps
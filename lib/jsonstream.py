@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+
+#=======================================================================================
+# Imports
+#=======================================================================================
+
+import re
+import json
+import codecs
+from lib.base import *
+
+#=======================================================================================
+# Library
+#=======================================================================================
+
+#==========================================================
+class JsonStreamDecoder(object):
+
+	#=============================
+	"""Decodes a JSON document from an iterable of byte chunks (e.g. 'Process.iterChunks', or an HTTP
+	response read piece by piece) and yields the entries of one array or object in it as soon as
+	each is complete: the values of an array, (key, value) tuples of an object. Only one entry is
+	held in memory at a time, so memory use doesn't grow with the size of the document.
+	'path' is the list of keys leading to the array or object to yield the entries of, e.g.
+	["result"] for a JSON-RPC response; everything else found along the way is kept in 'others',
+	keyed by path (e.g. others[("error",)]) once the iteration is done. If 'fields' is specified,
+	entries that are objects only get those of their keys decoded; the rest is skipped over without
+	being decoded at all. Malformed documents raise 'json.JSONDecodeError' (a 'ValueError')."""
+	#=============================
+
+	whitespacePattern = re.compile(r"[ \t\n\r]*")
+	# What's interesting when skipping over a value: where strings and containers begin and end.
+	skipPattern = re.compile(r"[\"\[\]{}]")
+	stringPattern = re.compile(r"\"(?:[^\"\\]|\\.)*\"", re.DOTALL)
+	scalarPattern = re.compile(r"[^,\]}\s]+")
+	# Keep the consumed beginning of the buffer around until it's at least this long.
+	trimSize = 64*1024
+
+	def __init__(self, chunks, path=[], fields=None):
+		self.chunks = iter(chunks)
+		self.path = list(path)
+		self.fields = None if fields is None else set(fields)
+		self.others = {}
+		self.buffer = ""
+		self.position = 0
+		self.eof = False
+		self._decoder = json.JSONDecoder()
+		self._utf8Decoder = codecs.getincrementaldecoder("utf-8")()
+
+	#=============================
+	# Buffer
+	#=============================
+
+	def fill(self):
+		"""Append the next chunk to the buffer; 'False' if there are no more."""
+		if self.eof:
+			return False
+		if self.position >= self.__class__.trimSize:
+			self.buffer = self.buffer[self.position:]
+			self.position = 0
+		for chunk in self.chunks:
+			text = self._utf8Decoder.decode(chunk)
+			if len(text) > 0:
+				self.buffer += text
+				return True
+		self.buffer += self._utf8Decoder.decode(b"", final=True)
+		self.eof = True
+		return False
+
+	def fillMore(self):
+		"""Grow the buffer for the value at 'position', which isn't complete yet, to about twice what
+		there is of it so far, so big values aren't scanned over and over again. Filling may drop the
+		consumed beginning of the buffer, so positions have to be taken from 'position' afterwards."""
+		pendingLength = max(1, len(self.buffer)-self.position)
+		filled = self.fill()
+		while filled and len(self.buffer)-self.position < 2*pendingLength:
+			filled = self.fill()
+
+	def error(self, message):
+		return json.JSONDecodeError(message, self.buffer, self.position)
+
+	def peek(self):
+		"""Skip whitespace and return the next character ("" at the end of the document)."""
+		while True:
+			self.position = self.__class__.whitespacePattern.match(self.buffer, self.position).end()
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+			if not self.fill():
+				return ""
+
+	def expect(self, characters):
+		character = self.peek()
+		if character == "" or not character in characters:
+			raise self.error("Expecting one of: {characters}".format(characters=characters))
+		self.position += 1
+		return character
+
+	#=============================
+	# Values
+	#=============================
+
+	def decodeValue(self):
+		"""Decode the next value and return it."""
+		self.peek()
+		start = self.position
+		while True:
+			# A number at the end of the buffer may go on in the next chunk, even right after its "." or
+			# "e", where it's a shorter number as far as 'raw_decode' is concerned; read up to its end first.
+			scalarMatch = None if self.eof else self.__class__.scalarPattern.match(self.buffer, start)
+			if not scalarMatch is None and not self.buffer[start] in "\"[{" and scalarMatch.end() == len(self.buffer):
+				self.fillMore()
+				start = self.position
+				continue
+			try:
+				value, end = self._decoder.raw_decode(self.buffer, start)
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+				self.fillMore()
+				start = self.position
+				continue
+			if end < len(self.buffer) and self.buffer[end] in ".eE+-0123456789":
+				self.position = end
+				raise self.error("Malformed number")
+			self.position = end
+			return value
+
+	def skipValue(self):
+		"""Skip over the next value without decoding it."""
+		if self.peek() == "":
+			raise self.error("Expecting value")
+		start = self.position
+		while True:
+			end = self.skipEnd(start)
+			if not end is None:
+				self.position = end
+				return
+			if self.eof:
+				self.position = len(self.buffer)
+				raise self.error("Unterminated value")
+			self.fillMore()
+			start = self.position
+
+	def skipEnd(self, start):
+		"""Where the value starting at 'start' ends, or 'None' if it isn't all in the buffer yet."""
+		buffer = self.buffer
+		if buffer[start] == "\"":
+			match = self.__class__.stringPattern.match(buffer, start)
+			return None if match is None else match.end()
+		if not buffer[start] in "[{":
+			end = self.__class__.scalarPattern.match(buffer, start).end()
+			return end if end < len(buffer) or self.eof else None
+		depth = 0
+		position = start
+		while True:
+			match = self.__class__.skipPattern.search(buffer, position)
+			if match is None:
+				return None
+			character = match.group()
+			if character == "\"":
+				stringMatch = self.__class__.stringPattern.match(buffer, match.start())
+				if stringMatch is None:
+					return None
+				position = stringMatch.end()
+				continue
+			depth += 1 if character in "[{" else -1
+			position = match.end()
+			if depth == 0:
+				return position
+
+	def decodeEntry(self):
+		"""Decode the next value, only decoding the 'fields' of it if it's an object."""
+		if self.fields is None or not self.peek() == "{":
+			return self.decodeValue()
+		self.position += 1
+		entry = {}
+		for key in self.iterKeys("}"):
+			if key in self.fields:
+				entry[key] = self.decodeValue()
+			else:
+				self.skipValue()
+		return entry
+
+	def iterKeys(self, closing):
+		"""Yield the keys of the object whose opening brace was just consumed, leaving it to the
+		caller to consume each key's value. Consumes the closing brace."""
+		if self.peek() == closing:
+			self.position += 1
+			return
+		while True:
+			if not self.peek() == "\"":
+				raise self.error("Expecting property name enclosed in double quotes")
+			key = self.decodeValue()
+			self.expect(":")
+			yield key
+			if self.expect(","+closing) == closing:
+				return
+
+	#=============================
+	# Iteration
+	#=============================
+
+	def iterContainer(self):
+		"""Yield the entries of the array or object that's next."""
+		opening = self.expect("[{")
+		if opening == "{":
+			for key in self.iterKeys("}"):
+				yield (key, self.decodeEntry())
+			return
+		if self.peek() == "]":
+			self.position += 1
+			return
+		while True:
+			yield self.decodeEntry()
+			if self.expect(",]") == "]":
+				return
+
+	def finishObject(self, keys, prefix):
+		"""Keep the remaining members of an object along 'path' in 'others'."""
+		for key in keys:
+			self.others[prefix+(key,)] = self.decodeValue()
+
+	def __iter__(self):
+		openObjects = []
+		prefix = ()
+		for pathKey in self.path:
+			if not self.peek() == "{":
+				# The path leads nowhere (e.g. a null result along with an error); keep what's there instead.
+				self.others[prefix] = self.decodeValue()
+				break
+			self.position += 1
+			keys = self.iterKeys("}")
+			for key in keys:
+				if key == pathKey:
+					break
+				self.others[prefix+(key,)] = self.decodeValue()
+			else:
+				break # No such key.
+			openObjects.append((keys, prefix))
+			prefix += (pathKey,)
+		else:
+			if self.peek() in ["[", "{"]:
+				yield from self.iterContainer()
+			else:
+				self.others[prefix] = self.decodeValue()
+		for keys, objectPrefix in reversed(openObjects):
+			self.finishObject(keys, objectPrefix)
+		if not self.peek() == "":
+			raise self.error("Extra data")
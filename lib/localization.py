@@ -8,6 +8,7 @@
 import gettext
 import os
 import sys
+import threading
 
 #=======================================================================================
 # Library
@@ -29,19 +30,91 @@ class Lang(object):
 	"""Represents a translation based on gettext."""
 	#=============================
 	
+	# Catalogs are shared by all 'Lang' objects of the process, keyed by (domain, localeDirPath, language).
+	# A value of 'None' means there's no catalog for that key, which is worth remembering just the same.
+	catalogs = {}
+	catalogsLock = threading.Lock()
+	
 	def __init__(self, domain, localeDirPath=defaultLocaleDirPath, language=None, autodetect=False):
-		self.translation = None
-		try:
-			self.translation = gettext.translation(domain, localeDirPath)
-			self.gettext = translation.gettext
-		except FileNotFoundError:
-			pass
 		self.domain = domain
 		self.localeDirPath = localeDirPath
 		self.language = language
-
+		# Every module has a 'Lang' of its own, so looking for a catalog right away would make
+		# every import probe the filesystem. We look once a message is actually translated.
+		self._translation = None
+		self._probed = False
+	
+	@classmethod
+	def catalog(cls, domain, localeDirPath, language=None):
+		"""The gettext translation for the specified key, or 'None' if there's no catalog for it.
+		Each key is only looked up once per process."""
+		key = (domain, localeDirPath, language)
+		with cls.catalogsLock:
+			if not key in cls.catalogs:
+				try:
+					cls.catalogs[key] = gettext.translation(domain, localeDirPath,\
+						languages=None if language is None else [language])
+				except FileNotFoundError:
+					cls.catalogs[key] = None
+			return cls.catalogs[key]
+	
+	@property
+	def translation(self):
+		"""The gettext translation for our domain, or 'None' if there's no catalog for it."""
+		if not self._probed:
+			self._translation = self.__class__.catalog(self.domain, self.localeDirPath, self.language)
+			self._probed = True
+		return self._translation
+	
 	def gettext(self, string, formatDict={}):
 		"""Wraps around gettext to provide additional features."""
 		if self.translation is None:
 			return string.format(**formatDict)
-		return self.gettext(string.format(**formatDict))
\ No newline at end of file
+		return self.translation.gettext(string).format(**formatDict)
+	
+	def lazy(self, string, formatDict={}):
+		"""Like 'gettext', but the message is only translated and formatted once it's rendered as text.
+		Meant for messages that are built in bulk, but rarely displayed."""
+		return LazyMessage(self, string, formatDict)
+
+#==========================================================
+class LazyMessage(object):
+	
+	#=============================
+	"""A message that's translated and formatted on its first conversion to 'str'.
+	It can be used wherever text is formatted ("{}".format, f-strings, '+'). Anything that insists
+	on actual 'str' objects, like 'str.join', needs an explicit 'str(message)'."""
+	#=============================
+	
+	__slots__ = ("lang", "string", "formatDict", "_text")
+	
+	def __init__(self, lang, string, formatDict={}):
+		self.lang = lang
+		self.string = string
+		self.formatDict = formatDict
+		self._text = None
+	
+	def __str__(self):
+		if self._text is None:
+			self._text = self.lang.gettext(self.string, formatDict=self.formatDict)
+		return self._text
+	
+	def __repr__(self):
+		return "{className}({string!r})".format(className=self.__class__.__name__, string=self.string)
+	
+	def __format__(self, formatSpec):
+		return format(str(self), formatSpec)
+	
+	def __add__(self, other):
+		return str(self)+other
+	
+	def __radd__(self, other):
+		return other+str(self)
+	
+	def __eq__(self, other):
+		if isinstance(other, (str, LazyMessage)):
+			return str(self) == str(other)
+		return NotImplemented
+	
+	def __hash__(self):
+		return hash(str(self))
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+
+#=======================================================================================
+# Imports
+#=======================================================================================
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+from lib.base import *
+from lib.localization import Lang
+
+#=======================================================================================
+# Localization
+#=======================================================================================
+
+_ = Lang( "manager", autodetect=False).gettext
+
+#=======================================================================================
+# Library
+#=======================================================================================
+
+#==========================================================
+# Exceptions
+#==========================================================
+
+#==========================================================
+class ManagerError(ErrorWithCodes):
+	
+	#=============================
+	"""Errors related to talking to the resident manager."""
+	#=============================
+	
+	codes = ErrorCodes()
+	codes.NOT_RUNNING = 0
+	codes.PROTOCOL = 1
+	codes.UNKNOWN_ACTION = 2
+	codes.REMOTE_ERROR = 3
+	codes.ALREADY_RUNNING = 4
+
+#==========================================================
+# Protocol
+#==========================================================
+
+#==========================================================
+class ManagerProtocol(object):
+	
+	#=============================
+	"""The manager talks newline delimited JSON over a Unix domain socket; one message per line.
+	A request looks like this:
+		{"id": 1, "action": "call", "params": {"capp": "mn1", "method": "getblockcount"}}
+	and is answered by any number of item messages (for actions that stream their results),
+	followed by exactly one final message:
+		{"id": 1, "item": ...}
+		{"id": 1, "done": true, "result": ...}
+		{"id": 1, "done": true, "error": {"type": "CappNotFoundError", "message": "..."}}
+	A connection can be used for any number of requests, one after the other."""
+	#=============================
+	
+	# Defaults
+	defaultSocketPath = os.path.join(os.environ.get("XDG_RUNTIME_DIR", os.path.join(os.path.expanduser("~"), ".cache")),\
+		"cappman", "manager.sock")
+	
+	@classmethod
+	def socketPath(cls):
+		"""The socket path to use: $CAPPMAN_SOCKET if set, 'defaultSocketPath' otherwise."""
+		return os.environ.get("CAPPMAN_SOCKET", cls.defaultSocketPath)
+	
+	@classmethod
+	def encode(cls, message):
+		# Results may contain objects JSON can't represent (e.g. paths as custom objects); send those as text.
+		return (json.dumps(message, default=str, separators=(",", ":"))+"\n").encode()
+	
+	@classmethod
+	def decode(cls, line):
+		try:
+			message = json.loads(line.decode())
+		except ValueError as error:
+			raise ManagerError(_("Malformed manager message: {line}", formatDict={"line": line[:200]}),\
+				ManagerError.codes.PROTOCOL) from error
+		if not isinstance(message, dict):
+			raise ManagerError(_("Malformed manager message: {line}", formatDict={"line": line[:200]}),\
+				ManagerError.codes.PROTOCOL)
+		return message
+
+#==========================================================
+# Server
+#==========================================================
+
+#==========================================================
+class Manager(object):
+	
+	#=============================
+	"""Keeps the capps loaded, along with their open RPC connections and whatever they cache, for
+	as long as it runs, and performs actions on them on behalf of clients.
+	Actions are plain callables taking keyword arguments, registered by name with 'addHandler'.
+	Callables returning a generator stream its items to the client, followed by its return value."""
+	#=============================
+	
+	def __init__(self, defaults=None, capps=None):
+		from lib.capps import Capps
+		if capps is None:
+			if defaults is None:
+				from lib.cappconfig import Defaults
+				defaults = Defaults()
+			capps = Capps(defaults.cappConfigDirPath, defaults=defaults)
+		self.capps = capps
+		self.loaded = {}
+		self.loadErrors = []
+		self.startTime = time.time()
+		self.lock = threading.RLock()
+		self.handlers = {}
+		for name, handler in [("ping", self.ping), ("capps", self.listCapps), ("call", self.call),\
+			("reload", self.reload), ("loadErrors", self.listLoadErrors), ("run", self.run),\
+			("cacheStats", self.cacheStats), ("status", self.status), ("dedup", self.dedup)]:
+			self.addHandler(name, handler)
+	
+	def addHandler(self, name, handler):
+		self.handlers[name] = handler
+	
+	def reload(self, name=None, flavor=None, capplib=None):
+		"""(Re-)load all (or only the matching) capps and return a summary of how that went.
+		Flavors and capplibs are resolved anew, so edits to them since are picked up too."""
+		from lib.plugins import PythonLibPlugin
+		PythonLibPlugin.forgetChangedModules()
+		capps = self.capps.renewed()
+		loaded = {}
+		for capp in capps.filter(name=name, flavor=flavor, capplib=capplib):
+			loaded[capp.config.name] = capp
+		with self.lock:
+			previous = self.loaded
+			self.capps = capps
+			self.loaded = loaded
+			self.loadErrors = list(capps.loadErrors)
+		for capp in previous.values():
+			if hasattr(capp, "disconnect"):
+				capp.disconnect()
+		return {"loaded": sorted(loaded.keys()), "errors": [loadResult.description for loadResult in self.loadErrors]}
+	
+	def resumeDeletions(self):
+		"""Finish background deletions that a process (e.g. a one-off 'cappman run') didn't get to finish."""
+		with self.lock:
+			capps = list(self.loaded.values())
+		for capp in capps:
+			if hasattr(capp, "resumeDeletion"):
+				try:
+					capp.resumeDeletion()
+				except OSError:
+					pass # The manager serves all the same; the next deletion in that datadir retries.
+	
+	def getCapp(self, name):
+		from lib.capps import CappNotFoundError
+		with self.lock:
+			try:
+				return self.loaded[name]
+			except KeyError:
+				raise CappNotFoundError(_("No capp named \"{name}\" is loaded.", formatDict={"name": name}))
+	
+	#=============================
+	# Handlers
+	#=============================
+	
+	def ping(self):
+		return {"pid": os.getpid(), "uptime": time.time()-self.startTime, "capps": len(self.loaded)}
+	
+	def listCapps(self):
+		with self.lock:
+			capps = list(self.loaded.values())
+		return [{"name": capp.config.name, "flavor": capp.config.cappFlavorName,\
+			"capplib": self.capps.getCappLibName(capp.config.cappFlavorName)} for capp in capps]
+	
+	def listLoadErrors(self):
+		with self.lock:
+			return [loadResult.description for loadResult in self.loadErrors]
+	
+	def call(self, capp, method, params=[]):
+		return self.getCapp(capp).call(method, *params)
+	
+	def status(self, name=None, flavor=None, capplib=None, maxWorkers=None):
+		"""Stream a status row (see 'CappStatusTable') per matching capp as it answers."""
+		rows = self.capps.iterStatus(capps=self.selectCapps(name=name, flavor=flavor, capplib=capplib),\
+			maxWorkers=maxWorkers)
+		while True:
+			try:
+				yield FormattedNamespace(next(rows)).asDict
+			except StopIteration as stop:
+				return stop.value
+	
+	def dedup(self, name=None, flavor=None, capplib=None, maxWorkers=None, dryRun=False):
+		"""Deduplicate the block files of the matching capps (see 'Capps.dedupBlockFiles')."""
+		return self.capps.dedupBlockFiles(capps=self.selectCapps(name=name, flavor=flavor, capplib=capplib),\
+			maxWorkers=maxWorkers, dryRun=dryRun)
+	
+	def cacheStats(self):
+		"""The status cache counters of each capp that has one."""
+		with self.lock:
+			capps = list(self.loaded.values())
+		return {capp.config.name: capp.statusCache.stats for capp in capps if hasattr(capp, "statusCache")}
+	
+	def selectCapps(self, name=None, flavor=None, capplib=None):
+		"""The loaded capps matching all of the specified criteria."""
+		with self.lock:
+			capps = list(self.loaded.values())
+		return [capp for capp in capps if (name is None or capp.config.name == name)\
+			and (flavor is None or capp.config.cappFlavorName == flavor)\
+			and (capplib is None or self.capps.getCappLibName(capp.config.cappFlavorName) == capplib)]
+	
+	def run(self, command, args=[], name=None, flavor=None, capplib=None, maxWorkers=None, perHostLimit=None):
+		"""Run a fan-out command (see 'CappFanOut') on the matching capps, streaming a result per capp."""
+		fanOut = self.capps.fanOut(command, args=args, capps=self.selectCapps(name=name, flavor=flavor, capplib=capplib),\
+			maxWorkers=maxWorkers, perHostLimit=perHostLimit)
+		results = fanOut.iterResults()
+		while True:
+			try:
+				yield next(results).toDict()
+			except StopIteration as stop:
+				return stop.value.json
+	
+	#=============================
+	
+	def handle(self, action, params):
+		"""Perform 'action' and return its result (or generator, for streaming actions)."""
+		try:
+			handler = self.handlers[action]
+		except KeyError:
+			raise ManagerError(_("Unknown manager action: {action}", formatDict={"action": action}),\
+				ManagerError.codes.UNKNOWN_ACTION)
+		return handler(**params)
+	
+	def serve(self, socketPath=None):
+		"""Load the capps and serve requests on 'socketPath' until interrupted."""
+		if socketPath is None:
+			socketPath = ManagerProtocol.socketPath()
+		self.reload()
+		self.resumeDeletions()
+		server = ManagerServer(socketPath, self)
+		try:
+			server.serve_forever()
+		finally:
+			server.close()
+
+#==========================================================
+class ManagerRequestHandler(object):
+	
+	#=============================
+	"""Answers the requests coming in on one client connection."""
+	#=============================
+	
+	def __init__(self, request, clientAddress, server):
+		self.connection = request
+		self.manager = server.manager
+		try:
+			self.handleConnection()
+		finally:
+			self.connection.close()
+	
+	def send(self, message):
+		self.connection.sendall(ManagerProtocol.encode(message))
+	
+	def handleConnection(self):
+		with self.connection.makefile("rb") as reader:
+			for line in reader:
+				if line.strip() == b"":
+					continue
+				try:
+					request = ManagerProtocol.decode(line)
+				except ManagerError as error:
+					self.send({"id": None, "done": True, "error": {"type": "ManagerError", "message": str(error)}})
+					return
+				self.handleRequest(request)
+	
+	def handleRequest(self, request):
+		requestId = request.get("id")
+		try:
+			result = self.manager.handle(request.get("action"), request.get("params") or {})
+			if hasattr(result, "__next__"):
+				items = result
+				while True:
+					try:
+						self.send({"id": requestId, "item": next(items)})
+					except StopIteration as stop:
+						result = stop.value
+						break
+		except Exception as error:
+			self.send({"id": requestId, "done": True, "error": {"type": error.__class__.__name__, "message": str(error)}})
+			return
+		self.send({"id": requestId, "done": True, "result": result})
+
+#==========================================================
+class ManagerServer(object):
+	
+	#=============================
+	"""The Unix domain socket server a 'Manager' is reached through. Only the owner of the socket
+	file (as created, mode 0600) can connect. A stale socket left by a manager that's gone is
+	replaced; one that a manager still answers on isn't."""
+	#=============================
+	
+	def __init__(self, socketPath, manager):
+		import socketserver
+		self.socketPath = socketPath
+		self.manager = manager
+		os.makedirs(os.path.dirname(socketPath), mode=0o700, exist_ok=True)
+		if os.path.exists(socketPath):
+			if ManagerClient(socketPath).running:
+				raise ManagerError(_("A manager is already running on {socketPath}.", formatDict={"socketPath": socketPath}),\
+					ManagerError.codes.ALREADY_RUNNING)
+			os.remove(socketPath)
+		class Server(socketserver.ThreadingUnixStreamServer):
+			daemon_threads = True
+		Server.manager = manager
+		oldUmask = os.umask(0o177)
+		try:
+			self.server = Server(socketPath, ManagerRequestHandler)
+		finally:
+			os.umask(oldUmask)
+	
+	def serve_forever(self, poll_interval=0.5):
+		self.server.serve_forever(poll_interval=poll_interval)
+	
+	def shutdown(self):
+		self.server.shutdown()
+	
+	def close(self):
+		self.server.server_close()
+		try:
+			os.remove(self.socketPath)
+		except FileNotFoundError:
+			pass
+
+#==========================================================
+# Client
+#==========================================================
+
+#==========================================================
+class ManagerClient(object):
+	
+	#=============================
+	"""A connection to a resident manager. Raises 'ManagerError' with the 'NOT_RUNNING' code if
+	there's no manager to connect to, so callers can fall back on doing the work themselves.
+	Not to be shared between threads; requests on one connection are answered one by one."""
+	#=============================
+	
+	# Defaults
+	defaultTimeout = 120
+	
+	def __init__(self, socketPath=None, timeout=defaultTimeout):
+		self.socketPath = ManagerProtocol.socketPath() if socketPath is None else socketPath
+		self.timeout = timeout
+		self._socket = None
+		self._reader = None
+		self._lastId = 0
+	
+	def connect(self):
+		connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		connection.settimeout(self.timeout)
+		try:
+			connection.connect(self.socketPath)
+		except OSError as error:
+			connection.close()
+			raise ManagerError(_("No manager running on {socketPath}: {error}",\
+				formatDict={"socketPath": self.socketPath, "error": error}), ManagerError.codes.NOT_RUNNING) from error
+		self._socket = connection
+		self._reader = connection.makefile("rb")
+	
+	def close(self):
+		if not self._socket is None:
+			self._reader.close()
+			self._socket.close()
+			self._socket = None
+			self._reader = None
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		self.close()
+	
+	@property
+	def running(self):
+		"""Whether a manager answers on our socket."""
+		try:
+			self.request("ping")
+			return True
+		except ManagerError:
+			return False
+		finally:
+			self.close()
+	
+	def stream(self, action, **params):
+		"""Send a request and yield the items of a streaming action as they come in.
+		The final result (if any) is the generator's return value."""
+		if self._socket is None:
+			self.connect()
+		self._lastId += 1
+		requestId = self._lastId
+		try:
+			self._socket.sendall(ManagerProtocol.encode({"id": requestId, "action": action, "params": params}))
+			while True:
+				line = self._reader.readline()
+				if line == b"":
+					raise ManagerError(_("The manager closed the connection."), ManagerError.codes.PROTOCOL)
+				message = ManagerProtocol.decode(line)
+				if not message.get("id") == requestId:
+					continue
+				if not message.get("done"):
+					yield message.get("item")
+					continue
+				if "error" in message:
+					raise ManagerError("{type}: {message}".format(**message["error"]), ManagerError.codes.REMOTE_ERROR)
+				return message.get("result")
+		except OSError as error:
+			self.close()
+			raise ManagerError(_("Lost the connection to the manager: {error}", formatDict={"error": error}),\
+				ManagerError.codes.PROTOCOL) from error
+		except GeneratorExit:
+			# The caller stopped listening midway; the rest of the answer would be mistaken for the next one's.
+			self.close()
+			raise
+	
+	def request(self, action, **params):
+		"""Send a request and return its result. Streamed items, if any, are returned as a list."""
+		stream = self.stream(action, **params)
+		items = []
+		while True:
+			try:
+				items.append(next(stream))
+			except StopIteration as stop:
+				return items if len(items) > 0 and stop.value is None else stop.value
@@ -4,9 +4,10 @@
 #=======================================================================================
 # Imports
 #=======================================================================================
-import importlib
 import sys
 import os
+import json
+import threading
 import configparser 
 from lib.localization import Lang
 from lib.base import *
@@ -16,7 +17,8 @@ from lib.configutils import *
 # Localization
 #=======================================================================================
 
-_ = Lang( "plugins", autodetect=False).gettext
+lang = Lang( "plugins", autodetect=False)
+_ = lang.gettext
 
 #=======================================================================================
 # Library
@@ -44,6 +46,7 @@ class PythonLibPluginError(ErrorWithCodes):
 	
 	# Error codes.
 	MODULE_NOT_LOADED = 0
+	NOT_FOUND = 1
 
 #==========================================================
 class ConfigPluginError(ErrorWithCodes):
@@ -55,6 +58,202 @@ class ConfigPluginError(ErrorWithCodes):
 	# Error codes.
 	MISSING_CONFIG = 0
 	MISSING_CONFIGSETUP = 1
+	NOT_FOUND = 2
+
+#==========================================================
+# Plugin Index
+#==========================================================
+
+#==========================================================
+class PluginIndexEntry(object):
+	
+	#=============================
+	"""Where a plugin was found: its 'path', the plugin dir of its kind it's in ('dirPath'),
+	and the 'precedence' of that dir (the position of its base dir in the list of plugin dirs)."""
+	#=============================
+	
+	__slots__ = ("name", "path", "dirPath", "precedence")
+	
+	def __init__(self, name, path, dirPath, precedence):
+		self.name = name
+		self.path = path
+		self.dirPath = dirPath
+		self.precedence = precedence
+	
+	def toList(self):
+		return [self.name, self.path, self.dirPath, self.precedence]
+
+#==========================================================
+class PluginIndex(object):
+	
+	#=============================
+	"""All the plugins in a list of plugin dirs, found by scanning each of them once.
+	Every kind of plugin lives in a subdir of its own (e.g. "capplibs") of each plugin dir. If a
+	plugin of the same kind and name is in several of them, the one in the first plugin dir listed
+	takes precedence. Lookups by kind and name don't touch the filesystem.
+	
+	Use 'PluginIndex.get' to share one index per list of plugin dirs for the whole process.
+	If 'manifestCache' is set, the scan results are kept on disk and reused for as long as
+	the mtimes of the scanned dirs stay the same."""
+	#=============================
+	
+	# Defaults
+	manifestCache = None
+	indexes = {}
+	indexesLock = threading.Lock()
+	
+	# The kinds of plugin dirs, with the prefix python module plugins of that kind have ('None' for
+	# non-python plugins).
+	kinds = {"capplibs": "capplib_", "cappextensions": "", "cappflavors": None, "languages": None}
+	
+	#===============
+	# Constructor
+	
+	def __init__(self, pluginDirPaths):
+		self.pluginDirPaths = list(pluginDirPaths)
+		self.stamps = None
+		self.entries = {}
+		self.load()
+	
+	@classmethod
+	def get(cls, pluginDirPaths):
+		"""The process-wide index for 'pluginDirPaths', rescanned if the dirs changed since it was made."""
+		key = tuple(pluginDirPaths)
+		with cls.indexesLock:
+			index = cls.indexes.get(key)
+			if index is None:
+				index = cls.indexes[key] = cls(pluginDirPaths)
+			else:
+				index.refresh()
+			return index
+	
+	def scannedDirPaths(self):
+		"""Every dir whose contents the index reflects."""
+		dirPaths = []
+		for pluginDirPath in self.pluginDirPaths:
+			dirPaths.append(pluginDirPath)
+			for kind in self.__class__.kinds.keys():
+				dirPaths.append(os.path.join(pluginDirPath, kind))
+		return dirPaths
+	
+	def currentStamps(self):
+		"""The mtimes of all scanned dirs ('None' for dirs that don't exist)."""
+		stamps = []
+		for dirPath in self.scannedDirPaths():
+			try:
+				stamps.append(os.stat(dirPath).st_mtime_ns)
+			except OSError:
+				stamps.append(None)
+		return stamps
+	
+	def pluginName(self, kind, dirEntry):
+		"""The name of the plugin a dir entry is, or 'None' if it's not a plugin (e.g. '__pycache__')."""
+		if dirEntry.name.startswith(".") or dirEntry.name.startswith("_"):
+			return None
+		if kind == "cappflavors":
+			return dirEntry.name if dirEntry.is_file() else None
+		if kind == "languages":
+			return dirEntry.name if dirEntry.is_dir() else None
+		prefix = self.__class__.kinds[kind]
+		if not dirEntry.name.startswith(prefix):
+			return None
+		if dirEntry.is_dir():
+			return dirEntry.name[len(prefix):]
+		if dirEntry.name.endswith(".py"):
+			return dirEntry.name[len(prefix):-len(".py")]
+		return None
+	
+	def scan(self):
+		"""Return the entries of all plugin dirs, as a dict of dicts (kind -> name -> 'PluginIndexEntry')."""
+		entries = {kind: {} for kind in self.__class__.kinds.keys()}
+		for precedence, pluginDirPath in enumerate(self.pluginDirPaths):
+			for kind in self.__class__.kinds.keys():
+				dirPath = os.path.join(pluginDirPath, kind)
+				try:
+					dirEntries = list(os.scandir(dirPath))
+				except OSError:
+					continue
+				for dirEntry in sorted(dirEntries, key=lambda dirEntry: dirEntry.name):
+					name = self.pluginName(kind, dirEntry)
+					if not name is None and not name in entries[kind]:
+						entries[kind][name] = PluginIndexEntry(name, dirEntry.path, dirPath, precedence)
+		return entries
+	
+	def load(self):
+		"""(Re-)build the index, from the manifest cache if it has a current manifest."""
+		stamps = self.currentStamps()
+		manifestCache = self.__class__.manifestCache
+		entries = None if manifestCache is None else manifestCache.restore(self, stamps)
+		if entries is None:
+			entries = self.scan()
+			if not manifestCache is None:
+				manifestCache.store(self, stamps, entries)
+		self.entries = entries
+		self.stamps = stamps
+	
+	def refresh(self):
+		"""Rebuild the index if any of the scanned dirs changed. Return 'True' if it was rebuilt."""
+		if self.currentStamps() == self.stamps:
+			return False
+		self.load()
+		return True
+	
+	def find(self, kind, name):
+		"""The 'PluginIndexEntry' for the plugin of the specified kind and name, or 'None'."""
+		return self.entries.get(kind, {}).get(name)
+	
+	def names(self, kind):
+		return sorted(self.entries.get(kind, {}).keys())
+	
+	def dirPaths(self, kind):
+		"""The existing plugin dirs of the specified kind, in order of precedence."""
+		stamps = dict(zip(self.scannedDirPaths(), self.stamps))
+		return [os.path.join(pluginDirPath, kind) for pluginDirPath in self.pluginDirPaths\
+			if not stamps[os.path.join(pluginDirPath, kind)] is None]
+
+#==========================================================
+class PluginManifestCache(object):
+	
+	#=============================
+	"""Keeps the scan results of 'PluginIndex' objects on disk, one manifest file per list of plugin dirs.
+	A manifest is valid for as long as the mtimes of the dirs it was made from stay the same.
+	Adding, removing or renaming a plugin changes the mtime of its dir, editing one doesn't; as
+	the index only records where plugins are, that's all it takes."""
+	#=============================
+	
+	# Defaults
+	defaultDirPath = os.path.join(os.path.expanduser("~"), ".cache", "cappman", "pluginmanifests")
+	formatVersion = 1
+	
+	def __init__(self, dirPath=defaultDirPath):
+		self.dirPath = dirPath
+	
+	def manifestFilePath(self, index):
+		import hashlib
+		digest = hashlib.sha256(json.dumps([self.__class__.formatVersion, index.pluginDirPaths]).encode()).hexdigest()
+		return os.path.join(self.dirPath, "{digest}.json".format(digest=digest))
+	
+	def restore(self, index, stamps):
+		"""Return the entries of the manifest for 'index', or 'None' if there's no valid one."""
+		try:
+			with open(self.manifestFilePath(index), "r") as manifestFile:
+				manifest = json.load(manifestFile)
+			if not manifest.get("stamps") == stamps:
+				return None
+			return {kind: {entry[0]: PluginIndexEntry(*entry) for entry in kindEntries}\
+				for kind, kindEntries in manifest["entries"].items()}
+		except (OSError, ValueError, TypeError, KeyError, AttributeError):
+			return None
+	
+	def store(self, index, stamps, entries):
+		"""Write the manifest for 'index'. Failing to do so is not an error, just a rescan next time."""
+		try:
+			data = json.dumps({"stamps": stamps, "entries": {kind: [entry.toList() for entry in kindEntries.values()]\
+				for kind, kindEntries in entries.items()}})
+			os.makedirs(self.dirPath, exist_ok=True)
+			File(self.manifestFilePath(index)).writeAtomically(data)
+		except (TypeError, ValueError, OSError):
+			pass
 
 #==========================================================
 # Plugin Classes
@@ -75,11 +274,16 @@ class Plugins(object):
 class Plugin(object):
 	
 	#=============================
-	"""Base class for various plugin classes."""
+	"""Base class for various plugin classes.
+	If a 'PluginIndex' is specified, the plugin is looked up in it instead of in 'dirPaths'."""
 	#=============================
 	
-	def __init__(self, dirPaths):
+	# The kind of plugin dir plugins of this class live in (see 'PluginIndex.kinds').
+	kind = None
+	
+	def __init__(self, dirPaths, index=None):
 		self.dirPaths = dirPaths
+		self.index = index
 	
 	@property
 	def existingDirPaths(self):
@@ -88,9 +292,21 @@ class Plugin(object):
 		for dirPath in self.dirPaths:
 			if os.path.exists(dirPath):
 				existingPaths.append(dirPath)
-		if len(existingPaths) is 0:
+		if len(existingPaths) == 0:
 			raise PluginError(_("No existing directory paths are configured for this plugin. The following paths are configured, but don't exist: {dirPaths}", formatDict={"dirPaths": self.dirPaths}), PluginError.NO_VALID_DIRS)
 		return existingPaths
+	
+	def locate(self, name, fileNames):
+		"""Return the 'PluginIndexEntry' of the plugin named 'name', or 'None' if there's no such plugin.
+		Without an index, the first of 'self.dirPaths' containing one of 'fileNames' wins."""
+		if not self.index is None:
+			return self.index.find(self.__class__.kind, name)
+		for precedence, dirPath in enumerate(self.existingDirPaths):
+			for fileName in fileNames:
+				path = os.path.join(dirPath, fileName)
+				if os.path.exists(path):
+					return PluginIndexEntry(name, path, dirPath, precedence)
+		return None
 
 #==========================================================
 class PythonLibPlugin(Plugin):
@@ -99,36 +315,163 @@ class PythonLibPlugin(Plugin):
 	# """Base class for plugins consisting of python libraries to be integrated and used with the runtime environment."""
 	#=============================
 	
-	def __init__(self, dirPaths, name, packageName=None):
-		super().__init__(dirPaths=dirPaths)
+	# The modules of all python plugins loaded so far, keyed by the real path of their source file,
+	# so each one is only executed once per process, no matter how many plugin objects refer to it.
+	modules = {}
+	# The (mtime, size) of their source files as they were executed, keyed the same way.
+	moduleStamps = {}
+	loadLock = threading.RLock()
+	
+	def __init__(self, dirPaths, name, packageName=None, index=None):
+		super().__init__(dirPaths=dirPaths, index=index)
 		self.prefix = "capplib"
 		self.name = name
 		self.moduleName = "{prefix}_{name}".format(prefix=self.prefix, name=self.name)
 		self.packageName = packageName
+		self.spec = None
 	
 	@property
 	def module(self):
+		"""The python module of the plugin. If it was loaded lazily, it's executed on first access."""
 		try:
 			return self._module
 		except AttributeError:
+			pass
+		if self.spec is None:
 			raise PythonLibPluginError(_("Attempted to access the python module of a PythonLibPlugin named {name}, but none was loaded yet.",\
 				formatDict={"name": self.name}), PythonLibPluginError.MODULE_NOT_LOADED)
+		self._module = self.__class__.importSpec(self.spec)
+		return self._module
 	
 	@module.setter
 	def module(self, moduleToSet):
 		self._module = moduleToSet
 	
+	@classmethod
+	def moduleSpec(cls, path):
+		"""The module spec for the python module (a file or a package dir) at 'path'."""
+		import hashlib
+		import importlib.util
+		path = os.path.realpath(path)
+		if os.path.isdir(path):
+			sourceFilePath, searchLocations = os.path.join(path, "__init__.py"), [path]
+		else:
+			sourceFilePath, searchLocations = path, None
+		# A module that's importable the regular way as well (like the ones that come with cappman, which
+		# other capplibs import to build on) gets the same name, so there's only ever one copy of it.
+		# Otherwise it's named after the path as well, so same-named modules in different plugin dirs
+		# don't collide in 'sys.modules'.
+		moduleName = cls.importableName(path, sourceFilePath)
+		if moduleName is None:
+			moduleName = "{name}_{digest}".format(name=os.path.splitext(os.path.basename(path))[0],\
+				digest=hashlib.sha256(path.encode()).hexdigest()[:16])
+		return importlib.util.spec_from_file_location(moduleName, sourceFilePath, submodule_search_locations=searchLocations)
 	
+	@classmethod
+	def importableName(cls, path, sourceFilePath):
+		"""The name the module at the real 'path' can be imported by through 'sys.path' (e.g.
+		"plugins.capplibs.capplib_bitcoin"), or 'None' if there's no such name."""
+		import importlib.util
+		modulePath = path if os.path.isdir(path) else os.path.splitext(path)[0]
+		for searchPath in sys.path:
+			relativePath = os.path.relpath(modulePath, os.path.realpath(searchPath or os.curdir))
+			moduleName = relativePath.replace(os.sep, ".")
+			if not all([part.isidentifier() for part in moduleName.split(".")]):
+				continue # Not inside this search path.
+			try:
+				spec = importlib.util.find_spec(moduleName)
+			except (ImportError, ValueError):
+				continue
+			if not spec is None and not spec.origin is None and os.path.realpath(spec.origin) == sourceFilePath:
+				return moduleName
+		return None
 	
-	def load(self):
-		"""Loads the plugin with or without package (according to parameters) into sys.path and imports it."""
-		for dirPath in self.existingDirPaths:
-			if not dirPath in sys.path:
-				sys.path.insert(1, dirPath)
-				#print("[DEBUG plugins.py.PythonLibPlugin.load] dirPath: ", dirPath, "sys.path", sys.path)
-		
-		self.module = __import__(name=self.moduleName, globals=globals(), locals=locals(), fromlist=[], level=0)
-		#print("[DEBUG] [plugins.py.PythonLibPlugin.load] Module:", self.module, "|| Module name:", self.name)
+	@classmethod
+	def importSpec(cls, spec):
+		"""Execute the module of 'spec' and return it, or return it right away if that happened before
+		(including by a regular import)."""
+		import importlib.util
+		# Capps may be loaded from several threads at once; execute every module just once all the same.
+		with cls.loadLock:
+			try:
+				return cls.modules[spec.origin]
+			except KeyError:
+				pass
+			module = sys.modules.get(spec.name)
+			if not module is None and os.path.realpath(getattr(module, "__file__", "")) == spec.origin:
+				cls.addModule(module, spec.origin)
+				return module
+			module = importlib.util.module_from_spec(spec)
+			sys.modules[spec.name] = module
+			try:
+				spec.loader.exec_module(module)
+			except BaseException:
+				del sys.modules[spec.name]
+				raise
+			cls.addModule(module, spec.origin)
+			return module
+	
+	@classmethod
+	def addModule(cls, module, origin):
+		"""Keep a loaded module, along with the stamp of its source, and likewise the python plugins of
+		the same kind (in a dir of the same name) it imports the regular way, so a change to any of
+		them is noticed by 'forgetChangedModules'. Assumes the load lock is held."""
+		cls.modules[origin] = module
+		cls.moduleStamps[origin] = cls.sourceStamp(origin)
+		kindDirName = os.path.basename(os.path.dirname(origin))
+		for value in list(vars(module).values()):
+			name = getattr(value, "__module__", getattr(value, "__name__", None))
+			dependency = sys.modules.get(name) if isinstance(name, str) else None
+			if getattr(dependency, "__file__", None) is None:
+				continue
+			dependencyOrigin = os.path.realpath(dependency.__file__)
+			if not dependencyOrigin in cls.modules and os.path.basename(os.path.dirname(dependencyOrigin)) == kindDirName:
+				cls.addModule(dependency, dependencyOrigin)
+	
+	@classmethod
+	def sourceStamp(cls, path):
+		try:
+			fileStat = os.stat(path)
+		except OSError:
+			return None
+		return (fileStat.st_mtime_ns, fileStat.st_size)
+	
+	@classmethod
+	def forgetChangedModules(cls):
+		"""Forget the loaded modules whose source was changed since they were executed, along with
+		those building on them, so they're executed anew the next time they're loaded. Plugin
+		objects already loaded keep their modules. Returns the names of the forgotten modules."""
+		with cls.loadLock:
+			# Deleted ones aren't found to be loaded again anyway.
+			origins = set([origin for origin, stamp in cls.moduleStamps.items()\
+				if not cls.sourceStamp(origin) in [stamp, None]])
+			names = set([cls.modules[origin].__name__ for origin in origins])
+			# Modules building on others import them or things from them.
+			while True:
+				dependentOrigins = set([origin for origin, module in cls.modules.items() if not origin in origins\
+					and any([getattr(value, "__module__", getattr(value, "__name__", None)) in names\
+						for value in vars(module).values()])])
+				if len(dependentOrigins) == 0:
+					break
+				origins |= dependentOrigins
+				names |= set([cls.modules[origin].__name__ for origin in dependentOrigins])
+			for origin in origins:
+				module = cls.modules.pop(origin)
+				del cls.moduleStamps[origin]
+				if sys.modules.get(module.__name__) is module:
+					del sys.modules[module.__name__]
+			return sorted(names)
+	
+	def load(self, lazy=False):
+		"""Import the plugin's module from the path it was found at, without touching 'sys.path'.
+		If 'lazy' is 'True', the module's code is only executed once 'self.module' is first accessed."""
+		entry = self.locate(self.name, [self.moduleName+".py", self.moduleName])
+		if entry is None:
+			raise PythonLibPluginError(_("No python module named {moduleName} found in any of the specified directories: {dirPathListing}",\
+				formatDict={"moduleName": self.moduleName, "dirPathListing": self.dirPaths}), PythonLibPluginError.NOT_FOUND)
+		self.spec = self.__class__.moduleSpec(entry.path)
+		if not lazy:
+			self.module
 
 #==========================================================
 class ConfigPlugin(Plugin):
@@ -139,13 +482,12 @@ class ConfigPlugin(Plugin):
 	is called, by assigning 'self.configSetup' with a 'ConfigSetup' object."""
 	#=============================
 	
-	def __init__(self, dirPaths, name, configSetup=None):
-		super().__init__(dirPaths=dirPaths)
+	def __init__(self, dirPaths, name, configSetup=None, index=None):
+		super().__init__(dirPaths=dirPaths, index=index)
 		self.name = name
-		self.configSetup = configSetup
 		self._config = None
-		self._configSetup = None
-		self.pluginInfoString = _("ConfigPlugin of the {pluginType} and the name \"{name}\"",\
+		self.configSetup = configSetup
+		self.pluginInfoString = lang.lazy("ConfigPlugin of the {pluginType} and the name \"{name}\"",\
 			formatDict={"pluginType": self.__class__, "name": self.name})
 
 	@property
@@ -176,15 +518,16 @@ class ConfigPlugin(Plugin):
 		"""Set the ConfigSetup which this plugin is supposed to represent."""
 		self._configSetup = configSetupObject
 	
-	def load(self, config=Config()):
+	def load(self, config=None):
 		"""Load the config from the first directory in the directory list containing a file with the specified name according to the specified ConfigSetup.
 		This must be called before the plugin is to be considered usable."""
-		for dirPath in self.existingDirPaths:
-			if self.name in os.listdir(dirPath):
-				self.config = self.configSetup.getConfig(configFilePaths=[os.path.join(dirPath, self.name)], config=config)
-				break
+		if config is None:
+			config = Config()
+		entry = self.locate(self.name, [self.name])
+		if entry is None:
 			raise ConfigPluginError(_("ConfigPlugin of the {configPluginType} type with the name \"{name}\" not found in any of the specified directories: {dirPathListing}",\
-				formatDict={"configPluginType": self.__class__, "name": self.name, "dirPathListing": self.dirPaths}), 0)
+				formatDict={"configPluginType": self.__class__, "name": self.name, "dirPathListing": self.dirPaths}), ConfigPluginError.NOT_FOUND)
+		self.config = self.configSetup.getConfig(configFilePaths=[entry.path], config=config)
 
 #==========================================================
 class CappLibPlugin(PythonLibPlugin):
@@ -195,8 +538,10 @@ class CappLibPlugin(PythonLibPlugin):
 	the crypto application they've been written for."""
 	#=============================
 	
-	def __init__(self, dirPaths, name):
-		super().__init__(dirPaths, name, packageName="capplibs")
+	kind = "capplibs"
+	
+	def __init__(self, dirPaths, name, index=None):
+		super().__init__(dirPaths, name, packageName="capplibs", index=index)
 
 #==========================================================
 class CappExtensionPlugin(PythonLibPlugin):
@@ -204,7 +549,8 @@ class CappExtensionPlugin(PythonLibPlugin):
 	#=============================
 	"""This type of plugin represents polymorphous mix-ins for capplibs."""
 	#=============================
-	pass
+	
+	kind = "cappextensions"
 
 #==========================================================
 class CappFlavorPlugin(ConfigPlugin):
@@ -213,11 +559,13 @@ class CappFlavorPlugin(ConfigPlugin):
 	"""A flavor represents a crypto application fork in the form of what's essentially a capplib-plugin config."""
 	#=============================
 	
-	def __init__(self, dirPaths, name):
+	kind = "cappflavors"
+	
+	def __init__(self, dirPaths, name, index=None):
 		flavorDirPaths = []
 		for dirPath in dirPaths:
-			flavorDirPaths.append(os.path.join(dirPath, "cappflavors"))
-		super().__init__(flavorDirPaths, name, configSetup=None)
+			flavorDirPaths.append(os.path.join(dirPath, self.__class__.kind))
+		super().__init__(flavorDirPaths, name, configSetup=None, index=index)
 	
 	def loadInitial(self, configSetup):
 		"""Loads the plugin with an initial ConfigSetup."""
@@ -237,4 +585,5 @@ class CappFlavorPlugin(ConfigPlugin):
 class LanguagePlugin(Plugin):
 	"""Represents gettext based translation files."""
 	#NOTE: Low development priority.
-	pass
\ No newline at end of file
+	
+	kind = "languages"
\ No newline at end of file
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+#-*- coding: utf-8 -*-
+
+#=======================================================================================
+# Imports
+#=======================================================================================
+
+import os
+import json
+import base64
+import threading
+import itertools
+from lib.base import *
+from lib.localization import Lang
+
+#=======================================================================================
+# Localization
+#=======================================================================================
+
+_ = Lang( "rpc", autodetect=False).gettext
+
+#=======================================================================================
+# Library
+#=======================================================================================
+
+#==========================================================
+# Exceptions
+#==========================================================
+
+#==========================================================
+class RpcError(ErrorWithCodes):
+
+	#=============================
+	"""Errors related to talking JSON-RPC to a daemon, as opposed to errors the daemon reports."""
+	#=============================
+
+	codes = ErrorCodes()
+	codes.CONNECTION_FAILED = 0
+	codes.CREDENTIALS_MISSING = 1
+	codes.UNAUTHORIZED = 2
+	codes.MALFORMED_RESPONSE = 3
+	codes.BATCH_NOT_SENT = 4
+
+#==========================================================
+class RpcResponseError(Error):
+
+	#=============================
+	"""An error object returned by the daemon in response to a call.
+	'rpcCode' is the daemon's own error code (e.g. -28 while the daemon is warming up)."""
+	#=============================
+
+	def __init__(self, method, rpcCode, rpcMessage):
+		self.method = method
+		self.rpcCode = rpcCode
+		self.rpcMessage = rpcMessage
+		super().__init__(_("RPC call \"{method}\" failed with error code {rpcCode}: {rpcMessage}",\
+			formatDict={"method": method, "rpcCode": rpcCode, "rpcMessage": rpcMessage}))
+
+#==========================================================
+# RPC Classes
+#==========================================================
+
+#==========================================================
+class RpcConfFile(object):
+
+	#=============================
+	"""The rpc relevant bits of a daemon's configuration file.
+	Bitcoin style conf files are plain "key=value" lines without a mandatory section header,
+	which is why we don't use configparser here."""
+	#=============================
+
+	def __init__(self, path):
+		self.path = path
+
+	def read(self):
+		"""Return a dict of all the key/value pairs found, or an empty dict if there's no such file."""
+		values = {}
+		if self.path is None or not os.path.isfile(self.path):
+			return values
+		with open(self.path, "r") as fileHandler:
+			for line in fileHandler:
+				line = line.strip()
+				if line == "" or line.startswith("#") or line.startswith("["):
+					continue
+				key, separator, value = line.partition("=")
+				if separator:
+					values[key.strip()] = value.strip()
+		return values
+
+#==========================================================
+class RpcCredentials(object):
+
+	#=============================
+	"""Where and how to reach a daemon's RPC interface.
+	'rpcuser'/'rpcpassword' from the conf file take precedence, otherwise the cookie file in the
+	datadir is used. The cookie is rewritten on each daemon start, which is why it's re-read
+	whenever 'reload' is called."""
+	#=============================
+
+	# Defaults
+	defaultHost = "127.0.0.1"
+	cookieFileName = ".cookie"
+
+	def __init__(self, dataDirPath, configFilePath=None, defaultPort=8332):
+		self.dataDirPath = dataDirPath
+		self.configFilePath = configFilePath
+		self.defaultPort = defaultPort
+		self.reload()
+
+	def reload(self):
+		"""(Re-)read the conf and cookie files."""
+		confValues = RpcConfFile(self.configFilePath).read()
+		self.host = confValues.get("rpcconnect", self.__class__.defaultHost)
+		self.port = int(confValues.get("rpcport", self.defaultPort))
+		self.user = confValues.get("rpcuser")
+		self.password = confValues.get("rpcpassword")
+		if self.user is None or self.password is None:
+			self.user, self.password = self.readCookie()
+
+	def readCookie(self):
+		"""Return a (user, password) tuple from the cookie file, or (None, None) if there's none."""
+		cookieFilePath = os.path.join(self.dataDirPath, self.__class__.cookieFileName)
+		try:
+			with open(cookieFilePath, "r") as fileHandler:
+				user, separator, password = fileHandler.read().strip().partition(":")
+		except (FileNotFoundError, PermissionError):
+			return (None, None)
+		if not separator:
+			return (None, None)
+		return (user, password)
+
+	@property
+	def available(self):
+		return not (self.user is None or self.password is None)
+
+	@property
+	def authHeader(self):
+		"""The value for the HTTP 'Authorization' header."""
+		if not self.available:
+			raise RpcError(_("No RPC credentials found in the conf file ({configFilePath}) or the datadir ({dataDirPath}).",\
+				formatDict={"configFilePath": self.configFilePath, "dataDirPath": self.dataDirPath}),\
+				RpcError.codes.CREDENTIALS_MISSING)
+		token = base64.b64encode("{user}:{password}".format(user=self.user, password=self.password).encode())
+		return "Basic {token}".format(token=token.decode())
+
+#==========================================================
+class RpcBatchCall(object):
+
+	#=============================
+	"""One call queued for a JSON-RPC batch request.
+	Once the batch has been sent, it carries either a result or an error of its own, so one failing
+	call doesn't take the rest of the batch with it. 'postProcess' is applied to the raw result."""
+	#=============================
+
+	def __init__(self, method, params=[], postProcess=None):
+		self.method = method
+		self.params = list(params)
+		self.postProcess = postProcess
+		self.done = False
+		self.error = None
+		self._result = None
+
+	def resolve(self, result=None, error=None):
+		"""Fill in the outcome of this call."""
+		if error is None and not self.postProcess is None:
+			try:
+				result = self.postProcess(result)
+			except (ValueError, TypeError) as postProcessError:
+				error = postProcessError
+		self._result = result
+		self.error = error
+		self.done = True
+
+	@property
+	def failed(self):
+		return not self.error is None
+
+	@property
+	def result(self):
+		"""The result of the call. Raises the call's error if it failed."""
+		if not self.done:
+			raise RpcError(_("The result of the batched call \"{method}\" was accessed before its batch was sent.",\
+				formatDict={"method": self.method}), RpcError.codes.BATCH_NOT_SENT)
+		if self.failed:
+			raise self.error
+		return self._result
+
+#==========================================================
+class RpcMethod(object):
+
+	#=============================
+	"""Declares a method that maps to exactly one daemon RPC call, e.g.:
+		getBlockCount = RpcMethod("getblockcount", postProcess=int)
+	The owning class has to provide 'call(method, *params)'. Methods declared this way can also
+	be queued in a batch by their name (see 'BitcoinCappBatch').
+	Methods that only report on the daemon's status can be declared 'cached'; calling these goes
+	through 'callCached(method, *params)' instead, which the owning class then has to provide too."""
+	#=============================
+
+	def __init__(self, method, *fixedParams, postProcess=None, cached=False):
+		self.method = method
+		self.fixedParams = list(fixedParams)
+		self.postProcess = postProcess
+		self.cached = cached
+
+	def params(self, params):
+		"""The complete parameter list for a call with the specified additional params."""
+		return self.fixedParams+list(params)
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self
+		def boundMethod(*params):
+			if self.cached:
+				result = instance.callCached(self.method, *self.params(params))
+			else:
+				result = instance.call(self.method, *self.params(params))
+			if self.postProcess is None:
+				return result
+			return self.postProcess(result)
+		return boundMethod
+
+#==========================================================
+class RpcConnection(object):
+
+	#=============================
+	"""A persistent keep-alive HTTP connection to a daemon's JSON-RPC interface.
+	The connection is opened on the first call and reused for all subsequent ones; if the daemon
+	closed it in the meantime, it's reopened once transparently. Calls are serialized, so one
+	object can be shared between threads; streamed calls ('iterCall') use a connection of their own."""
+	#=============================
+
+	# Defaults
+	defaultTimeout = 30
+	streamChunkSize = 64*1024
+
+	def __init__(self, credentials, timeout=defaultTimeout):
+		self.credentials = credentials
+		self.timeout = timeout
+		self._connection = None
+		self._lock = threading.Lock()
+		self._ids = itertools.count(1)
+
+	def connect(self):
+		"""Open a new connection; it's up to the caller to keep or close it."""
+		import http.client
+		return http.client.HTTPConnection(self.credentials.host, self.credentials.port, timeout=self.timeout)
+
+	def close(self):
+		with self._lock:
+			if not self._connection is None:
+				self._connection.close()
+				self._connection = None
+
+	def newId(self):
+		return next(self._ids)
+
+	def _send(self, connection, body, stream=False):
+		"""Send one request body on 'connection' ('None' for a new one) and return (connection, response,
+		response body). With 'stream', the body is 'None' and left unread for the caller to read.
+		On failure the connection is closed and 'RpcError' raised."""
+		import http.client
+		headers = {"Authorization": self.credentials.authHeader, "Content-Type": "application/json",\
+			"Connection": "keep-alive"}
+		for attempt in (0, 1):
+			fresh = connection is None
+			if fresh:
+				connection = self.connect()
+			try:
+				connection.request("POST", "/", body=body, headers=headers)
+				response = connection.getresponse()
+				responseBody = None if stream else response.read()
+				break
+			except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError,\
+				http.client.CannotSendRequest, http.client.BadStatusLine) as error:
+				# A kept alive connection the daemon has dropped in the meantime. Retry on a new one.
+				connection.close()
+				connection = None
+				if fresh or attempt == 1:
+					raise RpcError(_("Lost the RPC connection to {host}:{port}: {error}",\
+						formatDict={"host": self.credentials.host, "port": self.credentials.port, "error": error}),\
+						RpcError.codes.CONNECTION_FAILED) from error
+			except OSError as error: # Refused connections, timeouts and the like.
+				connection.close()
+				raise RpcError(_("Couldn't connect to the RPC interface at {host}:{port}: {error}",\
+					formatDict={"host": self.credentials.host, "port": self.credentials.port, "error": error}),\
+					RpcError.codes.CONNECTION_FAILED) from error
+		if response.status == 401:
+			connection.close()
+			raise RpcError(_("The daemon at {host}:{port} rejected our RPC credentials.",\
+				formatDict={"host": self.credentials.host, "port": self.credentials.port}),\
+				RpcError.codes.UNAUTHORIZED)
+		return (connection, response, responseBody)
+
+	def _post(self, body):
+		"""Send one request body on the shared connection and return (status, decoded json).
+		Assumes the lock is held."""
+		connection, self._connection = self._connection, None
+		self._connection, response, responseBody = self._send(connection, body)
+		try:
+			return (response.status, json.loads(responseBody.decode()))
+		except ValueError as error:
+			raise RpcError(_("Malformed RPC response (HTTP status {status}): {body}",\
+				formatDict={"status": response.status, "body": responseBody[:200]}),\
+				RpcError.codes.MALFORMED_RESPONSE) from error
+
+	def post(self, payload):
+		"""Send a JSON serializable payload and return the decoded response.
+		Unauthorized requests are retried once with re-read credentials, as the cookie changes
+		with every daemon restart."""
+		body = json.dumps(payload).encode()
+		with self._lock:
+			try:
+				return self._post(body)[1]
+			except RpcError as error:
+				if not error.code == RpcError.codes.UNAUTHORIZED:
+					raise
+				self.credentials.reload()
+				return self._post(body)[1]
+
+	def call(self, method, params=[]):
+		"""Call 'method' with a list of 'params' and return its result."""
+		response = self.post({"jsonrpc": "1.0", "id": self.newId(), "method": method, "params": list(params)})
+		if not isinstance(response, dict) or not "result" in response:
+			raise RpcError(_("Malformed RPC response to \"{method}\": {response}",\
+				formatDict={"method": method, "response": response}), RpcError.codes.MALFORMED_RESPONSE)
+		if not response.get("error") is None:
+			raise RpcResponseError(method, response["error"].get("code"), response["error"].get("message"))
+		return response["result"]
+
+	def iterCall(self, method, params=[], fields=None):
+		"""Like 'call', for methods returning a big array or object: yield its entries one by one as
+		they're read off the connection (see 'JsonStreamDecoder' for 'fields'), so memory use stays
+		flat however big the result. The response is read on a connection of its own (the shared one
+		if it's idle), so other calls, including ones made while iterating, go ahead on another one.
+		It's kept for reuse if the response is read completely, and closed if the iteration stops
+		early. An error the daemon answers with is raised once the response has been read."""
+		from lib.jsonstream import JsonStreamDecoder
+		body = json.dumps({"jsonrpc": "1.0", "id": self.newId(), "method": method, "params": list(params)}).encode()
+		with self._lock:
+			connection, self._connection = self._connection, None
+		try:
+			try:
+				connection, response, responseBody = self._send(connection, body, stream=True)
+			except RpcError as error:
+				connection = None
+				if not error.code == RpcError.codes.UNAUTHORIZED:
+					raise
+				self.credentials.reload()
+				connection, response, responseBody = self._send(None, body, stream=True)
+			decoder = JsonStreamDecoder(iter(lambda: response.read(self.__class__.streamChunkSize), b""),\
+				path=["result"], fields=fields)
+			try:
+				yield from decoder
+			except ValueError as error:
+				raise RpcError(_("Malformed RPC response to \"{method}\" (HTTP status {status}): {error}",\
+					formatDict={"method": method, "status": response.status, "error": error}),\
+					RpcError.codes.MALFORMED_RESPONSE) from error
+			with self._lock:
+				if self._connection is None:
+					self._connection, connection = connection, None
+		finally:
+			# Otherwise, what's left of the response would be taken for the answer to the next request.
+			if not connection is None:
+				connection.close()
+		error = decoder.others.get(("error",))
+		if not error is None:
+			raise RpcResponseError(method, error.get("code"), error.get("message"))
+
+	def callBatch(self, calls):
+		"""Send a list of 'RpcBatchCall' objects as one batch request and resolve each of them."""
+		callsById = {}
+		payload = []
+		for batchCall in calls:
+			callId = self.newId()
+			callsById[callId] = batchCall
+			payload.append({"jsonrpc": "1.0", "id": callId, "method": batchCall.method, "params": batchCall.params})
+		if len(payload) == 0:
+			return calls
+		responses = self.post(payload)
+		if not isinstance(responses, list):
+			# Some daemons answer a batch with a single error object if they can't handle it at all.
+			raise RpcError(_("Malformed RPC batch response: {response}", formatDict={"response": responses}),\
+				RpcError.codes.MALFORMED_RESPONSE)
+		for response in responses:
+			batchCall = callsById.pop(response.get("id"), None) if isinstance(response, dict) else None
+			if batchCall is None:
+				continue
+			if not response.get("error") is None:
+				batchCall.resolve(error=RpcResponseError(batchCall.method, response["error"].get("code"),\
+					response["error"].get("message")))
+			else:
+				batchCall.resolve(result=response.get("result"))
+		for batchCall in callsById.values():
+			batchCall.resolve(error=RpcError(_("No response to the batched call \"{method}\".",\
+				formatDict={"method": batchCall.method}), RpcError.codes.MALFORMED_RESPONSE))
+		return calls
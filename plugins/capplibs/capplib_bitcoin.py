@@ -5,9 +5,14 @@
 # Imports
 #=======================================================================================
 
+import re
+import json
+import shutil
+import threading
 from lib.base import *
 from lib.capplib import *
 from lib.configutils import ConfigSetup, ConfigOption
+from lib.rpc import RpcConnection, RpcConfFile, RpcCredentials, RpcError, RpcResponseError, RpcBatchCall, RpcMethod
 
 #=======================================================================================
 # Library
@@ -40,6 +45,18 @@ class BitcoinFlavorConfigSetup(ConfigSetup):
 		self.addOption(ConfigOption(varName="dataDirPath",\
 			shortDescription="The path of the datadir.",\
 			configName="datadir", category="paths", enforceAssignment=True))
+		#=============================
+		self.addOption(ConfigOption(varName="rpcTransport",\
+			shortDescription="How to talk to the daemon: \"rpc\" (JSON-RPC over HTTP) or \"cli\" (through the cli executable).",\
+			configName="transport", category="rpc", defaultValue="rpc"))
+		#=============================
+		self.addOption(ConfigOption(varName="rpcPort",\
+			shortDescription="The RPC port to use if the wallet config file doesn't specify one.",\
+			configName="port", category="rpc"))
+		#=============================
+		self.addOption(ConfigOption(varName="pidFileName",\
+			shortDescription="The name of the pid file the daemon writes into the datadir, if it's not \"<daemon executable name>.pid\".",\
+			configName="pidfilename", category="names"))
 
 #==========================================================
 class BitcoinCappConfigSetup(BitcoinFlavorConfigSetup):
@@ -54,6 +71,50 @@ class BitcoinCappConfigSetup(BitcoinFlavorConfigSetup):
 			shortDescription="The path of the wallet config file.",\
 			configName="config", category="paths"))
 
+#==========================================================
+class BitcoinCappBatch(object):
+	
+	#=============================
+	"""Queues calls to a capp's daemon to send them as one JSON-RPC batch request.
+	Any 'RpcMethod' of the capp can be queued by its name, e.g. 'batch.getBlockCount()';
+	other calls are queued with 'batch.call(method, *params)'. Either returns an 'RpcBatchCall'
+	whose 'result' is available once the batch has been sent. Used as a context manager,
+	the batch is sent when the block is left."""
+	#=============================
+	
+	def __init__(self, capp):
+		self.capp = capp
+		self.calls = []
+	
+	def call(self, method, *params, postProcess=None):
+		batchCall = RpcBatchCall(method, params, postProcess=postProcess)
+		self.calls.append(batchCall)
+		return batchCall
+	
+	def __getattr__(self, name):
+		rpcMethod = getattr(type(self.capp), name, None)
+		if not isinstance(rpcMethod, RpcMethod):
+			raise AttributeError("{capp} has no RPC method \"{name}\" that could be batched.".format(\
+				capp=type(self.capp).__name__, name=name))
+		def queueCall(*params):
+			return self.call(rpcMethod.method, *rpcMethod.params(params), postProcess=rpcMethod.postProcess)
+		return queueCall
+	
+	def __len__(self):
+		return len(self.calls)
+	
+	def send(self):
+		"""Send all calls that haven't been sent yet and return the list of all queued calls."""
+		self.capp.sendBatch([batchCall for batchCall in self.calls if not batchCall.done])
+		return self.calls
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exceptionType, exceptionValue, traceback):
+		if exceptionType is None:
+			self.send()
+
 #==========================================================
 class BitcoinCapp(BaseCapp):
 	
@@ -61,84 +122,416 @@ class BitcoinCapp(BaseCapp):
 	"""Represents a Bitcoin capp."""
 	#=============================
 	
+	# Defaults
+	defaultRpcPort = 8332
+	# While the daemon is warming up, it answers everything with error -28. How long to wait for it.
+	retryPolicy = RetryPolicy(initialDelay=0.5, maxDelay=5, deadline=75, classification={-28: RetryPolicy.RETRY})
+	# How many blocking calls (JSON-RPC requests, waiting for daemons) the asyncio counterparts run at
+	# once, across all capps; the rest queue up. See 'asyncExecutor'.
+	asyncWorkers = 64
+	_asyncExecutor = None
+	_asyncExecutorLock = threading.Lock()
+	# How long 'iterCall' gives the cli to write a big result, in seconds.
+	cliStreamTimeout = 300
+	# How long the answers of 'cached' RPC methods (see 'callCached') are reused, in seconds.
+	statusCacheTtl = 2
+	# What 'deleteBlockchainData' deletes from the datadir.
+	blockchainDataFileNames = ["blocks", "chainstate", "database", "peers.dat", "banlist.dat"]
+	# Where 'deleteDataFiles' moves things to be deleted in the background, in the datadir.
+	trashDirName = ".cappman-trash"
+	# Blockchain data 'seedDatadir' leaves out, as it's about the node rather than the chain
+	# ("database" holds the wallet's database environment).
+	seedExcludedFileNames = ["database", "peers.dat", "banlist.dat", "wallet.dat", "wallets"]
+	# Where 'seedDatadir' puts together what it clones, in the datadir.
+	seedDirName = ".cappman-seed"
+	blockFilePattern = re.compile(r"^blocks/(blk|rev)([0-9]+)\.dat$")
+	# The conf file settings that select a chain other than mainnet, with the chain each selects.
+	chainSwitches = [("testnet", "test"), ("regtest", "regtest"), ("signet", "signet")]
+	# Where in the datadir the daemon keeps the data of a chain; chains not listed use their name.
+	chainDirNames = {"main": "", "test": "testnet3"}
+	
 	def __init__(self, configSetup, flavor=None):
-		print("[DEBUG] capplib_bitcoin.py BitcoinCapp.__init__ Flavor (as given)", flavor)
+		self._rpc = None
+		self.statusCache = TtlCache(ttl=self.__class__.statusCacheTtl)
+		# Callers waiting on this capp's daemon share one probe. It's the instance's own, so a
+		# reloaded capp gets a fresh one rather than probing through the capp it replaced.
+		self.readinessProbe = ReadinessProbe(self.isReady, self.retryPolicy)
 		super().__init__(configSetup, flavor)
-		print("[DEBUG] capplib_bitcoin.py BitcoinCapp.__init__ self.flavor", self.flavor)
 		# Check path sanity.
-		batchPathExistenceCheck = BatchPathExistenceCheck()
-		batchPathExistenceCheck.addPath(self.config.cliExecPath, "cli-bin path: {path}".format(\
-			path=self.config.cliExecPath))
-		batchPathExistenceCheck.addPath(self.config.daemonExecPath, "daemon-bin path: {path}".format(\
-			path=self.config.daemonExecPath))
-		batchPathExistenceCheck.addPath(self.config.dataDirPath, "datadir path: {path}".format(\
-			path=self.config.dataDirPath))
+		self.checkPaths()
+		# All paths are dandy, nice!
+	
+	def pathChecks(self):
+		pathChecks = [\
+			(self.config.cliExecPath, "cli-bin path: {path}".format(path=self.config.cliExecPath)),\
+			(self.config.daemonExecPath, "daemon-bin path: {path}".format(path=self.config.daemonExecPath)),\
+			(self.config.dataDirPath, "datadir path: {path}".format(path=self.config.dataDirPath))]
 		if not self.config.configFilePath == None:
 			# A conf file path got specified; check too.
-			batchPathExistenceCheck.addPath(self.config.configFilePath, "conf-file path: {path}".format(\
-				path=self.config.configFilePath))
-		batchPathExistenceCheck.checkAll()
-		# All paths are dandy, nice!
+			pathChecks.append((self.config.configFilePath, "conf-file path: {path}".format(path=self.config.configFilePath)))
+		return pathChecks
+	
+	@property
+	def resolvedConfigFilePath(self):
+		"""The wallet config file the daemon uses: 'configFilePath' if specified, the one in the datadir otherwise."""
+		if not self.config.configFilePath == None:
+			return self.config.configFilePath
+		return os.path.join(self.config.dataDirPath, self.config.configFileName)
+	
+	@property
+	def rpc(self):
+		"""The persistent JSON-RPC connection to the daemon, created on first access."""
+		if self._rpc is None:
+			if self.config.rpcPort == None:
+				port = self.__class__.defaultRpcPort
+			else:
+				port = int(self.config.rpcPort)
+			self._rpc = RpcConnection(RpcCredentials(self.config.dataDirPath,\
+				configFilePath=self.resolvedConfigFilePath, defaultPort=port))
+		return self._rpc
+	
+	@property
+	def chainName(self):
+		"""The chain the daemon runs on according to its conf file; "main" unless it selects another one."""
+		confValues = RpcConfFile(self.resolvedConfigFilePath).read()
+		if "chain" in confValues:
+			return confValues["chain"]
+		for key, chainName in self.__class__.chainSwitches:
+			value = confValues.get(key, "0")
+			if not value == "0":
+				# Some switches take a name rather than "1", like Dash's "devnet".
+				return chainName if value == "1" else "{chainName}-{value}".format(chainName=chainName, value=value)
+		return "main"
+	
+	@property
+	def chainDirName(self):
+		"""The datadir subdir the daemon keeps the data of its chain in; "" for mainnet, which uses the datadir itself."""
+		chainName = self.chainName
+		return self.__class__.chainDirNames.get(chainName, chainName)
+	
+	@property
+	def chainDataDirPath(self):
+		"""Where the daemon keeps the blockchain data of its chain."""
+		chainDirName = self.chainDirName
+		return self.config.dataDirPath if chainDirName == "" else os.path.join(self.config.dataDirPath, chainDirName)
+	
+	@property
+	def host(self):
+		"""The host the daemon runs on, judging by where its RPC interface is."""
+		return self.rpc.credentials.host
+	
+	def disconnect(self):
+		"""Close the RPC connection, if there is one. It'll be reopened by the next call."""
+		if not self._rpc is None:
+			self._rpc.close()
+	
+	def call(self, method, *params):
 		
-	def runCli(self, commandLine):
+		#=============================
+		"""Call an RPC method of the daemon and return its decoded result.
+		Talks JSON-RPC to the daemon directly unless the flavor or capp config sets the transport
+		to "cli". If there are no usable RPC credentials, the cli is used as a fallback."""
+		#=============================
+		
+		if self.config.rpcTransport == "rpc":
+			try:
+				return self.callRpcSafe(method, *params)
+			except RpcError as error:
+				if error.code == RpcError.codes.CONNECTION_FAILED:
+					raise CappConnectionError(\
+						"Can't connect to the daemon's RPC interface. Is the daemon running?") from error
+				if not error.code in [RpcError.codes.CREDENTIALS_MISSING, RpcError.codes.UNAUTHORIZED]:
+					raise
+		return self.callCli(method, *params)
+	
+	def iterCall(self, method, *params, fields=None):
 		
 		#=============================
-		"""Run the command line version of the capp with a list of command line arguments."""
+		"""Like 'call', for methods that return a big array or object, such as masternode or
+		transaction lists: yields the entries of the result as they come in, the values of an array
+		or (key, value) tuples of an object. If 'fields' is specified, only those keys of entries
+		that are objects are decoded (see 'JsonStreamDecoder'). Memory use stays flat however big
+		the result is. Uses the same transport as 'call', and waits for a warming up daemon too."""
+		#=============================
+		
+		if self.config.rpcTransport == "rpc":
+			try:
+				yield from self.iterCallRpcSafe(method, params, fields)
+				return
+			except RpcError as error:
+				if error.code == RpcError.codes.CONNECTION_FAILED:
+					raise CappConnectionError(\
+						"Can't connect to the daemon's RPC interface. Is the daemon running?") from error
+				if not error.code in [RpcError.codes.CREDENTIALS_MISSING, RpcError.codes.UNAUTHORIZED]:
+					raise
+		yield from self.iterCallCli(method, params, fields)
+	
+	def iterCallRpcSafe(self, method, params, fields):
+		# A daemon that's warming up answers with an error and no entries, so nothing is yielded twice.
+		try:
+			yield from self.rpc.iterCall(method, params, fields=fields)
+			return
+		except RpcResponseError as error:
+			if not self.retryPolicy.shouldRetry(error.rpcCode):
+				raise
+		self.waitUntilReady()
+		yield from self.rpc.iterCall(method, params, fields=fields)
+	
+	def iterCallCli(self, method, params, fields):
+		from lib.jsonstream import JsonStreamDecoder
+		for attempt in (0, 1):
+			process = self.runCli([method]+self.cliParams(params))
+			chunks = process.iterChunks(timeout=self.__class__.cliStreamTimeout)
+			yielded = False
+			try:
+				for entry in JsonStreamDecoder(chunks, fields=fields):
+					yielded = True
+					yield entry
+				return
+			except ValueError as error:
+				# The cli reports errors on stderr, leaving stdout empty.
+				chunks.close()
+				stderrString = process.waitAndGetStderr()
+				errorCode = self.cliErrorCode(b"", stderrString)
+				if errorCode is None:
+					raise
+				# Running it again would yield the entries that came in so far a second time.
+				if attempt == 1 or yielded or not self.retryPolicy.shouldRetry(errorCode):
+					raise RpcResponseError(method, errorCode, stderrString.decode().strip()) from error
+			finally:
+				chunks.close()
+			self.waitUntilReady()
+	
+	def callCached(self, method, *params):
+		
+		#=============================
+		"""Like 'call', but reuses an answer to the same call from within the last 'statusCacheTtl'
+		seconds, and has concurrent identical calls share one call to the daemon.
+		The cache is dropped whenever the daemon is started or stopped, or its data deleted."""
+		#=============================
+		
+		return self.statusCache.get((method, json.dumps(params)), lambda: self.call(method, *params))
+	
+	def callRpcSafe(self, method, *params):
+		
+		#=============================
+		"""Call an RPC method over JSON-RPC, waiting for the daemon to finish warming up (error -28)."""
+		#=============================
+		
+		try:
+			return self.rpc.call(method, params)
+		except RpcResponseError as error:
+			if not self.retryPolicy.shouldRetry(error.rpcCode):
+				raise
+		self.waitUntilReady()
+		return self.rpc.call(method, params)
+	
+	def isReady(self):
+		"""Whether the daemon is done warming up. Raises 'CappConnectionError' if it isn't reachable at all."""
+		if self.config.rpcTransport == "rpc":
+			try:
+				self.rpc.call("getblockcount")
+				return True
+			except RpcResponseError as error:
+				if self.retryPolicy.shouldRetry(error.rpcCode):
+					return False
+				return True # It's answering, which is all we're asking for here.
+			except RpcError as error:
+				if error.code == RpcError.codes.CONNECTION_FAILED:
+					raise CappConnectionError(\
+						"Can't connect to the daemon's RPC interface. Is the daemon running?") from error
+				if not error.code in [RpcError.codes.CREDENTIALS_MISSING, RpcError.codes.UNAUTHORIZED]:
+					raise
+		return not self.checkCliOutput(*self.runCli(["getblockcount"]).waitAndGetOutput())
+	
+	def waitUntilReady(self):
+		"""Wait for the daemon to finish warming up, or raise 'DaemonStuckError' if it takes too long."""
+		if not self.readinessProbe.wait(self.retryPolicy):
+			raise DaemonStuckError("Daemon stuck at error -28.")
+	
+	def status(self):
+		
+		#=============================
+		"""The daemon's status at a glance, as a 'Namespace': whether it's 'running', its block 'height',
+		its 'state' ("stopped", "warming up", "unreachable" or "ok") and its 'masternode' state, for
+		capplibs that have masternodes. Doesn't wait for a daemon that's warming up, and answers from
+		the status cache where it can (see 'callCached'), so it's cheap to ask for many capps at once."""
+		#=============================
+		
+		status = Namespace(running=self.isDaemonRunning(), height=None, state="stopped", masternode=None)
+		if not status.running:
+			return status
+		try:
+			if not self.statusCache.get(("ready",), self.isReady):
+				status.state = "warming up"
+				return status
+			status.height = self.getBlockCount()
+		except CappConnectionError:
+			status.state = "unreachable"
+			return status
+		status.state = "ok"
+		return status
+	
+	def batch(self):
+		"""Return a new 'BitcoinCappBatch' to queue several calls and send them as one request."""
+		return BitcoinCappBatch(self)
+	
+	def sendBatch(self, calls):
+		
+		#=============================
+		"""Send a list of 'RpcBatchCall' objects to the daemon and resolve each of them.
+		Falls back to one cli call per batched call under the same conditions as 'call'."""
+		#=============================
+		
+		if self.config.rpcTransport == "rpc":
+			try:
+				return self.sendRpcBatchSafe(calls)
+			except RpcError as error:
+				if error.code == RpcError.codes.CONNECTION_FAILED:
+					raise CappConnectionError(\
+						"Can't connect to the daemon's RPC interface. Is the daemon running?") from error
+				if not error.code in [RpcError.codes.CREDENTIALS_MISSING, RpcError.codes.UNAUTHORIZED]:
+					raise
+		for batchCall in calls:
+			try:
+				batchCall.resolve(result=self.callCli(batchCall.method, *batchCall.params))
+			except DaemonStuckError as error:
+				batchCall.resolve(error=error)
+		return calls
+	
+	def sendRpcBatchSafe(self, calls):
+		
+		#=============================
+		"""Send a batch over JSON-RPC, resending the calls that hit the daemon warming up (error -28)."""
+		#=============================
+		
+		self.rpc.callBatch(calls)
+		pendingCalls = [batchCall for batchCall in calls\
+			if isinstance(batchCall.error, RpcResponseError) and self.retryPolicy.shouldRetry(batchCall.error.rpcCode)]
+		if len(pendingCalls) == 0:
+			return calls
+		try:
+			self.waitUntilReady()
+		except DaemonStuckError as error:
+			for batchCall in pendingCalls:
+				batchCall.resolve(error=error)
+			return calls
+		self.rpc.callBatch(pendingCalls)
+		return calls
+	
+	def callCli(self, method, *params):
+		
+		#=============================
+		"""Call an RPC method through the cli executable.
+		Like with the cli itself, string parameters are passed as they are and everything else as JSON."""
+		#=============================
+		
+		stdoutString = self.runCliSafe([method]+self.cliParams(params)).waitAndGetStdout(timeout=8).decode().strip()
+		try:
+			return json.loads(stdoutString)
+		except ValueError:
+			return stdoutString # Plain string results aren't JSON encoded by the cli.
+	
+	def cliParams(self, params):
+		"""Turn RPC params into cli arguments: strings are passed as they are, everything else as JSON."""
+		cliParams = []
+		for param in params:
+			if isinstance(param, str):
+				cliParams.append(param)
+			else:
+				cliParams.append(json.dumps(param))
+		return cliParams
+		
+	def cliCommandLine(self, commandLine):
+		
+		#=============================
+		"""The complete command line to run the cli with the specified list of arguments."""
 		#=============================
 		
 		if not self.config.configFilePath == None:
-			return Process([self.config.cliExecPath,\
+			return [self.config.cliExecPath,\
 				"-datadir={datadir}".format(datadir=self.config.dataDirPath),\
-				"-conf={configFilePath}".format(configFilePath=self.config.configFilePath)] + commandLine)
+				"-conf={configFilePath}".format(configFilePath=self.config.configFilePath)] + commandLine
 		else:
-			return Process([self.config.cliExecPath,\
-				"-datadir={datadir}".format(datadir=self.config.dataDirPath)] + commandLine)
-		
-
-	def runDaemon(self, commandLine):
+			return [self.config.cliExecPath,\
+				"-datadir={datadir}".format(datadir=self.config.dataDirPath)] + commandLine
+	
+	def daemonCommandLine(self, commandLine):
 		
 		#=============================
-		"""Run the daemon. Takes a list for command line arguments to it."""
+		"""The complete command line to run the daemon with the specified list of arguments."""
 		#=============================
 		
 		if not self.config.configFilePath == None:
-			return Process([self.config.daemonExecPath,\
+			return [self.config.daemonExecPath,\
 				"-daemon",\
 				"-datadir={datadir}".format(datadir=self.config.dataDirPath),\
-				"-conf={configFilePath}".format(configFilePath=self.config.configFilePath)] +commandLine)
+				"-conf={configFilePath}".format(configFilePath=self.config.configFilePath)] +commandLine
 		else:
-			return Process([self.config.daemonExecPath,\
+			return [self.config.daemonExecPath,\
 				"-daemon",\
-				"-datadir={datadir}".format(datadir=self.config.dataDirPath)] +commandLine)
-
-	def runCliSafe(self, commandLine, _retrying=False):
+				"-datadir={datadir}".format(datadir=self.config.dataDirPath)] +commandLine
+	
+	def checkCliOutput(self, stdoutString, stderrString):
 		
 		#=============================
-		"""A version of .runCli that checks for the capp tripping up and responds accordingly."""
+		"""Check the output of a finished cli process for the capp tripping up.
+		Raises 'CappConnectionError' if the daemon isn't reachable and returns 'True' if the
+		daemon is still warming up (error -28), which means the command should be retried."""
 		#=============================
-		process = self.runCli(commandLine)
-		stdoutString, stderrString = process.waitAndGetOutput()
+		
+		return self.retryPolicy.shouldRetry(self.cliErrorCode(stdoutString, stderrString))
+	
+	def cliErrorCode(self, stdoutString, stderrString):
+		
+		#=============================
+		"""The RPC error code a finished cli process reported, or 'None' if it didn't report one.
+		Raises 'CappConnectionError' if the daemon isn't reachable."""
+		#=============================
+		
+		stderrString = stderrString.decode()
 		# Catch the capp taking the way out because the daemon isn't running.
-		if stderrString.decode().strip() == "error: couldn't connect to server":
+		if stderrString.strip() == "error: couldn't connect to server":
 			raise CappConnectionError(\
 				"Command line capp can't connect to the daemon. Is the daemon running?")
-		# Catch issues caused by the capp connecting to the daemon right after the daemon started.
-		# As this involves retrying, we have to make sure we don't get stuck retrying forever.
-		if "error code: -28" in stdoutString.decode()\
-			or "error code: -28" in stderrString.decode()\
-			and not _retrying:
-			# Rerun this method in intervals until it works, or we decide to give up.
-			for retry in range(1,16):
-				time.sleep(5)
-				retriedProcess = self.runCliSafe(commandLine, _retrying=True)
-				retriedStdoutString, retriedStderrString = retriedProcess.waitAndGetOutput()
-				if "error code: -28" in retriedStdoutString.decode()\
-					or "error code: -28" in retriedStderrString.decode():
-					continue
-				else:
-					return retriedProcess
-			raise DaemonStuckError("Daemon stuck at error -28.")
-		return process
+		# The cli reports RPC errors as "error code: <code>", followed by the message.
+		for outputString in [stderrString, stdoutString.decode()]:
+			match = re.search(r"error code: (-?[0-9]+)", outputString)
+			if not match is None:
+				return int(match.group(1))
+		return None
+	
+	def runCli(self, commandLine):
+		
+		#=============================
+		"""Run the command line version of the capp with a list of command line arguments."""
+		#=============================
+		
+		return Process(self.cliCommandLine(commandLine))
+
+	def runDaemon(self, commandLine):
+		
+		#=============================
+		"""Run the daemon. Takes a list for command line arguments to it."""
+		#=============================
+		
+		self.statusCache.invalidate()
+		return Process(self.daemonCommandLine(commandLine))
+
+	def runCliSafe(self, commandLine):
+		
+		#=============================
+		"""A version of .runCli that checks for the capp tripping up and responds accordingly."""
+		#=============================
+		
+		# If the daemon is warming up, wait for it to be done and run the command again.
+		process = self.runCli(commandLine)
+		if not self.checkCliOutput(*process.waitAndGetOutput()):
+			return process
+		self.waitUntilReady()
+		# Some methods stay unavailable a little longer than the one the probe uses (e.g. while
+		# wallets load), so keep retrying this one as long as the policy allows.
+		return Process.runRetrying(self.cliCommandLine(commandLine), self.retryPolicy, self.cliErrorCode)
 
 	def runDaemonSafe(self, commandLine):
 		
@@ -158,26 +551,155 @@ class BitcoinCapp(BaseCapp):
 		#=============================
 		
 		return self.runDaemon(commandLine)
+	
+	def startDaemonAndWait(self, commandLine=[]):
+		"""Start the daemon and return once it has detached. Doesn't wait for it to be ready."""
+		self.runDaemonSafe(commandLine)
+	
+	def restartDaemon(self, waitTimeout=None, commandLine=[]):
+		"""Stop the daemon if it's running, wait for it to exit and start it again."""
+		if self.isDaemonRunning():
+			self.stopDaemon(waitTimeout=waitTimeout, wait=True)
+		self.startDaemonAndWait(commandLine)
 
-	def stopDaemon(self, waitTimeout):
+	@property
+	def pidFilePath(self):
+		"""The pid file the daemon writes into the datadir while it's running."""
+		pidFileName = self.config.pidFileName
+		if pidFileName == None:
+			pidFileName = "{daemonName}.pid".format(daemonName=os.path.basename(self.config.daemonExecPath))
+		return os.path.join(self.config.dataDirPath, pidFileName)
+	
+	@property
+	def daemonPid(self):
+		"""The pid of the daemon according to its pid file, or 'None' if there's none."""
+		return PidFile(self.pidFilePath).read()
+	
+	@property
+	def dataDirLocked(self):
+		"""Whether a daemon holds the lock on the datadir."""
+		return LockFile(os.path.join(self.config.dataDirPath, ".lock")).held
+	
+	def isDaemonRunning(self):
+		pid = self.daemonPid
+		if not pid is None and PidWatcher(pid).alive:
+			return True
+		return self.dataDirLocked
+	
+	def stopDaemon(self, waitTimeout=None, wait=None):
 		
 		#=============================
 		"""Stop the daemon.
-		The parameter 'waitTimeout' determines for how long we will wait and poll
-		for stop confirmation, in seconds."""
-		#=============================
-		
-		process = self.runCliSafe(["stop"])
-		# Wait and poll every second for daemon shutdown completion.
-		# Return once daemon shut down is confirmed.
-		if not waitTimeout == None:
-			for second in range(1,waitTimeout):
-				try:
-					self.getBlockCount() # We could use anything. This will do.
-				except CappConnectionError:
-					break
-				time.sleep(1)
-		return process
+		If 'wait' is 'True' (the default if a 'waitTimeout' is specified), return only once the daemon's
+		process has exited and the datadir lock is released. If that takes longer than 'waitTimeout'
+		seconds ('None' for no limit), 'DaemonStuckError' is raised."""
+		#=============================
+		
+		if wait is None:
+			wait = not waitTimeout == None
+		# The daemon removes its pid file on its way out, so get the pid first.
+		pid = self.daemonPid
+		try:
+			result = self.call("stop")
+		except CappConnectionError as error:
+			self.raiseIfUnreachable(pid, error)
+			raise
+		finally:
+			self.statusCache.invalidate()
+		if wait:
+			self.checkDaemonExit(pid, PidWatcher(pid).wait(waitTimeout) if not pid is None\
+				else self.waitForDataDirRelease(waitTimeout), waitTimeout)
+			# Drop whatever got cached while the daemon was shutting down.
+			self.statusCache.invalidate()
+		return result
+	
+	def raiseIfUnreachable(self, pid, error):
+		"""Tell a daemon that's running but can't be reached apart from one that isn't running at all."""
+		if not pid is None and PidWatcher(pid).alive:
+			raise CappConnectionError("The daemon is running (pid {pid}), but can't be reached.".format(pid=pid)) from error
+	
+	def waitForDataDirRelease(self, timeout=None):
+		"""Wait for the datadir lock to be released, for daemons we don't have a pid of. This has to poll."""
+		retryPolicy = RetryPolicy(initialDelay=0.05, maxDelay=1, deadline=float("inf") if timeout is None else timeout)
+		for attempt in retryPolicy.attempts():
+			if not self.dataDirLocked:
+				return True
+		return False
+	
+	def checkDaemonExit(self, pid, exited, timeout):
+		if not exited:
+			raise DaemonStuckError("The daemon (pid {pid}) didn't shut down within {timeout} seconds.".format(\
+				pid=pid, timeout=timeout))
+		if self.dataDirLocked:
+			raise DaemonStuckError("The daemon (pid {pid}) exited, but its datadir is still locked: {dataDirPath}".format(\
+				pid=pid, dataDirPath=self.config.dataDirPath))
+	
+	#=============================
+	# Asyncio counterparts
+	# These let one event loop drive many capps at once. They build the same command lines and
+	# check the output the same way as their blocking versions above. asyncio is only imported
+	# once they're used, as it's expensive to import.
+	#=============================
+	
+	@classmethod
+	def asyncExecutor(cls):
+		"""The thread pool the asyncio counterparts run blocking calls in, shared by all capps. It has
+		'asyncWorkers' threads, unlike the event loop's default executor, which is sized by the CPU count."""
+		with BitcoinCapp._asyncExecutorLock:
+			if BitcoinCapp._asyncExecutor is None:
+				import concurrent.futures
+				BitcoinCapp._asyncExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=cls.asyncWorkers,\
+					thread_name_prefix="cappAsync")
+			return BitcoinCapp._asyncExecutor
+	
+	async def runBlocking(self, function, *args):
+		"""Await a blocking call, run in 'asyncExecutor'."""
+		import asyncio
+		return await asyncio.get_running_loop().run_in_executor(self.asyncExecutor(), function, *args)
+	
+	async def runCliAsync(self, commandLine):
+		"""Async version of 'runCli', returning a running 'AsyncProcess'."""
+		return await AsyncProcess(self.cliCommandLine(commandLine)).run()
+	
+	async def runDaemonAsync(self, commandLine):
+		"""Async version of 'runDaemon', returning a running 'AsyncProcess'."""
+		self.statusCache.invalidate()
+		return await AsyncProcess(self.daemonCommandLine(commandLine)).run()
+	
+	async def runCliSafeAsync(self, commandLine):
+		"""Async version of 'runCliSafe'.
+		Waiting for the daemon to warm up is left to the shared (thread based) readiness probe."""
+		process = await self.runCliAsync(commandLine)
+		if not self.checkCliOutput(*(await process.waitAndGetOutput())):
+			return process
+		await self.runBlocking(self.waitUntilReady)
+		return await self.runCliAsync(commandLine)
+	
+	async def startDaemonAsync(self, commandLine=[]):
+		"""Async version of 'startDaemon'."""
+		return await self.runDaemonAsync(commandLine)
+	
+	async def callAsync(self, method, *params):
+		"""Async version of 'call'.
+		JSON-RPC calls are run in 'asyncExecutor', as 'http.client' blocks."""
+		if self.config.rpcTransport == "rpc":
+			return await self.runBlocking(self.call, method, *params)
+		return await self.callCliAsync(method, *params)
+	
+	async def callCliAsync(self, method, *params):
+		"""Async version of 'callCli'."""
+		process = await self.runCliSafeAsync([method]+self.cliParams(params))
+		stdoutString = (await process.waitAndGetStdout(timeout=8)).decode().strip()
+		try:
+			return json.loads(stdoutString)
+		except ValueError:
+			return stdoutString
+	
+	async def stopDaemonAsync(self, waitTimeout=None, wait=None):
+		"""Async version of 'stopDaemon', which it runs in 'asyncExecutor'. Up to 'asyncWorkers' daemons
+		can be stopped and waited for at once this way; more queue up for a free thread."""
+		return await self.runBlocking(self.stopDaemon, waitTimeout, wait)
+	
 	def deleteDataFile(self, fileName):
 		filePath = os.path.join(self.config.dataDirPath, fileName)
 		if os.path.exists(filePath):
@@ -185,15 +707,165 @@ class BitcoinCapp(BaseCapp):
 				shutil.rmtree(filePath)
 			else:
 				os.remove(filePath)
-	def deleteDataFiles(self, fileNameList):
+	def deleteDataFiles(self, fileNameList, background=False):
+		
+		#=============================
+		"""Delete the specified files and dirs from the datadir.
+		With 'background', they're moved into the datadir's trash dir instead, which is instant, and
+		deleted from there by the shared 'TrashReaper' at a rate the other daemons on the host won't
+		notice. Either way, they're gone from where the daemon looks for them once this returns.
+		If the process ends before the trash is empty, the rest is deleted by the next one that
+		trashes something in this datadir or calls 'resumeDeletion' (the manager does on start)."""
+		#=============================
+		
+		self.statusCache.invalidate()
+		if background:
+			trashDir = TrashDir(os.path.join(self.config.dataDirPath, self.__class__.trashDirName))
+			trashDir.move([os.path.join(self.config.dataDirPath, fileName) for fileName in fileNameList])
+			TrashReaper.shared().add(trashDir.path)
+			return
 		for fileName in fileNameList:
-			self.deleteDataFile(fileName7)
-	def deleteBlockchainData(self):
-		self.deleteDataFiles(["blocks", "chainstate", "database", "peers.dat", "banlist.dat"])
+			self.deleteDataFile(fileName)
+	
+	def resumeDeletion(self):
+		"""Have the shared 'TrashReaper' delete what an earlier process left in the trash dir
+		(see 'deleteDataFiles'). Returns whether there was anything."""
+		trashDir = TrashDir(os.path.join(self.config.dataDirPath, self.__class__.trashDirName))
+		if len(trashDir.batchDirPaths) == 0:
+			return False
+		TrashReaper.shared().add(trashDir.path)
+		return True
+	
+	def deleteBlockchainData(self, background=False):
+		self.deleteDataFiles(self.__class__.blockchainDataFileNames, background=background)
+	
+	@classmethod
+	def latestBlockFileNumber(cls, dataDirPath):
+		"""The number of the block file the daemon appends to (the highest one), or -1 if there's none."""
+		numbers = [-1]
+		try:
+			for fileName in os.listdir(os.path.join(dataDirPath, "blocks")):
+				match = cls.blockFilePattern.match("blocks/"+fileName)
+				if not match is None:
+					numbers.append(int(match.group(2)))
+		except FileNotFoundError:
+			pass
+		return max(numbers)
+	
+	@classmethod
+	def isImmutableDataFile(cls, relativePath, latestBlockFileNumber):
+		"""Whether the daemon never writes to a datadir file again: block files other than the latest
+		one, which the daemon appends to, and LevelDB tables, which are written once. Undo files
+		don't qualify; blocks connected late get their undo data added to older ones."""
+		if relativePath.endswith(".ldb"):
+			return True
+		match = cls.blockFilePattern.match(relativePath)
+		return not match is None and match.group(1) == "blk" and int(match.group(2)) < latestBlockFileNumber
+	
+	def dedupCandidatePaths(self):
+		"""The block files 'FileDeduplicator' may replace with links to identical files of sibling
+		capps (see 'Capps.dedupBlockFiles'): the immutable ones, which excludes the block file a
+		running daemon may still append to."""
+		blocksDirPath = os.path.join(self.config.dataDirPath, "blocks")
+		latestBlockFileNumber = self.latestBlockFileNumber(self.config.dataDirPath)
+		try:
+			fileNames = sorted(os.listdir(blocksDirPath))
+		except FileNotFoundError:
+			return []
+		return [os.path.join(blocksDirPath, fileName) for fileName in fileNames\
+			if self.isImmutableDataFile("blocks/"+fileName, latestBlockFileNumber)]
+	
+	def seedDatadir(self, fromCapp, replace=False, maxWorkers=4):
+		
+		#=============================
+		"""Clone the blockchain data of a sibling capp of the same flavor and chain into our datadir, saving a
+		sync from scratch. Only the data of that chain is cloned (see 'chainDataDirPath'). Both daemons have to be stopped. Files are reflinked where the filesystem
+		supports it, immutable ones (see 'isImmutableDataFile') hard linked otherwise, and the rest
+		copied, 'maxWorkers' at a time. Wallet and peer files aren't cloned ('seedExcludedFileNames').
+		Existing blockchain data is only replaced (and deleted in the background) if 'replace' is set.
+		Returns how many files were cloned by each method, and how many bytes they hold."""
+		#=============================
+		
+		# Flavors of the same capplib can be different coins, and the same flavor can run on different chains.
+		for what, ours, theirs in [("capplib", type(self), type(fromCapp)),\
+			("flavor", getattr(self.config, "cappFlavorName", None), getattr(fromCapp.config, "cappFlavorName", None)),\
+			("chain", self.chainName, fromCapp.chainName)]:
+			if not ours == theirs:
+				raise DataDirError("Can't seed a datadir from one of a different {what} ({ours} vs. {theirs}).".format(\
+					what=what, ours=getattr(ours, "__name__", ours), theirs=getattr(theirs, "__name__", theirs)),\
+					DataDirError.codes.INCOMPATIBLE)
+		for capp in [self, fromCapp]:
+			if capp.isDaemonRunning():
+				raise DataDirError("The daemon using {dataDirPath} has to be stopped first.".format(\
+					dataDirPath=capp.config.dataDirPath), DataDirError.codes.DAEMON_RUNNING)
+		fileNames = [fileName for fileName in self.__class__.blockchainDataFileNames\
+			if not fileName in self.__class__.seedExcludedFileNames]
+		sourceDirPath = fromCapp.chainDataDirPath
+		relativeDirPaths = []
+		relativePaths = []
+		for fileName in fileNames:
+			sourcePath = os.path.join(sourceDirPath, fileName)
+			if os.path.isdir(sourcePath):
+				for dirPath, dirNames, dirFileNames in os.walk(sourcePath):
+					relativeDirPath = os.path.relpath(dirPath, sourceDirPath)
+					relativeDirPaths.append(relativeDirPath)
+					relativePaths += [os.path.join(relativeDirPath, dirFileName) for dirFileName in dirFileNames]
+			elif os.path.isfile(sourcePath):
+				relativePaths.append(fileName)
+		# Check before anything of ours is touched; replacing our data with nothing would just lose it.
+		if len(relativePaths) == 0:
+			raise DataDirError("{dataDirPath} has no blockchain data to seed from.".format(dataDirPath=sourceDirPath),\
+				DataDirError.codes.SOURCE_EMPTY)
+		chainDirName = self.chainDirName
+		targetDirPath = self.chainDataDirPath
+		existingFileNames = [fileName for fileName in fileNames\
+			if os.path.lexists(os.path.join(targetDirPath, fileName))]
+		if len(existingFileNames) > 0:
+			if not replace:
+				raise DataDirError("{dataDirPath} already has blockchain data: {fileNames}".format(\
+					dataDirPath=targetDirPath, fileNames=", ".join(existingFileNames)), DataDirError.codes.TARGET_EXISTS)
+			self.deleteDataFiles([os.path.join(chainDirName, fileName) for fileName in existingFileNames], background=True)
+		self.statusCache.invalidate()
+		stagingDirPath = os.path.join(targetDirPath, self.__class__.seedDirName)
+		if os.path.lexists(stagingDirPath):
+			shutil.rmtree(stagingDirPath) # Left over from seeding that didn't finish.
+		os.makedirs(stagingDirPath)
+		for relativeDirPath in relativeDirPaths:
+			os.makedirs(os.path.join(stagingDirPath, relativeDirPath), exist_ok=True)
+		latestBlockFileNumber = self.latestBlockFileNumber(sourceDirPath)
+		fileCloner = FileCloner()
+		def cloneFile(relativePath):
+			sourcePath = os.path.join(sourceDirPath, relativePath)
+			method = fileCloner.clone(sourcePath, os.path.join(stagingDirPath, relativePath),\
+				immutable=self.isImmutableDataFile(relativePath, latestBlockFileNumber))
+			return (method, os.path.getsize(sourcePath))
+		report = {FileCloner.REFLINK: 0, FileCloner.HARDLINK: 0, FileCloner.COPY: 0, "bytes": 0}
+		import concurrent.futures
+		try:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+				for method, size in executor.map(cloneFile, relativePaths):
+					report[method] += 1
+					report["bytes"] += size
+		except BaseException:
+			shutil.rmtree(stagingDirPath, ignore_errors=True)
+			raise
+		# Only move the data where the daemon looks for it once it's complete.
+		for fileName in fileNames:
+			stagedPath = os.path.join(stagingDirPath, fileName)
+			if os.path.lexists(stagedPath):
+				os.rename(stagedPath, os.path.join(targetDirPath, fileName))
+		os.rmdir(stagingDirPath)
+		return report
 		
 
-	def getBlockCount(self):
-		return int(self.runCliSafe(["getblockcount"]).waitAndGetStdout(timeout=8).decode())
+	#=============================
+	# RPC methods
+	# These can be called directly or queued in a batch (see 'BitcoinCappBatch').
+	#=============================
+	
+	getBlockCount = RpcMethod("getblockcount", postProcess=int, cached=True)
+	getBlockchainInfo = RpcMethod("getblockchaininfo", cached=True)
+	getNetworkInfo = RpcMethod("getnetworkinfo", cached=True)
 
 #=======================================================================================
 # Export
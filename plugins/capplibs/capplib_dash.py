@@ -18,5 +18,36 @@ class DashCapp(BitcoinCapp):
 	"""Represents a Dash capp."""
 	#=============================
 	
-	def deleteBlockchainData(self):
-		self.deleteDataFiles["blocks", "chainstate", "database", "mncache.dat", "peers.dat", "mnpayments.dat", "banlist.dat"]
\ No newline at end of file
+	# Defaults
+	defaultRpcPort = 9998
+	blockchainDataFileNames = ["blocks", "chainstate", "database", "mncache.dat", "peers.dat", "mnpayments.dat", "banlist.dat"]
+	chainSwitches = [("testnet", "test"), ("regtest", "regtest"), ("devnet", "devnet")]
+	
+	def status(self):
+		status = super().status()
+		if status.state == "ok":
+			try:
+				masternodeStatus = self.getMasternodeStatus()
+			except RpcResponseError as error:
+				status.masternode = error.rpcMessage # E.g. "This is not a masternode".
+			else:
+				if isinstance(masternodeStatus, dict):
+					masternodeStatus = masternodeStatus.get("state", masternodeStatus.get("status"))
+				status.masternode = masternodeStatus
+		return status
+	
+	#=============================
+	# RPC methods
+	#=============================
+	
+	getMasternodeStatus = RpcMethod("masternode", "status", cached=True)
+	
+	def iterMasternodeList(self, mode="json", fields=None):
+		"""Yield (outpoint, entry) tuples of the masternode list, one by one (see 'iterCall')."""
+		return self.iterCall("masternodelist", mode, fields=fields)
+
+#=======================================================================================
+# Export
+#=======================================================================================
+
+Capp = DashCapp
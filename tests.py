@@ -7,10 +7,32 @@
 
 import unittest
 import os
+import sys
 import shutil
 import configparser
 import argparse
+import json
+import subprocess
+from unittest import mock
+import tempfile
+import threading
+import asyncio
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from lib.base import *
+from lib.configutils import *
+import lib.configutils
+from lib.rpc import *
+import base64
+from lib.capplib import CappConnectionError, DaemonStuckError, DataDirError
+from lib.capps import Capps, CappLoadError, CappNotFoundError, CappFanOut, CappCommandUnknownError, CappStatusTable
+from lib.plugins import ConfigPlugin, PythonLibPlugin, PluginIndex, PluginManifestCache
+from lib.localization import Lang, LazyMessage
+from lib.jsonstream import JsonStreamDecoder
+from lib.manager import Manager, ManagerClient, ManagerError, ManagerServer
+from plugins.capplibs.capplib_bitcoin import BitcoinCapp, BitcoinCappConfigSetup
+from plugins.capplibs.capplib_dash import DashCapp
 
 
 #=======================================================================================
@@ -19,6 +41,8 @@ from lib.base import *
 
 testDirPath=os.path.join(os.path.join(os.path.expanduser("~"), ".cache"), "walman")
 
+distPluginDirPath=os.path.join(os.path.dirname(os.path.realpath(__file__)), "plugins")
+
 #=======================================================================================
 # Library
 #=======================================================================================
@@ -50,5 +74,1122 @@ class ConfigTest(unittest.TestCase):
 		self.config = self.configSetup.getConfig()
 		self.assertEqual(self.config.test, "testdefaultvalue")
 
+#==========================================================
+class FakeRpcServer(ThreadingMixIn, HTTPServer):
+	
+	#=============================
+	"""A local stand-in for a daemon's JSON-RPC interface.
+	'methods' maps method names to callables taking the params list."""
+	#=============================
+	
+	daemon_threads = True
+	
+	def __init__(self, methods, user="testuser", password="testpassword"):
+		self.methods = methods
+		self.user = user
+		self.password = password
+		self.connectionCount = 0
+		self.requestCount = 0
+		super().__init__(("127.0.0.1", 0), FakeRpcRequestHandler)
+		threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+	
+	@property
+	def port(self):
+		return self.server_address[1]
+	
+	def answer(self, request):
+		try:
+			result = self.methods[request["method"]](request["params"])
+			return {"result": result, "error": None, "id": request["id"]}
+		except KeyError:
+			return {"result": None, "error": {"code": -32601, "message": "Method not found"}, "id": request["id"]}
+		except RpcResponseError as error:
+			return {"result": None, "error": {"code": error.rpcCode, "message": error.rpcMessage}, "id": request["id"]}
+	
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+#==========================================================
+class FakeRpcRequestHandler(BaseHTTPRequestHandler):
+	
+	protocol_version = "HTTP/1.1"
+	# Headers and body are written separately; don't let them wait on delayed ACKs.
+	disable_nagle_algorithm = True
+	
+	def setup(self):
+		super().setup()
+		self.server.connectionCount += 1
+	
+	def log_message(self, *args):
+		pass
+	
+	def do_POST(self):
+		self.server.requestCount += 1
+		body = self.rfile.read(int(self.headers["Content-Length"]))
+		credentials = "{user}:{password}".format(user=self.server.user, password=self.server.password)
+		if not self.headers["Authorization"] == "Basic "+base64.b64encode(credentials.encode()).decode():
+			self.send_response(401)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		request = json.loads(body.decode())
+		if isinstance(request, list):
+			response = [self.server.answer(item) for item in request]
+		else:
+			response = self.server.answer(request)
+		responseBody = json.dumps(response).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(responseBody)))
+		self.end_headers()
+		self.wfile.write(responseBody)
+
+#==========================================================
+class CappTestCase(unittest.TestCase):
+	
+	#=============================
+	"""Sets up a throwaway capp directory layout with fake executables and a datadir."""
+	#=============================
+	
+	def setUp(self):
+		self.tempDirPath = tempfile.mkdtemp()
+		self.dataDirPath = os.path.join(self.tempDirPath, "datadir")
+		os.makedirs(self.dataDirPath)
+		self.cliExecPath = os.path.join(self.tempDirPath, "test-cli")
+		self.daemonExecPath = os.path.join(self.tempDirPath, "testd")
+		for execPath in [self.cliExecPath, self.daemonExecPath]:
+			with open(execPath, "w") as execFile:
+				execFile.write("#!/bin/sh\n")
+			os.chmod(execPath, 0o755)
+	
+	def tearDown(self):
+		shutil.rmtree(self.tempDirPath)
+	
+	def writeCli(self, scriptBody):
+		with open(self.cliExecPath, "w") as execFile:
+			execFile.write("#!/bin/sh\n"+scriptBody+"\n")
+	
+	def writeConf(self, lines, fileName="test.conf"):
+		with open(os.path.join(self.dataDirPath, fileName), "w") as confFile:
+			confFile.write("\n".join(lines)+"\n")
+	
+	def writeDataFiles(self, filePaths, dataDirPath=None):
+		dataDirPath = self.dataDirPath if dataDirPath is None else dataDirPath
+		for filePath in filePaths:
+			os.makedirs(os.path.dirname(os.path.join(dataDirPath, filePath)), exist_ok=True)
+			with open(os.path.join(dataDirPath, filePath), "wb") as dataFile:
+				dataFile.write(b"x"*1024)
+	
+	def makeCapp(self, cappClass=BitcoinCapp, **flavorValues):
+		flavor = Config()
+		flavor.cliExecPath = self.cliExecPath
+		flavor.daemonExecPath = self.daemonExecPath
+		flavor.dataDirPath = self.dataDirPath
+		flavor.configFileName = "test.conf"
+		for key, value in flavorValues.items():
+			setattr(flavor, key, value)
+		return cappClass(configSetup=BitcoinCappConfigSetup(), flavor=flavor)
+
+#==========================================================
+class RpcServerTestCase(CappTestCase):
+	def setUp(self):
+		super().setUp()
+		self.server = FakeRpcServer({"getblockcount": lambda params: 1234, "echo": lambda params: params})
+	def tearDown(self):
+		self.server.stop()
+		super().tearDown()
+
+#==========================================================
+class RpcTest(RpcServerTestCase):
+	def testConfCredentials(self):
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		self.assertEqual(capp.getBlockCount(), 1234)
+		self.assertEqual(capp.call("echo", "a", 1, [True]), ["a", 1, [True]])
+	def testKeepAlive(self):
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		for count in range(0, 5):
+			capp.call("getblockcount")
+		self.assertEqual(self.server.requestCount, 5)
+		self.assertEqual(self.server.connectionCount, 1)
+	def testCookieCredentials(self):
+		self.server.user = "__cookie__"
+		with open(os.path.join(self.dataDirPath, ".cookie"), "w") as cookieFile:
+			cookieFile.write("__cookie__:cookiepassword")
+		self.server.password = "cookiepassword"
+		capp = self.makeCapp(rpcPort=str(self.server.port))
+		self.assertEqual(capp.getBlockCount(), 1234)
+	def testResponseError(self):
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		with self.assertRaises(RpcResponseError) as context:
+			self.makeCapp().call("nosuchmethod")
+		self.assertEqual(context.exception.rpcCode, -32601)
+	def testConnectionRefused(self):
+		port = self.server.port
+		self.server.stop()
+		self.server = FakeRpcServer({})
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=port)])
+		with self.assertRaises(CappConnectionError):
+			self.makeCapp().getBlockCount()
+
+#==========================================================
+class StatusCacheTest(RpcServerTestCase):
+	def testTtlAndInvalidation(self):
+		now = {"time": 0}
+		cache = TtlCache(ttl=2, clock=lambda: now["time"])
+		calls = []
+		function = lambda: calls.append(None) or len(calls)
+		self.assertEqual([cache.get("key", function) for count in range(0, 3)], [1, 1, 1])
+		now["time"] = 3
+		self.assertEqual(cache.get("key", function), 2)
+		cache.invalidate()
+		self.assertEqual(cache.get("key", function), 3)
+		with self.assertRaises(ValueError):
+			cache.get("failing", lambda: int("x"))
+		self.assertEqual(cache.get("failing", lambda: 4), 4)
+		self.assertEqual((cache.hits, cache.misses), (2, 5))
+	def testCoalescing(self):
+		cache = TtlCache()
+		release = threading.Event()
+		calls = []
+		def function():
+			calls.append(None)
+			release.wait()
+			return 42
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(cache.get("key", function))) for count in range(0, 5)]
+		for thread in threads:
+			thread.start()
+		while cache.misses+cache.coalesced < 5:
+			time.sleep(0.01)
+		release.set()
+		for thread in threads:
+			thread.join()
+		self.assertEqual((results, len(calls), cache.coalesced), ([42]*5, 1, 4))
+	def testCappStatus(self):
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		for count in range(0, 5):
+			self.assertEqual(capp.getBlockCount(), 1234)
+		self.assertEqual(self.server.requestCount, 1)
+		capp.deleteDataFiles([])
+		capp.getBlockCount()
+		self.assertEqual(self.server.requestCount, 2)
+		self.assertEqual(capp.statusCache.stats["hits"], 4)
+
+#==========================================================
+class RpcBatchTest(RpcServerTestCase):
+	def testBatch(self):
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		with capp.batch() as batch:
+			blockCount = batch.getBlockCount()
+			echo = batch.call("echo", "x")
+			missing = batch.call("nosuchmethod")
+		self.assertEqual(self.server.requestCount, 1)
+		self.assertEqual(blockCount.result, 1234)
+		self.assertEqual(echo.result, ["x"])
+		self.assertTrue(missing.failed)
+		self.assertEqual(missing.error.rpcCode, -32601)
+		with self.assertRaises(RpcResponseError):
+			missing.result
+	def testUnsentBatch(self):
+		batch = self.makeCapp().batch()
+		with self.assertRaises(RpcError):
+			batch.getBlockCount().result
+		with self.assertRaises(AttributeError):
+			batch.deleteBlockchainData()
+
+#==========================================================
+class RetryTest(RpcServerTestCase):
+	def setUp(self):
+		super().setUp()
+		self.quickRetryPolicy = RetryPolicy(initialDelay=0.01, maxDelay=0.05, deadline=5,\
+			classification={-28: RetryPolicy.RETRY})
+	def testBackoff(self):
+		delays = []
+		retryPolicy = RetryPolicy(initialDelay=1, maxDelay=4, jitter=0.5, deadline=1000, maxAttempts=5)
+		self.assertEqual(list(retryPolicy.attempts(sleep=delays.append)), [0, 1, 2, 3, 4])
+		for delay, fullDelay in zip(delays, [1, 2, 4, 4]):
+			self.assertTrue(fullDelay/2 <= delay <= fullDelay)
+		self.assertEqual(len(list(RetryPolicy(initialDelay=0.01, deadline=0).attempts())), 1)
+		self.assertTrue(self.quickRetryPolicy.shouldRetry(-28))
+		self.assertFalse(self.quickRetryPolicy.shouldRetry(-32601))
+	def testSharedReadinessProbe(self):
+		probes = []
+		def probe():
+			probes.append(None)
+			time.sleep(0.05)
+			return len(probes) >= 3
+		readinessProbe = ReadinessProbe(probe, self.quickRetryPolicy)
+		outcomes = []
+		threads = [threading.Thread(target=lambda: outcomes.append(readinessProbe.wait())) for count in range(0, 5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(outcomes, [True]*5)
+		self.assertEqual(len(probes), 3)
+	def testRpcWarmup(self):
+		warmup = {"remaining": 3}
+		def getBlockCount(params):
+			if warmup["remaining"] > 0:
+				warmup["remaining"] -= 1
+				raise RpcResponseError("getblockcount", -28, "Loading block index...")
+			return 1234
+		self.server.methods["getblockcount"] = getBlockCount
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		capp.retryPolicy = self.quickRetryPolicy
+		self.assertEqual(capp.getBlockCount(), 1234)
+		warmup["remaining"] = 1000
+		capp.retryPolicy = RetryPolicy(initialDelay=0.01, deadline=0.1, classification={-28: RetryPolicy.RETRY})
+		with self.assertRaises(DaemonStuckError):
+			capp.call("getblockcount")
+	def testCliRetrying(self):
+		# The probe's getblockcount is fine all along; getbalance answers -28 twice.
+		counterFilePath = os.path.join(self.tempDirPath, "counter")
+		self.writeCli("case \"$*\" in *getblockcount) echo 1234; exit 0;; esac\n"\
+			"echo x >> {path}; [ $(wc -l < {path}) -ge 3 ] && echo 5 || (echo 'error code: -28' >&2; exit 1)".format(\
+			path=counterFilePath))
+		capp = self.makeCapp(rpcTransport="cli")
+		capp.retryPolicy = self.quickRetryPolicy
+		self.assertEqual(capp.runCliSafe(["getbalance"]).waitAndGetStdout(), b"5\n")
+	def testProcessRetrying(self):
+		counterFilePath = os.path.join(self.tempDirPath, "counter")
+		script = "echo x >> {path}; [ $(wc -l < {path}) -ge 3 ] && echo ok || echo 'error code: -28'".format(path=counterFilePath)
+		errorCodeOf = lambda stdout, stderr: None if stdout == b"ok\n" else -28
+		process = Process.runRetrying(["sh", "-c", script], self.quickRetryPolicy, errorCodeOf)
+		self.assertIsNone(process.errorCode)
+		self.assertEqual(process.waitAndGetStdout(), b"ok\n")
+
+#==========================================================
+class StopDaemonTest(RpcServerTestCase):
+	def setUp(self):
+		super().setUp()
+		self.server.methods["stop"] = lambda params: "stopping"
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		self.capp = self.makeCapp()
+	def startDaemon(self, lifetime):
+		"""A stand-in daemon that detaches, writes its pid file, locks the datadir and exits after 'lifetime' seconds."""
+		script = "import fcntl, time; lockFile = open({lockFilePath!r}, 'w'); fcntl.lockf(lockFile, fcntl.LOCK_EX); "\
+			"open({readyFilePath!r}, 'w').close(); time.sleep({lifetime})".format(lifetime=lifetime,\
+			lockFilePath=os.path.join(self.dataDirPath, ".lock"), readyFilePath=os.path.join(self.tempDirPath, "ready"))
+		Process(["sh", "-c", "{python} -c \"{script}\" > /dev/null 2>&1 & echo $! > {pidFilePath}".format(python=sys.executable,\
+			script=script, pidFilePath=self.capp.pidFilePath)]).waitAndGetOutput()
+		while not os.path.exists(os.path.join(self.tempDirPath, "ready")):
+			time.sleep(0.01)
+	def testStopAndWait(self):
+		self.startDaemon(0.3)
+		self.assertTrue(self.capp.isDaemonRunning())
+		startTime = time.monotonic()
+		self.assertEqual(self.capp.stopDaemon(wait=True), "stopping")
+		self.assertLess(time.monotonic()-startTime, 2)
+		self.assertFalse(self.capp.isDaemonRunning())
+	def testDataDirLocked(self):
+		self.assertFalse(self.capp.dataDirLocked)
+		self.startDaemon(30)
+		try:
+			self.assertTrue(self.capp.dataDirLocked)
+			os.chmod(os.path.join(self.dataDirPath, ".lock"), 0o444)
+			self.assertTrue(self.capp.dataDirLocked)
+			with mock.patch("os.open", side_effect=PermissionError(13, "Permission denied")):
+				self.assertTrue(self.capp.dataDirLocked)
+		finally:
+			os.kill(self.capp.daemonPid, 15)
+		self.assertTrue(PidWatcher(self.capp.daemonPid).wait(5))
+		self.assertFalse(self.capp.dataDirLocked)
+	def testStopTimeout(self):
+		self.startDaemon(30)
+		try:
+			with self.assertRaises(DaemonStuckError):
+				asyncio.run(self.capp.stopDaemonAsync(waitTimeout=0.2))
+		finally:
+			os.kill(self.capp.daemonPid, 15)
+
+#==========================================================
+class DeleteDataTest(CappTestCase):
+	def testDelete(self):
+		self.writeDataFiles(["blocks/blk00000.dat", "chainstate/000001.ldb", "mncache.dat", "peers.dat", "wallet.dat"])
+		self.makeCapp(cappClass=DashCapp).deleteBlockchainData()
+		self.assertEqual(os.listdir(self.dataDirPath), ["wallet.dat"])
+	def testBackgroundDelete(self):
+		self.writeDataFiles(["blocks/blk00000.dat", "blocks/index/000001.ldb", "chainstate/000001.ldb", "wallet.dat"])
+		capp = self.makeCapp()
+		capp.deleteBlockchainData(background=True)
+		self.assertEqual(sorted(os.listdir(self.dataDirPath)), [".cappman-trash", "wallet.dat"])
+		self.assertTrue(TrashReaper.shared().wait(10))
+		self.assertEqual(os.listdir(os.path.join(self.dataDirPath, ".cappman-trash")), [])
+	def testThrottle(self):
+		sleeps = []
+		trashDir = TrashDir(os.path.join(self.dataDirPath, "trash"))
+		batchDirPath = trashDir.move([])
+		with open(os.path.join(batchDirPath, "blk00000.dat"), "wb") as dataFile:
+			dataFile.write(b"x"*1024*1024)
+		reaper = TrashReaper(rate=1024*1024, sleep=sleeps.append)
+		with mock.patch.object(TrashReaper, "chunkSize", 256*1024):
+			reaper.add(trashDir.path)
+			self.assertTrue(reaper.wait(10))
+		self.assertEqual((reaper.bytesFreed, len(sleeps), reaper.errors), (1024*1024, 4, []))
+		self.assertTrue(0.9 < sleeps[-1] <= 1)
+		self.assertEqual(trashDir.batchDirPaths, [])
+	def testTrashedWhileReaping(self):
+		trashDir = TrashDir(os.path.join(self.dataDirPath, "trash"))
+		reaper = TrashReaper(rate=1024)
+		def sleep(seconds):
+			# Another deletion into the same trash dir, while the first one is being reaped.
+			if len(sleeps) == 0:
+				self.writeDataFiles(["later.dat"])
+				trashDir.move([os.path.join(self.dataDirPath, "later.dat")])
+				reaper.add(trashDir.path)
+			sleeps.append(seconds)
+		sleeps = []
+		reaper.sleep = sleep
+		self.writeDataFiles(["first.dat"])
+		trashDir.move([os.path.join(self.dataDirPath, "first.dat")])
+		reaper.add(trashDir.path)
+		self.assertTrue(reaper.wait(10))
+		self.assertEqual((trashDir.batchDirPaths, reaper.bytesFreed), ([], 2*1024))
+	def testResumeDeletion(self):
+		capp = self.makeCapp()
+		self.assertFalse(capp.resumeDeletion())
+		self.writeDataFiles(["blocks/blk00000.dat"])
+		TrashDir(os.path.join(self.dataDirPath, ".cappman-trash")).move([os.path.join(self.dataDirPath, "blocks")])
+		self.assertTrue(capp.resumeDeletion())
+		self.assertTrue(TrashReaper.shared().wait(10))
+		self.assertEqual(os.listdir(os.path.join(self.dataDirPath, ".cappman-trash")), [])
+
+#==========================================================
+class SeedDatadirTest(CappTestCase):
+	def testSeed(self):
+		self.writeDataFiles(["blocks/blk00000.dat", "blocks/blk00001.dat", "blocks/rev00000.dat", "blocks/rev00001.dat",\
+			"blocks/index/000003.ldb", "blocks/index/CURRENT", "chainstate/000005.ldb", "peers.dat", "wallet.dat",\
+			"database/log.0000000001"])
+		source = self.makeCapp()
+		targetDataDirPath = os.path.join(self.tempDirPath, "target")
+		os.makedirs(targetDataDirPath)
+		target = self.makeCapp(dataDirPath=targetDataDirPath)
+		with mock.patch.object(FileCloner, "reflink", return_value=False):
+			report = target.seedDatadir(source)
+			self.assertEqual(report, {"reflink": 0, "hardlink": 3, "copy": 4, "bytes": 7*1024})
+			self.assertEqual(sorted(os.listdir(targetDataDirPath)), ["blocks", "chainstate"])
+			inode = lambda dataDirPath, path: os.stat(os.path.join(dataDirPath, path)).st_ino
+			self.assertEqual(inode(targetDataDirPath, "blocks/blk00000.dat"), inode(self.dataDirPath, "blocks/blk00000.dat"))
+			self.assertNotEqual(inode(targetDataDirPath, "blocks/blk00001.dat"), inode(self.dataDirPath, "blocks/blk00001.dat"))
+			with self.assertRaises(DataDirError) as context:
+				target.seedDatadir(source)
+			self.assertEqual(context.exception.code, DataDirError.codes.TARGET_EXISTS)
+			self.assertEqual(target.seedDatadir(source, replace=True)["hardlink"], 3)
+		with open(source.pidFilePath, "w") as pidFile:
+			pidFile.write(str(os.getpid()))
+		with self.assertRaises(DataDirError) as context:
+			target.seedDatadir(source, replace=True)
+		self.assertEqual(context.exception.code, DataDirError.codes.DAEMON_RUNNING)
+		self.assertTrue(TrashReaper.shared().wait(10))
+	def testSeedChain(self):
+		self.writeDataFiles(["testnet3/blocks/blk00000.dat", "testnet3/chainstate/000005.ldb"])
+		targetDataDirPath = os.path.join(self.tempDirPath, "target")
+		os.makedirs(targetDataDirPath)
+		self.writeDataFiles(["testnet3/blocks/blk00007.dat"], dataDirPath=targetDataDirPath)
+		source, target = self.makeCapp(), self.makeCapp(dataDirPath=targetDataDirPath)
+		for capp in [source, target]:
+			with open(os.path.join(capp.config.dataDirPath, "testnet.conf"), "w") as confFile:
+				confFile.write("testnet=1\n")
+			capp.config.configFileName = "testnet.conf"
+		self.assertEqual(target.chainDataDirPath, os.path.join(targetDataDirPath, "testnet3"))
+		# Nothing to seed from: what the target has is left alone.
+		shutil.move(os.path.join(self.dataDirPath, "testnet3"), os.path.join(self.dataDirPath, "elsewhere"))
+		with self.assertRaises(DataDirError) as context:
+			target.seedDatadir(source, replace=True)
+		self.assertEqual(context.exception.code, DataDirError.codes.SOURCE_EMPTY)
+		self.assertEqual(os.listdir(os.path.join(targetDataDirPath, "testnet3", "blocks")), ["blk00007.dat"])
+		shutil.move(os.path.join(self.dataDirPath, "elsewhere"), os.path.join(self.dataDirPath, "testnet3"))
+		self.assertEqual(target.seedDatadir(source, replace=True)["bytes"], 2*1024)
+		self.assertEqual(sorted(os.listdir(os.path.join(targetDataDirPath, "testnet3"))), ["blocks", "chainstate"])
+		self.assertEqual(os.listdir(os.path.join(targetDataDirPath, "testnet3", "blocks")), ["blk00000.dat"])
+		self.assertTrue(TrashReaper.shared().wait(10))
+	def testIncompatible(self):
+		self.writeDataFiles(["blocks/blk00000.dat"])
+		targetDataDirPath = os.path.join(self.tempDirPath, "target")
+		os.makedirs(targetDataDirPath)
+		target = self.makeCapp(dataDirPath=targetDataDirPath)
+		sources = [self.makeCapp(cappClass=DashCapp), self.makeCapp(), self.makeCapp()]
+		sources[1].config.cappFlavorName = "othercoin"
+		self.writeConf(["testnet=1"], fileName="testnet.conf")
+		sources[2].config.configFileName = "testnet.conf"
+		self.assertEqual([source.chainName for source in sources], ["main", "main", "test"])
+		for source in sources:
+			with self.assertRaises(DataDirError) as context:
+				target.seedDatadir(source)
+			self.assertEqual(context.exception.code, DataDirError.codes.INCOMPATIBLE)
+		self.assertEqual(os.listdir(targetDataDirPath), [])
+
+#==========================================================
+class StreamingProcessTest(unittest.TestCase):
+	def testLines(self):
+		process = Process(["sh", "-c", "printf 'line1\\nline2\\n'; echo err >&2; printf 0123456789; exit 3"])
+		self.assertEqual(list(process.iterLines(maxLineLength=4)), [b"line", b"1\n", b"line", b"2\n", b"0123", b"4567", b"89"])
+		self.assertEqual(process.process.returncode, 3)
+		self.assertEqual(process.waitAndGetOutput(), (b"", b"err\n"))
+	def testBigStderr(self):
+		script = "import sys; sys.stderr.write('e'*(1 << 20)); sys.stderr.flush(); sys.stdout.write('o'*(1 << 20))"
+		process = Process([sys.executable, "-c", script])
+		self.assertEqual(sum([len(chunk) for chunk in process.iterChunks(timeout=10)]), 1 << 20)
+		self.assertEqual(len(process.waitAndGetStderr()), Process.stderrTailSize)
+	def testStderrWhileSuspended(self):
+		script = "import sys; print('started', flush=True); sys.stderr.write('e'*(1 << 20)); sys.stderr.flush()"
+		process = Process([sys.executable, "-c", script])
+		lines = process.iterLines(timeout=10)
+		self.assertEqual(next(lines), b"started\n")
+		# The process gets to finish while the caller is still busy with the first line.
+		process.process.wait(timeout=5)
+		self.assertEqual(list(lines), [])
+		self.assertEqual(len(process.waitAndGetStderr()), Process.stderrTailSize)
+	def testDeadlineAndEarlyStop(self):
+		startTime = time.monotonic()
+		process = Process(["sh", "-c", "echo started; sleep 10"])
+		with self.assertRaises(subprocess.TimeoutExpired):
+			for line in process.iterLines(timeout=0.2):
+				self.assertEqual(line, b"started\n")
+		self.assertLess(time.monotonic()-startTime, 5)
+		self.assertIsNotNone(process.process.returncode)
+		process = Process(["yes"])
+		lines = process.iterLines()
+		self.assertEqual([next(lines) for count in range(0, 3)], [b"y\n"]*3)
+		lines.close()
+		self.assertIsNotNone(process.process.returncode)
+
+#==========================================================
+class JsonStreamTest(RpcServerTestCase):
+	def chunked(self, document, chunkSize):
+		data = json.dumps(document).encode()
+		return [data[start:start+chunkSize] for start in range(0, len(data), chunkSize)]
+	def testDecoder(self):
+		entries = [{"a": index, "b": "\u00e9\\\"]}"*index, "c": [{"d": None}, 1.5e3]} for index in range(0, 50)]
+		document = {"id": 1, "result": entries, "error": None}
+		for chunkSize in [1, 7, 4096]:
+			decoder = JsonStreamDecoder(self.chunked(document, chunkSize), path=["result"])
+			self.assertEqual(list(decoder), entries)
+			self.assertEqual(decoder.others, {("id",): 1, ("error",): None})
+		decoder = JsonStreamDecoder(self.chunked({"x": entries[3]}, 3), fields=["a", "c"])
+		self.assertEqual(list(decoder), [("x", {"a": 3, "c": [{"d": None}, 1.5e3]})])
+		decoder = JsonStreamDecoder(self.chunked({"result": None, "error": {"code": -1}}, 2), path=["result"])
+		self.assertEqual(list(decoder), [])
+		self.assertEqual(decoder.others[("error",)], {"code": -1})
+		# Numbers split right after their sign, "." or "e" aren't taken for shorter ones.
+		for chunks, values in [([b'{"result": [1.', b'5]}'], [1.5]), ([b'{"result": [1e', b'5]}'], [1e5]),\
+			([b'{"result": [-', b'1', b'2]}'], [-12]), ([b'{"result": [0', b'.5e', b'-3, 2]}'], [0.0005, 2])]:
+			self.assertEqual(list(JsonStreamDecoder(chunks, path=["result"])), values)
+		for malformed in [b'[1, 2', b'[1 2]', b'{"a": }', b'[1] 2', b'', b'[01]', b'[1.]']:
+			with self.assertRaises(ValueError):
+				list(JsonStreamDecoder([malformed]))
+	def testIterCall(self):
+		entries = [{"txid": str(index)*64, "vout": index} for index in range(0, 1000)]
+		warmup = {"remaining": 1}
+		def listEntries(params):
+			if warmup["remaining"] > 0:
+				warmup["remaining"] -= 1
+				raise RpcResponseError("listentries", -28, "Loading block index...")
+			return entries
+		self.server.methods["listentries"] = listEntries
+		self.writeConf(["rpcuser=testuser", "rpcpassword=testpassword", "rpcport={port}".format(port=self.server.port)])
+		capp = self.makeCapp()
+		capp.retryPolicy = RetryPolicy(initialDelay=0.01, deadline=5, classification={-28: RetryPolicy.RETRY})
+		self.assertEqual(list(capp.iterCall("listentries", fields=["vout"])), [{"vout": entry["vout"]} for entry in entries])
+		# Stopping early doesn't leave the rest of the response to be taken for the next answer.
+		iterator = capp.iterCall("listentries")
+		self.assertEqual(next(iterator), entries[0])
+		iterator.close()
+		self.assertEqual(capp.call("getblockcount"), 1234)
+		# Other calls go ahead while a response is being streamed.
+		blockCounts = [capp.call("getblockcount") for entry in capp.iterCall("listentries")]
+		self.assertEqual(blockCounts, [1234]*len(entries))
+		with self.assertRaises(RpcResponseError):
+			list(capp.iterCall("nosuchmethod"))
+	def testIterCallCli(self):
+		self.writeCli('case "$*" in *" list") echo \'{"a": [1, 2], "b": {"c": 3}}\';; *) echo "error code: -32601" >&2; exit 1;; esac')
+		capp = self.makeCapp(rpcTransport="cli")
+		self.assertEqual(list(capp.iterCall("list")), [("a", [1, 2]), ("b", {"c": 3})])
+		with self.assertRaises(RpcResponseError) as context:
+			list(capp.iterCall("other"))
+		self.assertEqual(context.exception.rpcCode, -32601)
+		# A failure after entries came in isn't retried, as that would yield them again.
+		self.writeCli('echo "[1, 2,"; echo "error code: -28" >&2; exit 1')
+		capp.retryPolicy = RetryPolicy(initialDelay=0.01, deadline=5, classification={-28: RetryPolicy.RETRY})
+		entries = []
+		with self.assertRaises(RpcResponseError):
+			for entry in capp.iterCall("list"):
+				entries.append(entry)
+		self.assertEqual(entries, [1, 2])
+
+#==========================================================
+class AsyncProcessTest(CappTestCase):
+	def testOutput(self):
+		async def run():
+			process = await AsyncProcess(["sh", "-c", "echo out; echo err >&2"]).run()
+			return await process.waitAndGetOutput()
+		self.assertEqual(asyncio.run(run()), (b"out\n", b"err\n"))
+	def testCliConcurrency(self):
+		self.writeCli("sleep 0.5; echo 42")
+		capp = self.makeCapp(rpcTransport="cli")
+		async def run():
+			return await asyncio.gather(*[capp.callCliAsync("getblockcount") for count in range(0, 10)])
+		startTime = time.monotonic()
+		self.assertEqual(asyncio.run(run()), [42]*10)
+		self.assertLess(time.monotonic()-startTime, 3)
+	def testAsyncExecutor(self):
+		# One pool of a known size for all capps, rather than the CPU bound default executor.
+		self.assertIs(self.makeCapp().asyncExecutor(), self.makeCapp(cappClass=DashCapp).asyncExecutor())
+		self.assertEqual(BitcoinCapp.asyncExecutor()._max_workers, BitcoinCapp.asyncWorkers)
+	def testCliConnectionError(self):
+		self.writeCli("echo \"error: couldn't connect to server\" >&2; exit 1")
+		capp = self.makeCapp(rpcTransport="cli")
+		with self.assertRaises(CappConnectionError):
+			asyncio.run(capp.runCliSafeAsync(["getblockcount"]))
+		with self.assertRaises(CappConnectionError):
+			capp.getBlockCount()
+
+#==========================================================
+class CappsTestCase(CappTestCase):
+	
+	#=============================
+	"""Sets up a plugin dir with a test flavor and a capp config dir to load capps from."""
+	#=============================
+	
+	def setUp(self):
+		super().setUp()
+		self.pluginDirPath = os.path.join(self.tempDirPath, "plugins")
+		self.cappConfigDirPath = os.path.join(self.tempDirPath, "capps")
+		os.makedirs(os.path.join(self.pluginDirPath, "cappflavors"))
+		os.makedirs(self.cappConfigDirPath)
+		self.writeFlavor("testflavor")
+		self.defaults = Namespace(pluginDirPaths=[self.pluginDirPath, distPluginDirPath],\
+			pluginDirNames={"cappExtensions": "cappextensions", "callFlavors": "cappflavors",\
+				"cappLibs": "capplibs", "languages": "languages"})
+	
+	def writeFlavor(self, name, cappLibName="bitcoin", dataDirPath=None):
+		fileConfig = configparser.ConfigParser()
+		fileConfig["main"] = {"capplib": cappLibName}
+		fileConfig["names"] = {"configfilename": "test.conf"}
+		fileConfig["paths"] = {"cli": self.cliExecPath, "daemon": self.daemonExecPath,\
+			"datadir": self.dataDirPath if dataDirPath is None else dataDirPath}
+		with open(os.path.join(self.pluginDirPath, "cappflavors", name), "w") as flavorFile:
+			fileConfig.write(flavorFile)
+	
+	def writeCappConfig(self, name, flavorName="testflavor"):
+		fileConfig = configparser.ConfigParser()
+		fileConfig["main"] = {"cappflavor": flavorName, "name": name}
+		with open(os.path.join(self.cappConfigDirPath, name+".conf"), "w") as configFile:
+			fileConfig.write(configFile)
+	
+	def makeCapps(self, **kwargs):
+		return Capps(self.cappConfigDirPath, defaults=self.defaults, **kwargs)
+
+#==========================================================
+class CappsTest(CappsTestCase):
+	def testConcurrentLoadOrder(self):
+		names = ["node{number:02d}".format(number=number) for number in range(0, 20)]
+		for name in reversed(names):
+			self.writeCappConfig(name)
+		for maxWorkers in [1, 8]:
+			capps = self.makeCapps(maxWorkers=maxWorkers).getAll()
+			self.assertEqual([capp.config.name for capp in capps], names)
+	def testLoadErrorsDontAbort(self):
+		self.writeCappConfig("a")
+		self.writeCappConfig("b", flavorName="nosuchflavor")
+		self.writeCappConfig("c")
+		capps = self.makeCapps()
+		self.assertEqual([capp.config.name for capp in capps.getAll()], ["a", "c"])
+		self.assertEqual([os.path.basename(loadResult.configFilePath) for loadResult in capps.loadErrors], ["b.conf"])
+		with self.assertRaises(CappLoadError):
+			capps.getAll(raiseErrors=True)
+
+#==========================================================
+class CappsLookupTest(CappsTestCase):
+	def setUp(self):
+		super().setUp()
+		self.writeFlavor("otherflavor", cappLibName="dash")
+		self.writeCappConfig("a")
+		self.writeCappConfig("b", flavorName="otherflavor")
+		self.writeCappConfig("c")
+		self.writeCappConfig("broken", flavorName="nosuchflavor")
+		self.loadedConfigFileNames = []
+		capps = self.makeCapps(maxWorkers=1)
+		load = capps.load
+		def countingLoad(configFilePath):
+			self.loadedConfigFileNames.append(os.path.basename(configFilePath))
+			return load(configFilePath)
+		capps.load = countingLoad
+		self.capps = capps
+	def testIterIsLazy(self):
+		cappIterator = self.capps.iter()
+		self.assertEqual(next(cappIterator).config.name, "a")
+		self.assertEqual(self.loadedConfigFileNames, ["a.conf"])
+	def testGet(self):
+		self.assertEqual(self.capps.get("c").config.name, "c")
+		self.assertEqual(self.loadedConfigFileNames, ["c.conf"])
+		with self.assertRaises(CappNotFoundError):
+			self.capps.get("nosuchcapp")
+	def testFilter(self):
+		self.assertEqual([capp.config.name for capp in self.capps.filter(flavor="testflavor")], ["a", "c"])
+		self.assertEqual([capp.config.name for capp in self.capps.filter(capplib="dash")], ["b"])
+		self.assertEqual(self.loadedConfigFileNames, ["a.conf", "c.conf", "b.conf"])
+
+#==========================================================
+class PathCheckTest(CappsTestCase):
+	def testResolutionCache(self):
+		resolutionCache = PathResolutionCache()
+		missingPath = os.path.join(self.tempDirPath, "missing")
+		with mock.patch("shutil.which", return_value=None) as which:
+			resolutions = resolutionCache.resolveAll(["no-such-cli", missingPath, self.cliExecPath, missingPath])
+			self.assertEqual(which.call_count, 2)
+			self.assertFalse(resolutions[missingPath].exists)
+			self.assertTrue(resolutions[self.cliExecPath].exists)
+			resolutionCache.resolveAll([missingPath, self.cliExecPath])
+			self.assertEqual(which.call_count, 2)
+			os.utime(self.tempDirPath, ns=(0, 0))
+			with open(missingPath, "w") as missingFile:
+				missingFile.write("")
+			self.assertTrue(resolutionCache.resolve(missingPath).exists)
+	def testFleetCheck(self):
+		for name in ["node1", "node2"]:
+			self.writeCappConfig(name)
+		capps = self.makeCapps()
+		allCapps = capps.getAll(raiseErrors=True)
+		shutil.rmtree(self.dataDirPath)
+		with mock.patch.object(BatchPathExistenceCheck, "resolutionCache", PathResolutionCache()):
+			with mock.patch.object(PathResolutionCache, "resolveUncached", autospec=True,\
+				side_effect=PathResolutionCache.resolveUncached) as resolveUncached:
+				report = capps.checkPaths(allCapps)
+		self.assertEqual(resolveUncached.call_count, 3)
+		self.assertFalse(report.ok)
+		self.assertEqual([checkedPath.owner for checkedPath in report.missing], allCapps)
+		self.assertEqual(report.forOwner(allCapps[0]).errorMessage, "datadir path: {path}".format(path=self.dataDirPath))
+
+#==========================================================
+class FanOutTest(unittest.TestCase):
+	class FakeCapp(object):
+		def __init__(self, test, name, host):
+			self.test = test
+			self.config = Namespace(name=name)
+			self.host = host
+		def call(self, method, *params):
+			with self.test.lock:
+				self.test.running[self.host] += 1
+				self.test.running["all"] += 1
+				self.test.maxRunning[self.host] = max(self.test.maxRunning.get(self.host, 0), self.test.running[self.host])
+				self.test.maxRunning["all"] = max(self.test.maxRunning.get("all", 0), self.test.running["all"])
+			time.sleep(0.02)
+			with self.test.lock:
+				self.test.running[self.host] -= 1
+				self.test.running["all"] -= 1
+			if self.config.name == "b1":
+				raise CappConnectionError("Is the daemon running?")
+			return self.config.name
+	def setUp(self):
+		import collections
+		self.lock = threading.Lock()
+		self.running = collections.Counter()
+		self.maxRunning = {}
+		self.capps = [self.FakeCapp(self, "a{number}".format(number=number), "hostA") for number in range(0, 6)]\
+			+[self.FakeCapp(self, "b{number}".format(number=number), "hostB") for number in range(0, 3)]
+	def testLimits(self):
+		fanOut = CappFanOut(self.capps, "call", ["getblockcount"], maxWorkers=3, perHostLimit=2)
+		results = fanOut.iterResults()
+		names = []
+		while True:
+			try:
+				names.append(next(results).name)
+			except StopIteration as stop:
+				summary = stop.value
+				break
+		self.assertEqual(sorted(names), sorted([capp.config.name for capp in self.capps]))
+		self.assertEqual(self.maxRunning["all"], 3)
+		self.assertLessEqual(max(self.maxRunning["hostA"], self.maxRunning["hostB"]), 2)
+		self.assertEqual(summary.status, 1)
+		self.assertEqual(summary.json["succeeded"], 8)
+		self.assertEqual(list(summary.json["failures"].keys()), ["b1"])
+		self.assertIn("CappConnectionError", summary.json["failures"]["b1"])
+	def testDuplicateNames(self):
+		capps = [self.FakeCapp(self, "b1", "hostA") for number in range(0, 2)]+[self.FakeCapp(self, "a1", "hostB")]
+		for number, capp in enumerate(capps[:2]):
+			capp.configSetup = Namespace(configFilePaths=["/dir{number}/b1.conf".format(number=number)])
+		summary = CappFanOut(capps, "call", ["getblockcount"]).run()
+		self.assertEqual(sorted([result.key for result in summary.item]), ["/dir0/b1.conf", "/dir1/b1.conf", "a1"])
+		self.assertEqual(sorted(summary.json["failures"].keys()), ["/dir0/b1.conf", "/dir1/b1.conf"])
+	def testUnknownCommand(self):
+		with self.assertRaises(CappCommandUnknownError):
+			CappFanOut(self.capps, "selfdestruct")
+
+#==========================================================
+class StatusTest(CappsTestCase):
+	def testCappStatus(self):
+		self.writeCli("echo 42")
+		capp = self.makeCapp()
+		self.assertEqual(capp.status(), Namespace(running=False, height=None, state="stopped", masternode=None))
+		with open(capp.pidFilePath, "w") as pidFile:
+			pidFile.write(str(os.getpid()))
+		self.assertEqual(capp.status(), Namespace(running=True, height=42, state="ok", masternode=None))
+	def testFleetStatus(self):
+		self.writeFlavor("otherflavor")
+		heights = {"a": 100, "b": 90, "c": None, "d": 7}
+		for name in sorted(heights.keys()):
+			self.writeCappConfig(name, flavorName="otherflavor" if name == "d" else "testflavor")
+		def status(capp):
+			height = heights[capp.config.name]
+			return Namespace(running=not height is None, height=height, state="stopped" if height is None else "ok",\
+				masternode=None)
+		capps = self.makeCapps()
+		allCapps = capps.getAll(raiseErrors=True)
+		# Loaded capplibs are modules of their own; patch the class the capps actually are.
+		with mock.patch.object(type(allCapps[0]), "status", autospec=True, side_effect=status):
+			rows = capps.iterStatus(capps=allCapps)
+			names = []
+			while True:
+				try:
+					names.append(next(rows).name)
+				except StopIteration as stop:
+					summary = stop.value
+					break
+		self.assertEqual(sorted(names), ["a", "b", "c", "d"])
+		self.assertEqual(summary["bestHeights"], {"testflavor": 100, "otherflavor": 7})
+		self.assertEqual(summary["lagging"], {"b": 10})
+		self.assertEqual(summary["running"], 3)
+		row = Namespace(name="b", flavor="testflavor", capplib="bitcoin", running=True, height=90, lag=10, state="ok",\
+			masternode=None)
+		self.assertEqual(CappStatusTable.formatRow(row).split(), ["b", "testflavor", "bitcoin", "True", "90", "10", "ok", "-"])
+
+#==========================================================
+class DedupTest(CappsTestCase):
+	def testDedup(self):
+		otherDataDirPath = os.path.join(self.tempDirPath, "otherdatadir")
+		os.makedirs(otherDataDirPath)
+		self.writeFlavor("otherflavor", dataDirPath=otherDataDirPath)
+		self.writeCappConfig("a")
+		self.writeCappConfig("b", flavorName="otherflavor")
+		contents = {self.dataDirPath: [b"x", b"y", b"z"], otherDataDirPath: [b"x", b"w", b"z"]}
+		for dataDirPath, blockFileContents in contents.items():
+			os.makedirs(os.path.join(dataDirPath, "blocks"))
+			for number, content in enumerate(blockFileContents):
+				with open(os.path.join(dataDirPath, "blocks", "blk{number:05d}.dat".format(number=number)), "wb") as blockFile:
+					blockFile.write(content*8192)
+		capps = self.makeCapps()
+		inode = lambda dataDirPath, number: os.stat(os.path.join(dataDirPath, "blocks",\
+			"blk{number:05d}.dat".format(number=number))).st_ino
+		with mock.patch.object(FileCloner, "reflink", return_value=False):
+			report = capps.dedupBlockFiles(dryRun=True)["bitcoin"]
+			self.assertEqual((report["checked"], report["replaced"], report["hardlink"]), (4, 1, 0))
+			self.assertNotEqual(inode(self.dataDirPath, 0), inode(otherDataDirPath, 0))
+			report = capps.dedupBlockFiles()["bitcoin"]
+		self.assertEqual((report["checked"], report["replaced"], report["hardlink"]), (4, 1, 1))
+		self.assertGreaterEqual(report["bytesReclaimed"], 8192)
+		self.assertEqual(inode(self.dataDirPath, 0), inode(otherDataDirPath, 0))
+		self.assertNotEqual(inode(self.dataDirPath, 1), inode(otherDataDirPath, 1))
+		self.assertNotEqual(inode(self.dataDirPath, 2), inode(otherDataDirPath, 2)) # The latest ones are left alone.
+		self.assertEqual(capps.dedupBlockFiles()["bitcoin"]["replaced"], 0)
+	def testReplaceFailure(self):
+		blocksDirPath = os.path.join(self.dataDirPath, "blocks")
+		self.writeDataFiles(["blocks/blk00000.dat", "blocks/blk00001.dat"])
+		deduplicator = FileDeduplicator(fileCloner=FileCloner(reflinks=False))
+		paths = [os.path.join(blocksDirPath, fileName) for fileName in ["blk00000.dat", "blk00001.dat"]]
+		with mock.patch("os.replace", side_effect=OSError("interrupted")):
+			with self.assertRaises(OSError):
+				deduplicator.run(paths)
+		# Nothing's left behind, and the next run goes through.
+		self.assertEqual(sorted(os.listdir(blocksDirPath)), ["blk00000.dat", "blk00001.dat"])
+		self.assertEqual(deduplicator.run(paths)["hardlink"], 1)
+		self.assertEqual(os.stat(paths[0]).st_ino, os.stat(paths[1]).st_ino)
+
+#==========================================================
+class ManagerTest(CappsTestCase):
+	def setUp(self):
+		super().setUp()
+		self.writeCli("echo 42")
+		self.writeCappConfig("node1")
+		self.socketPath = os.path.join(self.tempDirPath, "manager.sock")
+		self.manager = Manager(capps=self.makeCapps())
+		self.manager.reload()
+		self.manager.addHandler("count", lambda upTo: iter(range(0, upTo)))
+		self.server = ManagerServer(self.socketPath, self.manager)
+		threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.close()
+		super().tearDown()
+	def testRequests(self):
+		with ManagerClient(self.socketPath) as client:
+			self.assertEqual(client.request("ping")["capps"], 1)
+			self.assertEqual(client.request("capps"), [{"name": "node1", "flavor": "testflavor", "capplib": "bitcoin"}])
+			self.assertEqual(client.request("call", capp="node1", method="getblockcount"), 42)
+			self.assertEqual(list(client.stream("count", upTo=3)), [0, 1, 2])
+			results = client.stream("run", command="call", args=["getblockcount"])
+			self.assertEqual([(item["capp"], item["result"]) for item in results], [("node1", 42)])
+			self.assertEqual(client.request("run", command="call", args=["getblockcount"], name="nosuchcapp"),\
+				{"succeeded": 0, "failed": 0, "failures": {}})
+			with self.assertRaises(ManagerError) as context:
+				client.request("call", capp="nosuchcapp", method="getblockcount")
+			self.assertEqual(context.exception.code, ManagerError.codes.REMOTE_ERROR)
+			self.assertEqual(client.request("ping")["capps"], 1) # The connection is still usable.
+	def testReload(self):
+		os.makedirs(os.path.join(self.pluginDirPath, "capplibs"))
+		def writeCappLib(marker):
+			with open(os.path.join(self.pluginDirPath, "capplibs", "capplib_testlib.py"), "w") as moduleFile:
+				moduleFile.write("from plugins.capplibs.capplib_bitcoin import *\n"\
+					"class Capp(BitcoinCapp):\n\tmarker = {marker!r}\n".format(marker=marker))
+		writeCappLib("before")
+		self.writeFlavor("testflavor", cappLibName="testlib")
+		self.manager.reload()
+		self.assertEqual(self.manager.getCapp("node1").marker, "before")
+		# Edited flavors and capplibs are picked up.
+		otherDataDirPath = os.path.join(self.tempDirPath, "otherdatadir")
+		os.makedirs(otherDataDirPath)
+		self.writeFlavor("testflavor", cappLibName="testlib", dataDirPath=otherDataDirPath)
+		writeCappLib("after!") # Of another size, should the mtime not change in between.
+		self.manager.reload()
+		capp = self.manager.getCapp("node1")
+		self.assertEqual((capp.marker, capp.config.dataDirPath), ("after!", otherDataDirPath))
+		self.assertIs(type(capp).__mro__[1], BitcoinCapp)
+	def testReloadIndirectlyImported(self):
+		# A capplib building on another one, which it imports the regular way.
+		cappLibDirPath = os.path.join(self.pluginDirPath, "capplibs")
+		os.makedirs(cappLibDirPath)
+		def writeBaseCappLib(marker):
+			with open(os.path.join(cappLibDirPath, "capplib_testbase.py"), "w") as moduleFile:
+				moduleFile.write("from plugins.capplibs.capplib_bitcoin import *\n"\
+					"class TestBaseCapp(BitcoinCapp):\n\tmarker = {marker!r}\n".format(marker=marker))
+		writeBaseCappLib("before")
+		with open(os.path.join(cappLibDirPath, "capplib_testlib.py"), "w") as moduleFile:
+			moduleFile.write("from capplibs.capplib_testbase import *\nCapp = TestBaseCapp\n")
+		self.writeFlavor("testflavor", cappLibName="testlib")
+		with mock.patch.object(sys, "path", sys.path+[self.pluginDirPath]), mock.patch.dict(sys.modules):
+			self.manager.reload()
+			self.assertEqual(self.manager.getCapp("node1").marker, "before")
+			writeBaseCappLib("after!") # Of another size, should the mtime not change in between.
+			self.manager.reload()
+			self.assertEqual(self.manager.getCapp("node1").marker, "after!")
+	def testReloadedReadinessProbe(self):
+		capp = self.manager.getCapp("node1")
+		self.manager.reload()
+		reloadedCapp = self.manager.getCapp("node1")
+		self.assertIsNot(reloadedCapp, capp)
+		self.assertIs(reloadedCapp.readinessProbe.probe.__self__, reloadedCapp)
+	def testReloadSelected(self):
+		self.writeCappConfig("node2")
+		self.assertEqual(self.manager.reload(name="node2")["loaded"], ["node2"])
+		self.assertEqual(self.manager.handle("call", {"capp": "node2", "method": "getblockcount"}), 42)
+		shutil.rmtree(self.cappConfigDirPath)
+		self.assertEqual(self.manager.reload(), {"loaded": [], "errors": []})
+	def testNotRunning(self):
+		with self.assertRaises(ManagerError) as context:
+			ManagerClient(os.path.join(self.tempDirPath, "missing.sock")).request("ping")
+		self.assertEqual(context.exception.code, ManagerError.codes.NOT_RUNNING)
+		with self.assertRaises(ManagerError) as context:
+			ManagerServer(self.socketPath, self.manager)
+		self.assertEqual(context.exception.code, ManagerError.codes.ALREADY_RUNNING)
+
+#==========================================================
+class CappResolverTest(CappsTestCase):
+	def testResolvedOnce(self):
+		for number in range(0, 10):
+			self.writeCappConfig("node{number}".format(number=number))
+		pluginLoads = []
+		def countingLoad(originalLoad):
+			def load(plugin, *args, **kwargs):
+				pluginLoads.append(type(plugin).__name__)
+				return originalLoad(plugin, *args, **kwargs)
+			return load
+		with mock.patch.object(ConfigPlugin, "load", countingLoad(ConfigPlugin.load)),\
+			mock.patch.object(PythonLibPlugin, "load", countingLoad(PythonLibPlugin.load)):
+			capps = self.makeCapps().getAll()
+		self.assertEqual(len(capps), 10)
+		self.assertEqual(sorted(pluginLoads), ["CappFlavorPlugin", "CappFlavorPlugin", "CappLibPlugin"])
+		# Every capp still gets a config of its own.
+		self.assertEqual(len(set([id(capp.config) for capp in capps])), 10)
+		self.assertEqual([capp.config.name for capp in capps], ["node{number}".format(number=number) for number in range(0, 10)])
+
+#==========================================================
+class PluginIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.tempDirPath = tempfile.mkdtemp()
+		self.pluginDirPaths = [os.path.join(self.tempDirPath, "first"), os.path.join(self.tempDirPath, "second")]
+		for pluginDirPath in self.pluginDirPaths:
+			os.makedirs(os.path.join(pluginDirPath, "cappflavors"))
+			self.writePlugin(pluginDirPath, "cappflavors", "shared")
+		self.writePlugin(self.pluginDirPaths[1], "cappflavors", "secondonly")
+		os.makedirs(os.path.join(self.pluginDirPaths[1], "capplibs", "__pycache__"))
+		self.writePlugin(self.pluginDirPaths[1], "capplibs", "capplib_test.py")
+	def tearDown(self):
+		PluginIndex.manifestCache = None
+		shutil.rmtree(self.tempDirPath)
+	def writePlugin(self, pluginDirPath, kind, fileName):
+		with open(os.path.join(pluginDirPath, kind, fileName), "w") as pluginFile:
+			pluginFile.write("")
+	def testPrecedenceAndLookup(self):
+		index = PluginIndex(self.pluginDirPaths)
+		self.assertEqual(index.find("cappflavors", "shared").dirPath, os.path.join(self.pluginDirPaths[0], "cappflavors"))
+		self.assertEqual(index.find("cappflavors", "secondonly").precedence, 1)
+		self.assertEqual(index.names("capplibs"), ["test"])
+		self.assertEqual(index.dirPaths("capplibs"), [os.path.join(self.pluginDirPaths[1], "capplibs")])
+		self.assertIsNone(index.find("cappflavors", "missing"))
+	def testManifestAndRefresh(self):
+		PluginIndex.manifestCache = PluginManifestCache(os.path.join(self.tempDirPath, "manifests"))
+		PluginIndex(self.pluginDirPaths)
+		with mock.patch.object(PluginIndex, "scan", wraps=None) as scan:
+			index = PluginIndex(self.pluginDirPaths)
+			self.assertEqual(scan.call_count, 0)
+		self.assertEqual(index.find("cappflavors", "secondonly").name, "secondonly")
+		self.assertFalse(index.refresh())
+		self.writePlugin(self.pluginDirPaths[0], "cappflavors", "new")
+		os.utime(os.path.join(self.pluginDirPaths[0], "cappflavors"), ns=(0, 0))
+		self.assertTrue(index.refresh())
+		self.assertEqual(index.find("cappflavors", "new").precedence, 0)
+	def testConfigPluginFallsBackToLaterDirs(self):
+		plugin = ConfigPlugin([os.path.join(pluginDirPath, "cappflavors") for pluginDirPath in self.pluginDirPaths],\
+			"secondonly", configSetup=ConfigSetup())
+		plugin.load()
+		self.assertEqual(plugin.config, Config())
+
+#==========================================================
+class PythonLibPluginTest(unittest.TestCase):
+	def setUp(self):
+		self.tempDirPath = tempfile.mkdtemp()
+		self.dirPaths = [os.path.join(self.tempDirPath, "first"), os.path.join(self.tempDirPath, "second")]
+		for dirPath in self.dirPaths:
+			os.makedirs(dirPath)
+			self.writeModule(dirPath, "capplib_same", "origin = {dirPath!r}".format(dirPath=dirPath))
+		self.writeModule(self.dirPaths[1], "capplib_broken", "raise RuntimeError('executed')")
+	def tearDown(self):
+		shutil.rmtree(self.tempDirPath)
+	def writeModule(self, dirPath, moduleName, code):
+		with open(os.path.join(dirPath, moduleName+".py"), "w") as moduleFile:
+			moduleFile.write(code+"\n")
+	def testLoadByPath(self):
+		sysPath = list(sys.path)
+		plugins = [PythonLibPlugin([dirPath], "same") for dirPath in self.dirPaths+self.dirPaths[:1]]
+		for plugin in plugins:
+			plugin.load()
+		self.assertEqual(sys.path, sysPath)
+		self.assertEqual([plugin.module.origin for plugin in plugins], self.dirPaths+self.dirPaths[:1])
+		self.assertIs(plugins[0].module, plugins[2].module)
+	def testOneModulePerCappLib(self):
+		# Capplibs building on others import them the regular way; loading them as plugins mustn't
+		# make second copies, with classes (and class level state) of their own.
+		plugins = [PythonLibPlugin([os.path.join(distPluginDirPath, "capplibs")], name) for name in ["dash", "bitcoin"]]
+		for plugin in plugins:
+			plugin.load()
+		self.assertIs(plugins[0].module.DashCapp, DashCapp)
+		self.assertIs(plugins[1].module.BitcoinCapp, BitcoinCapp)
+		self.assertIs(plugins[0].module.BitcoinCapp, BitcoinCapp)
+		self.assertIs(sys.modules["plugins.capplibs.capplib_bitcoin"], plugins[1].module)
+	def testLazyLoad(self):
+		plugin = PythonLibPlugin(self.dirPaths, "broken")
+		plugin.load(lazy=True)
+		with self.assertRaises(RuntimeError):
+			plugin.module
+
+#==========================================================
+class CompiledConfigSetupTest(unittest.TestCase):
+	def setUp(self):
+		self.tempDirPath = tempfile.mkdtemp()
+		self.configSetup = ConfigSetup()
+		self.configSetup.addOption(ConfigOption("test", argName="--test", configName="testkey", category="Test"))
+		self.configSetup.addOption(ConfigOption("other", configName="OtherKey", category="Other", defaultValue="x"))
+	def tearDown(self):
+		shutil.rmtree(self.tempDirPath)
+	def testIndexes(self):
+		compiled = self.configSetup.compiled
+		self.assertEqual(list(compiled.byArgName.keys()), ["--test"])
+		self.assertEqual(sorted(compiled.byConfigKey.keys()), [("Other", "otherkey"), ("Test", "testkey")])
+		self.assertEqual(list(self.configSetup.commandLineOptions.keys()), ["test"])
+		with self.assertRaises(TypeError):
+			compiled.byVarName["new"] = None
+		self.configSetup.addOption(ConfigOption("new", configName="new"))
+		self.assertIn("new", self.configSetup.compiled.byVarName)
+	def testFileResolution(self):
+		configFilePath = os.path.join(self.tempDirPath, "test.conf")
+		with open(configFilePath, "w") as configFile:
+			configFile.write("[Test]\ntestkey=a\nunknown=b\n[Other]\notherkey=c\n[Unknown]\ntestkey=d\n")
+		config = self.configSetup.getConfig(configFilePaths=[configFilePath])
+		self.assertEqual((config.test, config.other), ("a", "c"))
+		self.assertFalse(hasattr(config, "unknown"))
+
+#==========================================================
+class ConfigOptionTest(unittest.TestCase):
+	def testCompactAndLazy(self):
+		with mock.patch.object(lib.configutils.lang, "gettext", side_effect=lambda string, formatDict={}: string) as gettext:
+			options = [ConfigOption("test{number}".format(number=number), configName="test") for number in range(0, 100)]
+			self.assertEqual(gettext.call_count, 0)
+			self.assertFalse(hasattr(options[0], "__dict__"))
+			self.assertIs(options[0].configName.kind, options[1].configName.kind)
+			self.assertIn("Name in a configuration file context", options[0].createConfiguredNamesErrorListing())
+			self.assertEqual(sorted(options[0].configuredParameters.keys()), ["configName", "varName"])
+		with self.assertRaises(lib.configutils.ConfigOptionUnassignedError):
+			ConfigOption("test", enforceAssignment=True).validate(None)
+
+#==========================================================
+class LocalizationTest(unittest.TestCase):
+	def setUp(self):
+		self.localeDirPath = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.localeDirPath)
+	def testCatalogCache(self):
+		with mock.patch("gettext.translation", side_effect=FileNotFoundError) as translation:
+			langs = [Lang("testdomain", localeDirPath=self.localeDirPath) for number in range(0, 3)]
+			self.assertEqual(translation.call_count, 0)
+			self.assertEqual([lang.gettext("{number} test", formatDict={"number": 1}) for lang in langs], ["1 test"]*3)
+			self.assertEqual(translation.call_count, 1)
+			Lang("testdomain", localeDirPath=self.localeDirPath, language="de").gettext("test")
+			self.assertEqual(translation.call_count, 2)
+	def testLazyMessage(self):
+		lang = Lang("testdomain", localeDirPath=self.localeDirPath)
+		with mock.patch.object(lang, "gettext", wraps=lang.gettext) as gettext:
+			message = lang.lazy("{name} test", formatDict={"name": "lazy"})
+			self.assertIsInstance(message, LazyMessage)
+			self.assertEqual(gettext.call_count, 0)
+			self.assertEqual("{message}!".format(message=message), "lazy test!")
+			self.assertEqual(message+"!", "lazy test!")
+			self.assertEqual(message, "lazy test")
+			self.assertEqual(gettext.call_count, 1)
+
+#==========================================================
+class ConfigSnapshotCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.tempDirPath = tempfile.mkdtemp()
+		self.configFilePath = os.path.join(self.tempDirPath, "test.conf")
+		self.writeConfig("testconfigvalue")
+		self.configSetup = ConfigSetup()
+		self.configSetup.addOption(ConfigOption("test", configName="testconfigkey", category="Test"))
+		self.configSetup.addOption(ConfigOption("testList", configName="testlist", category="Test",\
+			optionTypes=[ConfigOptionListType()]))
+		ConfigSetup.snapshotCache = ConfigSnapshotCache(os.path.join(self.tempDirPath, "cache"))
+	def tearDown(self):
+		ConfigSetup.snapshotCache = None
+		shutil.rmtree(self.tempDirPath)
+	def writeConfig(self, value):
+		with open(self.configFilePath, "w") as configFile:
+			configFile.write("[Test]\ntestconfigkey={value}\ntestlist=[\"a\", \"b\"]\n".format(value=value))
+	def testSnapshotHit(self):
+		self.assertEqual(self.configSetup.getConfig(configFilePaths=[self.configFilePath]).test, "testconfigvalue")
+		with mock.patch.object(ConfigSetup, "putConfigFileValuesIntoConfig", side_effect=AssertionError):
+			config = self.configSetup.getConfig(configFilePaths=[self.configFilePath])
+		self.assertEqual(config.test, "testconfigvalue")
+		self.assertEqual(config.testList, ["a", "b"])
+	def testAtomicWrite(self):
+		filePath = os.path.join(self.tempDirPath, "atomic.json")
+		File(filePath).writeAtomically("before")
+		with self.assertRaises(TypeError):
+			File(filePath).writeAtomically(b"not a str")
+		self.assertEqual(File(filePath).read(), "before")
+		self.assertFalse([fileName for fileName in os.listdir(self.tempDirPath) if fileName.endswith(".tmp")])
+	def testSnapshotInvalidation(self):
+		self.configSetup.getConfig(configFilePaths=[self.configFilePath])
+		self.writeConfig("changedvalue")
+		self.assertEqual(self.configSetup.getConfig(configFilePaths=[self.configFilePath]).test, "changedvalue")
+		# A differently set up config setup doesn't get to use the other one's snapshot.
+		self.configSetup.addOption(ConfigOption("other", configName="other", category="Test", defaultValue="x"))
+		self.assertEqual(self.configSetup.getConfig(configFilePaths=[self.configFilePath]).other, "x")
+
 if __name__ == "__main__":
 	unittest.main()
\ No newline at end of file